@@ -8,4 +8,14 @@ done
 
 echo "PostgreSQL started"
 
-gunicorn -b 0.0.0.0:5000 manage:app
+# Every worker writes its metrics here, for /metrics to add up
+export METRICS_DIR=/tmp/metrics
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
+# Threaded workers, so that the open /admin/stream responses each only take
+# up an idle thread.  STREAM_MAX_SUBSCRIBERS keeps them to a few of the
+# threads.  The config opens the database connections of each worker when it
+# starts.
+gunicorn -c gunicorn_config.py -b 0.0.0.0:5000 --worker-class gthread \
+  --threads 32 manage:app
@@ -0,0 +1,37 @@
+# services/flask/gunicorn_config.py
+
+# Settings for gunicorn, which serves the app in production
+# (see entrypoint-prod.sh).
+
+import os
+
+
+def post_worker_init(worker):
+    """Open the worker's database connections before it takes requests, and
+    have it replaced once its memory passes its watermark"""
+    from project import memory_monitor
+    from project.pool import prewarm
+    opened = prewarm(worker.wsgi)
+    if opened:
+        worker.log.info('Opened %d database connections', opened)
+
+    def recycle():
+        # what gunicorn does after max_requests: the worker finishes the
+        # requests that it has, and the master starts a new one
+        worker.alive = False
+    memory_monitor.watch(recycle)
+
+
+def worker_exit(server, worker):
+    """Write the metrics and the access log of a worker that is exiting"""
+    from project import access_log, metrics
+    metrics.flush(worker.wsgi)
+    access_log.stop()
+
+
+def child_exit(server, worker):
+    """Keep the counters of a worker that has exited, in the master"""
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        from project.metrics import mark_process_dead
+        mark_process_dead(directory, worker.pid)
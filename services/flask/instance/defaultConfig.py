@@ -13,6 +13,197 @@ class BaseConfig:
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     BCRYPT_LOG_ROUNDS = 13
 
+    # JSON encoder used for API responses: 'orjson', 'json' (stdlib) or
+    # 'auto', which picks orjson when it is installed.
+    JSON_BACKEND = 'auto'
+
+    # The pool of database connections of each process (see
+    # project/pool.py).  Every thread of a gunicorn worker may need a
+    # connection, so SQLALCHEMY_POOL_SIZE plus SQLALCHEMY_MAX_OVERFLOW should
+    # be about the number of threads, and the total over every process must
+    # stay below the server's max_connections.  Connections are replaced
+    # after SQLALCHEMY_POOL_RECYCLE seconds, before firewalls and load
+    # balancers drop them, and tested with a ping when they're checked out
+    # if SQLALCHEMY_POOL_PRE_PING is set.  Each gunicorn worker opens
+    # SQLALCHEMY_POOL_PREWARM connections when it starts.  Statements that
+    # run for longer than SQLALCHEMY_STATEMENT_TIMEOUT seconds are canceled,
+    # which includes migrations and the manage.py commands.
+    SQLALCHEMY_POOL_SIZE = 10
+    SQLALCHEMY_MAX_OVERFLOW = 22
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    SQLALCHEMY_POOL_PREWARM = 0
+    SQLALCHEMY_STATEMENT_TIMEOUT = None
+
+    # Set SQLALCHEMY_PGBOUNCER when the database URIs point at PgBouncer in
+    # transaction pooling mode.  The listeners of the cache invalidations
+    # and the change streams then connect to SQLALCHEMY_DIRECT_URI, which
+    # must be the database itself.
+    SQLALCHEMY_PGBOUNCER = False
+    SQLALCHEMY_DIRECT_URI = os.environ.get('DATABASE_DIRECT_URL')
+
+    # Count the statements, database time and rows of every request (see
+    # project/instrumentation.py).  Statements that take SQL_SLOW_QUERY_TIME
+    # seconds or more are logged with their parameters, and so are
+    # statements that one request runs SQL_REPEATED_QUERY_THRESHOLD times,
+    # which is usually an N+1 query.  SERVER_TIMING_ENABLED sends the totals
+    # in a Server-Timing header, which tells anyone how long the database
+    # took, so it's only on in development and testing.
+    SQL_INSTRUMENTATION_ENABLED = True
+    SQL_SLOW_QUERY_TIME = 0.5
+    SQL_REPEATED_QUERY_THRESHOLD = 10
+    SERVER_TIMING_ENABLED = False
+
+    # Serve the request, database, pool, cache and password hashing metrics
+    # at /metrics, for Prometheus (see project/metrics.py).  Scrapes must
+    # send METRICS_TOKEN as a bearer token if it's set.  With more than one
+    # process, each one writes its metrics to METRICS_DIR every
+    # METRICS_FLUSH_INTERVAL seconds, so that a scrape can add them up.
+    # The gunicorn hooks read METRICS_DIR from the environment too.  The
+    # metrics show how the app is used, so in production they're only
+    # served when METRICS_TOKEN is set.
+    METRICS_ENABLED = True
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5.0
+
+    # Profile single requests with a sampling profiler (see
+    # project/profiling.py), which looks at the request's stack every
+    # PROFILING_INTERVAL seconds.  With PROFILING_ENABLED, logged in clients
+    # can ask for a profile with the PROFILING_HEADER header, and fetch it
+    # from /admin/profiles.  PROFILING_SAMPLE_RATE is the fraction of all
+    # requests that are profiled anyway.  The newest PROFILING_MAX_FILES
+    # profiles are kept in PROFILING_DIR, and at most
+    # PROFILING_MAX_CONCURRENT requests of a process are profiled at once.
+    # Any user could profile the app and read its stacks, so it's off in
+    # production.
+    PROFILING_ENABLED = True
+    PROFILING_HEADER = 'X-Profile'
+    PROFILING_SAMPLE_RATE = 0.0
+    PROFILING_INTERVAL = 0.005
+    PROFILING_DIR = os.environ.get('PROFILING_DIR', '/tmp/profiles')
+    PROFILING_MAX_FILES = 500
+    PROFILING_MAX_CONCURRENT = 4
+
+    # Replace a gunicorn worker once its resident memory passes a watermark
+    # of MEMORY_RSS_LIMIT megabytes, less a random share of up to
+    # MEMORY_RSS_JITTER, so that the workers don't restart together (see
+    # project/memory.py).  MEMORY_TRACING_ENABLED traces the allocations of
+    # each process with tracemalloc, which slows it down and about doubles
+    # its memory, to find leaks: it counts how much memory each route leaves
+    # behind, and writes a snapshot to MEMORY_SNAPSHOT_DIR every
+    # MEMORY_SNAPSHOT_INTERVAL seconds.  /admin/memory and `manage.py
+    # memory-growers` compare the first and the latest snapshot of a process.
+    # The snapshots of the last MEMORY_MAX_SNAPSHOT_PROCESSES processes are
+    # kept.
+    MEMORY_RSS_LIMIT = 512
+    MEMORY_RSS_JITTER = 0.1
+    MEMORY_TRACING_ENABLED = False
+    MEMORY_TRACING_FRAMES = 10
+    MEMORY_SNAPSHOT_DIR = os.environ.get('MEMORY_SNAPSHOT_DIR', '/tmp/memory')
+    MEMORY_SNAPSHOT_INTERVAL = 300
+    MEMORY_MAX_SNAPSHOT_PROCESSES = 10
+
+    # Log every request as a line of JSON to ACCESS_LOG_FILE, or to stdout
+    # (see project/access_log.py).  A thread writes the log, and when
+    # ACCESS_LOG_QUEUE_SIZE records are waiting for it, new ones are
+    # dropped.  ACCESS_LOG_SAMPLE_RATES maps routes to the fraction of
+    # their requests that are logged.  Errors and requests that take
+    # ACCESS_LOG_SLOW_TIME seconds or more are always logged.
+    ACCESS_LOG_ENABLED = True
+    ACCESS_LOG_FILE = os.environ.get('ACCESS_LOG_FILE')
+    ACCESS_LOG_QUEUE_SIZE = 10000
+    ACCESS_LOG_SAMPLE_RATES = {'/admin/ping': 0.01, '/metrics': 0.01}
+    ACCESS_LOG_SLOW_TIME = 1.0
+
+    # Limit the requests of each process that run at the same time, for
+    # each class of routes (see project/shedding.py).  LOAD_SHEDDING_LIMITS
+    # maps the classes to how many of their requests may run, and how many
+    # may wait for a turn, for up to LOAD_SHEDDING_QUEUE_TIMEOUT seconds.
+    # The others get a 503, and are told to retry after
+    # LOAD_SHEDDING_RETRY_AFTER to twice as many seconds.  Waiting requests
+    # take up a thread too, so the limits should add up to about the number
+    # of threads of a gunicorn worker (see entrypoint-prod.sh).  bcrypt
+    # takes a core for each password, so 'auth' should be about the number
+    # of cores.
+    LOAD_SHEDDING_ENABLED = True
+    LOAD_SHEDDING_LIMITS = {
+        'auth': (2, 4),
+        'read': (14, 4),
+        'write': (4, 2),
+        'export': (2, 0),
+    }
+    LOAD_SHEDDING_QUEUE_TIMEOUT = 1.0
+    LOAD_SHEDDING_RETRY_AFTER = 5
+
+    # Where cached values are kept: 'memory' (in each process), 'redis' (a
+    # server at CACHE_URL, like redis://localhost:6379/0) or 'postgres' (an
+    # unlogged table in the database at CACHE_URL, or in the app's database
+    # if CACHE_URL isn't set).  The migrations create the table in the app's
+    # database; run `python manage.py create-cache-table` for the one at
+    # CACHE_URL.  CACHE_MAX_SIZE is the number of keys that the memory
+    # backend keeps.
+    CACHE_BACKEND = 'memory'
+    CACHE_URL = None
+    CACHE_KEY_PREFIX = 'gta'
+    CACHE_MAX_SIZE = 10000
+
+    # Cache single rows that are loaded by id, like the user of every
+    # authenticated request, for ROW_CACHE_TTL seconds.
+    ROW_CACHE_ENABLED = False
+    ROW_CACHE_TTL = 3600
+
+    # Cache the jobs and expenses that /events returns for each date window
+    # of up to EVENTS_CACHE_MAX_DAYS days, for EVENTS_CACHE_TTL seconds.
+    EVENTS_CACHE_ENABLED = False
+    EVENTS_CACHE_TTL = 3600
+    EVENTS_CACHE_MAX_DAYS = 400
+
+    # Let identical expensive reads that run at the same time (/events and
+    # the lists of all jobs and expenses) share one set of queries.  Waiting
+    # requests give up after SINGLE_FLIGHT_TIMEOUT seconds and run the
+    # queries themselves.  SINGLE_FLIGHT_ADVISORY_LOCK coalesces the reads
+    # of different processes too, through a Postgres advisory lock and the
+    # events cache, so it only helps with a shared CACHE_BACKEND.
+    SINGLE_FLIGHT_ENABLED = False
+    SINGLE_FLIGHT_TIMEOUT = 5.0
+    SINGLE_FLIGHT_ADVISORY_LOCK = False
+
+    # Tell the other processes (gunicorn workers and containers) which
+    # cached values to drop when data changes, with Postgres NOTIFY on
+    # CACHE_INVALIDATION_CHANNEL.  Needed when the memory cache backend is
+    # used with more than one process.
+    CACHE_INVALIDATION_ENABLED = False
+    CACHE_INVALIDATION_CHANNEL = 'cache_invalidation'
+
+    # Read replicas of the database.  Routes that only read send their
+    # queries to a replica whose replication lag was at most REPLICA_MAX_LAG
+    # seconds when it was last checked, which is done every
+    # REPLICA_CHECK_INTERVAL seconds.  After a write, every read goes to the
+    # primary until the replicas must have caught up.  With more than one
+    # process, that needs CACHE_INVALIDATION_ENABLED.
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if uri]
+    REPLICA_MAX_LAG = 5.0
+    REPLICA_CHECK_INTERVAL = 1.0
+
+    # Push change notifications to the clients that hold /admin/stream open,
+    # through Postgres NOTIFY on STREAM_CHANNEL.  Streams send a comment
+    # every STREAM_HEARTBEAT seconds to keep proxies from closing them, and
+    # end after STREAM_MAX_AGE seconds, when the client reconnects and its
+    # token is checked again.  Each stream drops its oldest notifications
+    # once STREAM_QUEUE_SIZE are waiting to be sent.  Each stream takes up a
+    # worker thread, so a process only serves STREAM_MAX_SUBSCRIBERS of them,
+    # well below its number of threads, and answers the rest with a 503.
+    STREAM_ENABLED = False
+    STREAM_CHANNEL = 'changes'
+    STREAM_HEARTBEAT = 15
+    STREAM_MAX_AGE = 600
+    STREAM_QUEUE_SIZE = 100
+    STREAM_MAX_SUBSCRIBERS = 8
+
     # Length of time for which a token is valid.
     # The LONG constants are for use on devices that the user declares are
     # private, whereas the SHORT constants are for public devices.
@@ -28,6 +219,7 @@ class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     DEBUG_TB_ENABLED = True
     BCRYPT_LOG_ROUNDS = 4
+    SERVER_TIMING_ENABLED = True
 
 
 class TestingConfig(BaseConfig):
@@ -36,6 +228,9 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL')
     BCRYPT_LOG_ROUNDS = 4
+    SERVER_TIMING_ENABLED = True
+    ACCESS_LOG_ENABLED = False
+    LOAD_SHEDDING_ENABLED = False
     TOKEN_EXPIRE_DAYS_LONG = 0
     TOKEN_EXPIRE_SECONDS_LONG = 3
     TOKEN_EXPIRE_DAYS_SHORT = 0
@@ -46,3 +241,5 @@ class ProductionConfig(BaseConfig):
     """Production configuration"""
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    METRICS_ENABLED = BaseConfig.METRICS_TOKEN is not None
+    PROFILING_ENABLED = False
@@ -1,22 +1,38 @@
 # services/flask/manage.py
 
+import datetime
+import json
+import os
+import sys
 import unittest
 import coverage
 import click
+from flask import current_app
 from flask.cli import FlaskGroup
+from sqlalchemy import create_engine
 
-from project import create_app, db
+from project import create_app, db, events_cache, set_app_configuration
 from project.admin.models import User
+from project.admin.changes import prune_changes, record_reset
+from project.admin.csv_io import csv_tables, CSVImportError
+from project.admin.seed import SyntheticData
+from project.cache import cache_entries
+from project.memory import snapshot_pids, top_growers
 
 
-COV = coverage.coverage(
-    branch=True,
-    include='project/*',
-    omit=[
+COVERAGE_OPTIONS = {
+    'branch': True,
+    'include': ['project/*'],
+    'omit': [
         'project/tests/*',
-    ]
-)
-COV.start()
+        'project/benchmarks/*',
+    ],
+}
+COV = coverage.coverage(**COVERAGE_OPTIONS)
+# Only trace the code when measuring coverage.  Tracing slows everything
+# down, including the app when it is served with `gunicorn manage:app`.
+if sys.argv[1:2] == ['cov']:
+    COV.start()
 
 app = create_app()
 cli = FlaskGroup(create_app=create_app)
@@ -26,14 +42,38 @@ cli = FlaskGroup(create_app=create_app)
 def recreate_db():
     db.drop_all()
     db.create_all()
+    cache_entries.create(db.engine, checkfirst=True)
     db.session.commit()
 
-@cli.command()
-def test():
-    """ Runs the tests without code coverage"""
+@cli.command('create-cache-table')
+def create_cache_table():
+    """Creates the table of the postgres cache backend in the database at
+    CACHE_URL, or in the app's database if it isn't set."""
+    url = current_app.config['CACHE_URL']
+    engine = create_engine(url) if url else db.engine
+    cache_entries.create(engine, checkfirst=True)
+    click.echo('Created the cache_entries table.')
+
+def run_tests(workers, coverage_options=None):
+    """Runs the tests serially, or in parallel when workers isn't 1"""
+    if workers != 1:
+        from project.tests import parallel
+        return parallel.run(workers or None, verbosity=2,
+                            coverage_options=coverage_options)
     tests = unittest.TestLoader().discover('project/tests', pattern='test*.py')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
-    if result.wasSuccessful():
+    return result.wasSuccessful()
+
+workers_option = click.option(
+    '--workers', '-j', default=1,
+    help='Number of processes to run the tests in, each with its own '
+         'database. 0 uses one per CPU core.')
+
+@cli.command()
+@workers_option
+def test(workers):
+    """ Runs the tests without code coverage"""
+    if run_tests(workers):
         return 0
     return 1
 
@@ -66,12 +106,177 @@ def seed_db():
     db.session.commit()
 
 @cli.command()
-def cov():
+@click.option('--jobs', default=100000, help='Number of jobs to generate.')
+@click.option('--one-time-expenses', default=100000,
+              help='Number of one time expenses to generate.')
+@click.option('--recurring-expenses', default=1000,
+              help='Number of recurring expenses to generate.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--start-date', default=None,
+              help='Earliest date, YYYY-MM-DD. Defaults to 5 years before '
+                   'the end date.')
+@click.option('--end-date', default=None,
+              help='Latest date, YYYY-MM-DD. Defaults to 2018-12-31.')
+@click.option('--date-skew', default=2.0,
+              help='1 spreads dates uniformly, higher favours recent dates.')
+@click.option('--enum-weight', multiple=True,
+              help='Weight of an enum value, as TABLE.COLUMN=VALUE:WEIGHT. '
+                   'Can be repeated.')
+def seed_scale(jobs, one_time_expenses, recurring_expenses, seed, start_date,
+               end_date, date_skew, enum_weight):
+    """Seeds the database with large amounts of synthetic data."""
+    def parse_date(value):
+        if value:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+    enum_weights = {}
+    for option in enum_weight:
+        try:
+            key, weight = option.rsplit(':', 1)
+            column, value = key.split('=', 1)
+            table, column = column.split('.', 1)
+            enum_weights.setdefault((table, column), {})[value] = float(weight)
+        except ValueError:
+            raise click.BadParameter(option, param_hint='--enum-weight')
+    data = SyntheticData(seed, parse_date(start_date), parse_date(end_date),
+                         date_skew, enum_weights)
+    counts = {
+        'jobs': jobs,
+        'one_time_expenses': one_time_expenses,
+        'recurring_expenses': recurring_expenses,
+    }
+    for table, count in counts.items():
+        with click.progressbar(length=count, label=table) as bar:
+            loaded = [0]
+
+            def progress(total):
+                bar.update(total - loaded[0])
+                loaded[0] = total
+            data.load(table, count, progress=progress)
+        if count:
+            record_reset(table)
+        db.session.commit()
+    # drop the cached events of the running app
+    events_cache.invalidate_all()
+
+@cli.command('import')
+@click.argument('table', type=click.Choice(sorted(csv_tables)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_csv(table, path):
+    """Imports rows into a table from a CSV file."""
+    try:
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            result = csv_tables[table].import_lines(csv_file)
+        if result.imported:
+            record_reset(table)
+        db.session.commit()
+        events_cache.invalidate_all()
+    except CSVImportError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo(f'Imported {result.imported} rows.')
+    if result.rejected:
+        click.echo(f'Rejected {result.rejected} rows:')
+        for error in result.errors:
+            click.echo(f"  line {error['line']}: {error['message']}")
+
+@cli.command('prune-changes')
+@click.option('--days', default=30,
+              help='Keep the changes made in this many days.')
+def prune_changes_command(days):
+    """Deletes old entries from the change log."""
+    deleted = prune_changes(datetime.timedelta(days))
+    db.session.commit()
+    click.echo(f'Deleted {deleted} changes.')
+
+@cli.command('memory-growers')
+@click.option('--pid', type=int, default=None,
+              help='Process whose snapshots to compare.  Defaults to the '
+                   'one that wrote the latest snapshot.')
+@click.option('--limit', '-n', default=20,
+              help='Number of lines of code to show.')
+def memory_growers(pid, limit):
+    """Shows where memory grew between the first and latest snapshots of
+    a process, taken with MEMORY_TRACING_ENABLED."""
+    directory = current_app.config['MEMORY_SNAPSHOT_DIR']
+    pids = snapshot_pids(directory)
+    if not pids:
+        raise click.ClickException(f'There are no snapshots in {directory}.')
+    if pid is None:
+        pid = pids[0]
+    growers = top_growers(directory, pid, limit)
+    if growers is None:
+        raise click.ClickException(
+            f'Process {pid} does not have two snapshots.  Processes with '
+            f'snapshots: {", ".join(map(str, pids))}')
+    click.echo(f'Top growers of process {pid}:')
+    for grower in growers:
+        click.echo(f"{grower['sizeDiff'] / 1024:+10.1f} KiB "
+                   f"{grower['countDiff']:+8d} blocks  "
+                   f"{grower['file']}:{grower['line']}")
+
+@cli.command()
+@click.option('--scale', '-s', multiple=True, type=int,
+              help='Rows per table. Can be repeated. '
+                   'Defaults to 1000, 100000 and 1000000.')
+@click.option('--iterations', '-n', default=20,
+              help='Timed requests per endpoint.')
+@click.option('--warmup', default=2, help='Untimed requests per endpoint.')
+@click.option('--endpoint', '-e', default=None,
+              help='Only run endpoints whose name contains this text.')
+@click.option('--gunicorn', is_flag=True,
+              help='Send requests over HTTP to a gunicorn process.')
+@click.option('--database-url', default=None,
+              help='Database to use. Defaults to DATABASE_TEST_URL. '
+                   'ALL OF ITS DATA IS DELETED.')
+@click.option('--output', '-o', default='benchmark-results.json',
+              help='File to write the results to.')
+@click.option('--compare', 'baseline', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Results file to compare against.')
+def benchmark(scale, iterations, warmup, endpoint, gunicorn, database_url,
+              output, baseline):
+    """Benchmarks every endpoint at several data scales."""
+    from project.benchmarks.endpoints import (run_benchmarks, compare,
+                                              DEFAULT_SCALES)
+    benchmark_app = create_app()
+    set_app_configuration('ProductionConfig', benchmark_app)
+    benchmark_app.config['SQLALCHEMY_DATABASE_URI'] = (
+            database_url or os.environ.get('DATABASE_TEST_URL'))
+    results = run_benchmarks(benchmark_app, scale or DEFAULT_SCALES,
+                             iterations, warmup, gunicorn, endpoint,
+                             log=click.echo)
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    click.echo(f'Results written to {output}')
+    if baseline:
+        with open(baseline) as baseline_file:
+            regressions = compare(json.load(baseline_file), results)
+        for r in regressions:
+            click.echo(f"REGRESSION {r['scale']:>8} {r['endpoint']:<28} "
+                       f"p50 {r['baseline_p50_ms']:.2f}ms -> "
+                       f"{r['current_p50_ms']:.2f}ms ({r['change']:+.0%}), "
+                       f"queries {r['baseline_queries']} -> "
+                       f"{r['current_queries']}")
+        if regressions:
+            return 1
+    return 0
+
+@cli.command()
+@workers_option
+def cov(workers):
     """Runs the unit tests with coverage."""
-    tests = unittest.TestLoader().discover('project/tests')
-    result = unittest.TextTestRunner(verbosity=2).run(tests)
-    if result.wasSuccessful():
+    if workers != 1:
+        # the workers measure coverage themselves, and leave a data file
+        # each for us to combine
+        COV.stop()
+        COV.erase()
+        successful = run_tests(workers, COVERAGE_OPTIONS)
+        COV.combine()
+    else:
+        successful = run_tests(workers)
         COV.stop()
+    if successful:
         COV.save()
         print('Coverage Summary:')
         COV.report()
@@ -0,0 +1,45 @@
+"""track changes to the jobs and expenses
+
+Revision ID: 4e2b8d1c7a90
+Revises: c7cc20884a06
+Create Date: 2026-10-19 10:12:41.208117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e2b8d1c7a90'
+down_revision = 'c7cc20884a06'
+branch_labels = None
+depends_on = None
+
+TRACKED_TABLES = ['jobs', 'one_time_expenses', 'recurring_expenses']
+
+
+def upgrade():
+    op.create_table(
+        'changes',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('table_name', sa.String(length=64), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=True),
+        sa.Column('operation',
+                  sa.Enum('UPSERT', 'DELETE', 'RESET',
+                          name='change_operation'),
+                  nullable=False),
+        sa.Column('changed_at', sa.DateTime(),
+                  server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    for table in TRACKED_TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       server_default=sa.text('now()'),
+                                       nullable=False))
+
+
+def downgrade():
+    for table in TRACKED_TABLES:
+        op.drop_column(table, 'updated_at')
+    op.drop_table('changes')
+    sa.Enum(name='change_operation').drop(op.get_bind(), checkfirst=False)
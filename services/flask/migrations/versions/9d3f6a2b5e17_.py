@@ -0,0 +1,35 @@
+"""add the table of the postgres cache backend
+
+Revision ID: 9d3f6a2b5e17
+Revises: 4e2b8d1c7a90
+Create Date: 2026-10-19 16:05:12.481263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f6a2b5e17'
+down_revision = '4e2b8d1c7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the cache used to create it the first time it was used
+    if 'cache_entries' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    # the same as project.cache.cache_entries
+    op.create_table(
+        'cache_entries',
+        sa.Column('key', sa.Text(), nullable=False),
+        sa.Column('value', sa.LargeBinary(), nullable=False),
+        sa.Column('expires_at', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('key'),
+        prefixes=['UNLOGGED']
+    )
+
+
+def downgrade():
+    op.drop_table('cache_entries')
@@ -4,11 +4,21 @@
 import os
 import sys
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_bcrypt import Bcrypt
+
+from project.access_log import AccessLog
+from project.cache import Cache, EventsCache, RowCache
+from project.instrumentation import QueryInstrumentation
+from project.memory import MemoryMonitor
+from project.metrics import MeteredBcrypt, Metrics
+from project.profiling import Profiler
+from project.invalidation import InvalidationBus
+from project.replicas import Replicas, RoutingSQLAlchemy
+from project.shedding import LoadShedder
+from project.singleflight import SingleFlight
+from project.stream import ChangeStream
 
 
 # Helper predicate that determines if there is a config.py file
@@ -29,13 +39,30 @@ def set_app_configuration(config_class, app):
 
 
 # instantiate the db
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 toolbar = DebugToolbarExtension()
 migrate = Migrate()
-bcrypt = Bcrypt()
-
-
-def create_app(script_info=None):
+query_instrumentation = QueryInstrumentation()
+metrics = Metrics()
+bcrypt = MeteredBcrypt(metrics)
+profiler = Profiler()
+memory_monitor = MemoryMonitor()
+access_log = AccessLog()
+load_shedder = LoadShedder()
+cache = Cache()
+invalidation_bus = InvalidationBus()
+replicas = Replicas(invalidation_bus)
+single_flight = SingleFlight()
+change_stream = ChangeStream()
+row_cache = RowCache(cache, invalidation_bus)
+events_cache = EventsCache(cache, invalidation_bus, single_flight)
+
+
+def create_app(script_info=None, replica_uris=None):
+    """
+    Create the app.  ``replica_uris`` is an optional list of read replica
+    URIs, which overrides SQLALCHEMY_REPLICA_URIS.
+    """
 
     # instantiate the app
     app = Flask(__name__)
@@ -54,12 +81,32 @@ def create_app(script_info=None):
     # set config
     config_class = config_classes[os.getenv('ENVIRONMENT_TYPE')]
     set_app_configuration(config_class, app)
+    if replica_uris is not None:
+        app.config['SQLALCHEMY_REPLICA_URIS'] = list(replica_uris)
 
     # set up extensions
     db.init_app(app)
+    query_instrumentation.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    memory_monitor.init_app(app)
+    access_log.init_app(app)
+    load_shedder.init_app(app)
     toolbar.init_app(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
+    cache.init_app(app)
+    invalidation_bus.init_app(app)
+    replicas.init_app(app)
+    single_flight.init_app(app)
+    row_cache.init_app(app)
+    events_cache.init_app(app)
+    change_stream.init_app(app)
+
+    # encode enums and dates the same way as the fast JSON path
+    from project.admin.serializers import JSONEncoder, init_json_backend
+    app.json_encoder = JSONEncoder
+    init_json_backend(app)
 
     # register blueprints
     from project.admin.api import admin_blueprint
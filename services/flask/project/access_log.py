@@ -0,0 +1,193 @@
+# services/flask/project/access_log.py
+
+"""
+Structured access log, written without slowing requests down.
+
+Each request becomes one line of JSON, with its method, route, path,
+status, how long it took, how long its SQL statements took (see
+project/instrumentation.py), the id of the logged in user, the size of
+the response and the client's address.  Request threads only put the
+records on a queue.  A thread of each process formats them and writes them
+to ACCESS_LOG_FILE, or to stdout if it isn't set.  When ACCESS_LOG_QUEUE_SIZE
+records are waiting, new ones are dropped and counted rather than making
+requests wait.
+
+ACCESS_LOG_SAMPLE_RATES maps routes, like '/admin/ping', to the fraction of
+their requests that are logged, for the ones that are too frequent to log
+in full.  Errors and requests that take ACCESS_LOG_SLOW_TIME seconds or
+more are always logged.  Each line has the rate that it was sampled at, so
+that counts can be scaled back up.
+"""
+
+import atexit
+import collections
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from flask import current_app, g, request
+
+from project.instrumentation import request_stats
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops the records that don't fit in its queue,
+    instead of waiting"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the records are formatted by the writer thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Writer(logging.handlers.QueueListener):
+    """Thread that writes the records of the queue"""
+
+    def enqueue_sentinel(self):
+        # wait for room, since the records before it are still wanted
+        self.queue.put(self._sentinel)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats the fields of an access log record as a line of JSON"""
+
+    def format(self, record):
+        entry = collections.OrderedDict()
+        entry['time'] = datetime.datetime.utcfromtimestamp(
+            record.created).isoformat() + 'Z'
+        entry.update(record.access)
+        return json.dumps(entry, separators=(',', ':'))
+
+
+class AccessLog(object):
+    """
+    Flask extension that logs every request, or a sample of them, if
+    ACCESS_LOG_ENABLED is set.
+    """
+
+    def __init__(self, app=None):
+        self.logger = logging.getLogger('project.access')
+        self.logger.setLevel(logging.INFO)
+        # only to the handler of this extension
+        self.logger.propagate = False
+        self._handler = None
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._dropped = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ACCESS_LOG_ENABLED', False)
+        app.config.setdefault('ACCESS_LOG_FILE', None)
+        app.config.setdefault('ACCESS_LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('ACCESS_LOG_SAMPLE_RATES', {})
+        app.config.setdefault('ACCESS_LOG_SLOW_TIME', 1.0)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    @property
+    def dropped(self):
+        """The records that were dropped because the queue was full"""
+        handler = self._handler
+        return self._dropped + (handler.dropped if handler else 0)
+
+    def start(self, app):
+        """Start the thread that writes the log, unless it's already running
+        in this process"""
+        if self._writer is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer is not None and self._pid == os.getpid():
+                return
+            if self._handler is not None:
+                # the handler of the parent process, whose thread isn't here
+                self.logger.removeHandler(self._handler)
+                self._dropped += self._handler.dropped
+            path = app.config['ACCESS_LOG_FILE']
+            target = logging.FileHandler(path) if path else \
+                logging.StreamHandler(sys.stdout)
+            target.setFormatter(JSONFormatter())
+            self._handler = DroppingQueueHandler(
+                queue.Queue(app.config['ACCESS_LOG_QUEUE_SIZE']))
+            self._writer = Writer(self._handler.queue, target)
+            self._writer.start()
+            self._pid = os.getpid()
+            self.logger.addHandler(self._handler)
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Write the records that are waiting, and stop the thread"""
+        with self._lock:
+            if self._writer is None or self._pid != os.getpid():
+                return
+            self._writer.stop()
+            for target in self._writer.handlers:
+                target.close()
+            self.logger.removeHandler(self._handler)
+            self._dropped += self._handler.dropped
+            self._handler = self._writer = None
+
+    # Recording
+
+    def _start(self):
+        g.access_log_start = None
+        g.user_id = None
+        if current_app.config['ACCESS_LOG_ENABLED']:
+            self.start(current_app)
+            g.access_log_start = time.perf_counter()
+
+    def _finish(self, response):
+        self._record(response.status_code, response.content_length)
+        return response
+
+    def _teardown(self, exception):
+        # after_request isn't called when a route raises
+        if exception is not None:
+            self._record(500, None)
+
+    def _record(self, status, size):
+        start = g.pop('access_log_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        config = current_app.config
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        rate = config['ACCESS_LOG_SAMPLE_RATES'].get(route, 1.0)
+        if status < 500 and duration < config['ACCESS_LOG_SLOW_TIME'] and \
+                random.random() >= rate:
+            return
+        stats = request_stats()
+        entry = collections.OrderedDict([
+            ('method', request.method),
+            ('route', route),
+            ('path', request.path),
+            ('status', status),
+            ('durationMs', round(duration * 1000, 1)),
+            ('dbTimeMs', round(stats.time * 1000, 1) if stats else None),
+            ('dbQueries', stats.queries if stats else None),
+            ('userId', g.get('user_id')),
+            ('bytes', size),
+            ('remoteAddr', request.remote_addr),
+            ('sampleRate', rate),
+        ])
+        self.logger.info('%s %s %s', request.method, request.path, status,
+                         extra={'access': entry})
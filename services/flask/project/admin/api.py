@@ -1,19 +1,63 @@
 # services/flask/project/admin/api.py
 
-from flask import Blueprint, jsonify, request
+import codecs
+import datetime
+import json
+import os
+import queue
+import time
+
+from flask import (Blueprint, Response, current_app, request,
+                   send_from_directory, stream_with_context)
 from sqlalchemy import exc, or_
 
 from project.admin.models import (User, Job, OneTimeExpense, RecurringExpense)
-from project import db, bcrypt
-from project.admin.decorators import users_only
+from project import (db, bcrypt, cache, change_stream, events_cache,
+                     memory_monitor, profiler, replicas, row_cache,
+                     single_flight)
+from project.admin.decorators import replica_reads, users_only
+from project.admin.changes import (CHANGES_PAGE_SIZE, changes_since,
+                                   current_cursor, cursor_expired,
+                                   record_reset)
+from project.admin.csv_io import csv_tables, CSVImportError
+from project.admin.serializers import (api_response, get_payload,
+                                       user_serializer,
+                                       job_serializer,
+                                       one_time_expense_serializer,
+                                       recurring_expense_serializer)
+from project.memory import top_growers
+from project.pool import pool_stats
+from project.profiling import PROFILE_NAME
+from project.shedding import LoadShedder, route_class
+from project.singleflight import visible_transactions
 
 admin_blueprint = Blueprint('admin', __name__)
 
 
+def dump_all(serializer):
+    """
+    Every row of serializer.model in the order of their ids, serialized in
+    the format that the client asked for.  Identical requests that run at the
+    same time, and that see the same writes, share a query.
+    """
+    def load():
+        return serializer.dump_many(
+            serializer.query().order_by(serializer.model.id).all())
+
+    if not current_app.config['SINGLE_FLIGHT_ENABLED']:
+        return load()
+    # so that the reload after a write doesn't get a list from before it
+    key = ('all', serializer.model.__tablename__,
+           request.args.get('format', 'rows'),
+           visible_transactions(db.session))
+    return single_flight.do(key, load)
+
+
 @admin_blueprint.route('/ping', methods=['GET'])
+@route_class(None)
 def ping():
     """Respond to a ping"""
-    return jsonify({
+    return api_response({
         'status': 'success',
         'message': 'pong!'
     })
@@ -32,9 +76,9 @@ def add_job():
         'status': 'fail',
         'message': 'Invalid payload.'
     }
-    post_data = request.get_json()
+    post_data = get_payload()
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     try:
         job = Job(
                    client=post_data.get('client'),
@@ -49,24 +93,25 @@ def add_job():
         )
         db.session.add(job)
         db.session.commit()
+        events_cache.invalidate((job.start_date, job.end_date))
         response_object = {
             'status': 'success',
             'message': f'{job.client} job was added!',
-            'job': job.to_json()
+            'job': job_serializer.dump(job)
         }
-        return jsonify(response_object), 201
+        return api_response(response_object), 201
     except exc.IntegrityError as e:
         db.session.rollback()
         if job.start_date > job.end_date:
             msg = 'endDate must be equal to or later than startDate'
             response_object['message'] = msg
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     except exc.DataError as e:
         db.session.rollback()
         err_msg = str(e)
         if 'invalid input syntax for type double precision' in err_msg:
             response_object['message'] = "'amountPaid' must be a number."
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     except ValueError as e:
         db.session.rollback()
         err_msg = str(e)
@@ -84,10 +129,11 @@ def add_job():
                        ', '.join([f"'{t.value}'"
                                   for t in Job.Confirmation]))
         response_object['message'] = err_msg
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
 
 
 @admin_blueprint.route('/jobs/<job_id>', methods=['GET'])
+@replica_reads
 @users_only()
 def get_single_job(job_id):
     """Get single job details"""
@@ -96,16 +142,16 @@ def get_single_job(job_id):
         'message': 'Job does not exist'
     }
     try:
-        job = Job.query.filter_by(id=job_id).first()
+        job = row_cache.get(job_serializer, int(job_id))
         if not job:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
         response_object = {
                 'status': 'success',
-                'data': job.to_json()
+                'data': job
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/jobs/<job_id>', methods=['DELETE'])
@@ -119,20 +165,23 @@ def delete_job(job_id):
     try:
         job = Job.query.filter_by(id=job_id).first()
         if not job:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
+        dates = (job.start_date, job.end_date)
 
         # Delete the job
         db.session.delete(job)
         db.session.commit()
+        row_cache.invalidate(Job, job.id)
+        events_cache.invalidate(dates)
 
         # Create a response
         response_object = {
                 'status': 'success',
                 'message': 'Job deleted successfully',
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/jobs/<job_id>', methods=['POST'])
@@ -143,9 +192,9 @@ def update_job(job_id):
         'status': 'fail',
         'message': 'Invalid payload.'
     }
-    post_data = request.get_json()
+    post_data = get_payload()
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     response_object = {
         'status': 'fail',
         'message': 'Job does not exist'
@@ -153,7 +202,8 @@ def update_job(job_id):
     try:
         job = Job.query.filter_by(id=job_id).first()
         if not job:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
+        old_dates = (job.start_date, job.end_date)
         updated_job = Job(
                    client=post_data.get('client'),
                    description=post_data.get('description'),
@@ -175,28 +225,31 @@ def update_job(job_id):
         job.start_date = updated_job.start_date
         job.end_date = updated_job.end_date
         db.session.commit()
+        row_cache.invalidate(Job, job.id)
+        events_cache.invalidate(old_dates, (job.start_date, job.end_date))
         response_object = {
                 'status': 'success',
-                'data': job.to_json(),
+                'data': job_serializer.dump(job),
                 'message': 'Job updated successfully',
-                'job': job.to_json()
+                'job': job_serializer.dump(job)
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/jobs', methods=['GET'])
+@replica_reads
 @users_only()
 def get_all_jobs():
     """Get all jobs"""
     response_object = {
         'status': 'success',
         'data': {
-            'jobs': [job.to_json() for job in Job.query.all()]
+            'jobs': dump_all(job_serializer)
         }
     }
-    return jsonify(response_object), 200
+    return api_response(response_object), 200
 
 
 # =======================
@@ -211,9 +264,9 @@ def add_one_time_expense():
         'status': 'fail',
         'message': 'Invalid payload.'
     }
-    post_data = request.get_json()
+    post_data = get_payload()
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     try:
         expense = OneTimeExpense(
                               merchant=post_data.get('merchant'),
@@ -226,21 +279,22 @@ def add_one_time_expense():
         )
         db.session.add(expense)
         db.session.commit()
+        events_cache.invalidate((expense.date, expense.date))
         response_object = {
             'status': 'success',
             'message': f'{post_data.get("merchant")} expense was added!',
-            'expense': expense.to_json()
+            'expense': one_time_expense_serializer.dump(expense)
         }
-        return jsonify(response_object), 201
+        return api_response(response_object), 201
     except exc.IntegrityError as e:
         db.session.rollback()
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     except exc.DataError as e:
         db.session.rollback()
         err_msg = str(e)
         if 'invalid input syntax for type double precision' in err_msg:
             response_object['message'] = "'amountSpent' must be a number."
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     except ValueError as e:
         db.session.rollback()
         err_msg = str(e)
@@ -255,10 +309,11 @@ def add_one_time_expense():
                        ', '.join([f"'{t.value}'"
                                   for t in OneTimeExpense.PaidBy]))
         response_object['message'] = err_msg
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
 
 
 @admin_blueprint.route('/one-time-expenses/<expense_id>', methods=['GET'])
+@replica_reads
 def get_single_one_time_expense(expense_id):
     """Get single one time expense"""
     response_object = {
@@ -266,16 +321,16 @@ def get_single_one_time_expense(expense_id):
         'message': 'Expense does not exist'
     }
     try:
-        expense = OneTimeExpense.query.filter_by(id=int(expense_id)).first()
+        expense = row_cache.get(one_time_expense_serializer, int(expense_id))
         if not expense:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
         response_object = {
                             'status': 'success',
-                            'data': expense.to_json()
+                            'data': expense
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/one-time-expenses/<expense_id>', methods=['POST'])
@@ -285,9 +340,9 @@ def update_one_time_expense(expense_id):
         'status': 'fail',
         'message': 'Invalid payload.'
     }
-    post_data = request.get_json()
+    post_data = get_payload()
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     response_object = {
         'status': 'fail',
         'message': 'Expense does not exist'
@@ -295,7 +350,8 @@ def update_one_time_expense(expense_id):
     try:
         expense = OneTimeExpense.query.filter_by(id=expense_id).first()
         if not expense:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
+        old_date = expense.date
         updated_expense = OneTimeExpense(
                               merchant=post_data.get('merchant'),
                               description=post_data.get('description'),
@@ -314,15 +370,18 @@ def update_one_time_expense(expense_id):
         expense.category = updated_expense.category
 
         db.session.commit()
+        row_cache.invalidate(OneTimeExpense, expense.id)
+        events_cache.invalidate((old_date, old_date),
+                                (expense.date, expense.date))
         response_object = {
                 'status': 'success',
-                'data': expense.to_json(),
+                'data': one_time_expense_serializer.dump(expense),
                 'message': 'Expense updated successfully',
-                'expense': expense.to_json()
+                'expense': one_time_expense_serializer.dump(expense)
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/one-time-expenses/<expense_id>', methods=['DELETE'])
@@ -335,34 +394,37 @@ def delete_one_time_expense(expense_id):
     try:
         expense = OneTimeExpense.query.filter_by(id=expense_id).first()
         if not expense:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
+        expense_date = expense.date
 
         # Delete the job
         db.session.delete(expense)
         db.session.commit()
+        row_cache.invalidate(OneTimeExpense, expense.id)
+        events_cache.invalidate((expense_date, expense_date))
 
         # Create a response
         response_object = {
                 'status': 'success',
                 'message': 'Expense deleted successfully',
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/one-time-expenses', methods=['GET'])
+@replica_reads
 def get_all_one_time_expenses():
     """Get all one time expenses"""
-    expenses = OneTimeExpense.query.all()
     response_object = {
             'status': 'success',
             'data': {
-                      'one-time-expenses': [expense.to_json()
-                                            for expense in expenses]
+                      'one-time-expenses':
+                      dump_all(one_time_expense_serializer)
                     }
     }
-    return jsonify(response_object), 200
+    return api_response(response_object), 200
 
 
 # ========================
@@ -377,9 +439,9 @@ def add_recurring_expense():
                         'status': 'fail',
                         'message': 'Invalid payload.'
     }
-    post_data = request.get_json()
+    post_data = get_payload()
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     try:
         expense = RecurringExpense(
                                 merchant=post_data.get('merchant'),
@@ -398,13 +460,13 @@ def add_recurring_expense():
             'status': 'success',
             'message': f'{expense.merchant} recurring expense was added!'
         }
-        return jsonify(response_object), 201
+        return api_response(response_object), 201
     except exc.IntegrityError as e:
         db.session.rollback()
         if 'violates check constraint' in str(e):
             msg = 'start_date must be earlier than end_date'
             response_object['message'] = msg
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     except ValueError as e:
         db.session.rollback()
         err_msg = str(e)
@@ -424,40 +486,41 @@ def add_recurring_expense():
                        ', '.join([f"'{t.value}'"
                                   for t in RecurringExpense.Category]))
         response_object['message'] = err_msg
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
 
 
 @admin_blueprint.route('/recurring-expenses/<expense_id>', methods=['GET'])
+@replica_reads
 def get_single_recurring_expense(expense_id):
     response_object = {
         'status': 'fail',
         'message': 'Expense does not exist'
     }
     try:
-        expense = RecurringExpense.query.filter_by(id=int(expense_id)).first()
+        expense = row_cache.get(recurring_expense_serializer, int(expense_id))
         if not expense:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
         response_object = {
                             'status': 'success',
-                            'data': expense.to_json()
+                            'data': expense
         }
-        return jsonify(response_object), 200
+        return api_response(response_object), 200
     except (ValueError, exc.DataError):
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/recurring-expenses', methods=['GET'])
+@replica_reads
 def get_all_recurring_expenses():
     """Get all recurring expenses"""
-    expenses = RecurringExpense.query.all()
     response_object = {
             'status': 'success',
             'data': {
-                      'recurring-expenses': [expense.to_json()
-                                             for expense in expenses]
+                      'recurring-expenses':
+                      dump_all(recurring_expense_serializer)
                     }
     }
-    return jsonify(response_object), 200
+    return api_response(response_object), 200
 
 
 # ===========
@@ -466,14 +529,15 @@ def get_all_recurring_expenses():
 
 
 @admin_blueprint.route('/users', methods=['POST'])
+@route_class('auth')
 def add_user():
-    post_data = request.get_json()
+    post_data = get_payload()
     response_object = {
         'status': 'fail',
         'message': 'Invalid payload.'
     }
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     try:
         email = post_data.get('email')
         user = User.query.filter_by(email=email).first()
@@ -485,16 +549,17 @@ def add_user():
             db.session.commit()
             response_object['status'] = 'success'
             response_object['message'] = f'User {user.username} was added!'
-            return jsonify(response_object), 201
+            return api_response(response_object), 201
         else:
             response_object['message'] = 'Sorry. That email already exists.'
-            return jsonify(response_object), 400
+            return api_response(response_object), 400
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
 
 
 @admin_blueprint.route('/users/<user_id>', methods=['GET'])
+@replica_reads
 def get_single_user(user_id):
     """Get single user details"""
     response_object = {
@@ -502,29 +567,30 @@ def get_single_user(user_id):
         'message': 'User does not exist'
     }
     try:
-        user = User.query.filter_by(id=int(user_id)).first()
+        user = row_cache.get(user_serializer, int(user_id))
         if not user:
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
         else:
             response_object = {
                                 'status': 'success',
-                                'data': user.to_json()
+                                'data': user
                               }
-            return jsonify(response_object), 200
+            return api_response(response_object), 200
     except ValueError:
-        return jsonify(response_object), 404
+        return api_response(response_object), 404
 
 
 @admin_blueprint.route('/users', methods=['GET'])
+@replica_reads
 def get_all_users():
     """Get all users"""
     response_object = {
         'status': 'success',
         'data': {
-            'users': [user.to_json() for user in User.query.all()]
+            'users': user_serializer.dump_many(user_serializer.query().all())
         }
     }
-    return jsonify(response_object), 200
+    return api_response(response_object), 200
 
 
 # ===========
@@ -533,15 +599,16 @@ def get_all_users():
 
 
 @admin_blueprint.route('/register', methods=['POST'])
+@route_class('auth')
 def register_user():
     """Register a new user"""
-    post_data = request.get_json()
+    post_data = get_payload()
     response_object = {
         'status': 'fail',
         'message': 'Invalid payload.'
     }
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     username = post_data.get('username')
     email = post_data.get('email')
     password = post_data.get('password')
@@ -566,26 +633,27 @@ def register_user():
             response_object['message'] = 'Successfully registered.'
             response_object['expiration'] = exp
             response_object['auth_token'] = auth_token.decode()
-            return jsonify(response_object), 201
+            return api_response(response_object), 201
         else:
             response_object['message'] = 'Sorry. That user already exists.'
-            return jsonify(response_object), 400
+            return api_response(response_object), 400
     # handler errors
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
 
 
 @admin_blueprint.route('/login', methods=['POST'])
+@route_class('auth')
 def login_user():
     # get post data
-    post_data = request.get_json()
+    post_data = get_payload()
     response_object = {
         'status': 'fail',
         'message': 'Invalid payload.'
     }
     if not post_data:
-        return jsonify(response_object), 400
+        return api_response(response_object), 400
     username = post_data.get('username')
     password = post_data.get('password')
     is_private_device = post_data.get('isPrivateDevice')
@@ -603,13 +671,13 @@ def login_user():
                 response_object['message'] = 'Successfully logged in.'
                 response_object['expiration'] = exp
                 response_object['auth_token'] = auth_token.decode()
-                return jsonify(response_object), 200
+                return api_response(response_object), 200
         else:
             response_object['message'] = 'User does not exist.'
-            return jsonify(response_object), 404
+            return api_response(response_object), 404
     except Exception as e:
         response_object['message'] = 'Try again.'
-        return jsonify(response_object), 500
+        return api_response(response_object), 500
 
 
 @admin_blueprint.route('/logout', methods=['GET'])
@@ -626,12 +694,12 @@ def logout_user():
         if not isinstance(decode_response, str):
             response_object['status'] = 'success'
             response_object['message'] = 'Successfully logged out.'
-            return jsonify(response_object), 200
+            return api_response(response_object), 200
         else:
             response_object['message'] = decode_response
-            return jsonify(response_object), 401
+            return api_response(response_object), 401
     else:
-        return jsonify(response_object), 403
+        return api_response(response_object), 403
 
 
 @admin_blueprint.route('/status', methods=['GET'])
@@ -646,16 +714,16 @@ def get_user_status():
         auth_token = auth_header.split(' ')[1]
         decode_response, exp = User.decode_auth_token(auth_token)
         if not isinstance(decode_response, str):
-            user = User.query.filter_by(id=decode_response).first()
+            user = row_cache.get(user_serializer, decode_response)
             response_object['status'] = 'success'
             response_object['message'] = 'Success.'
             response_object['expiration'] = exp
-            response_object['user'] = user.to_json()
-            return jsonify(response_object), 200
+            response_object['user'] = user
+            return api_response(response_object), 200
         response_object['message'] = decode_response
-        return jsonify(response_object), 401
+        return api_response(response_object), 401
     else:
-        return jsonify(response_object), 401
+        return api_response(response_object), 401
 
 
 # ==========================
@@ -664,23 +732,328 @@ def get_user_status():
 
 
 @admin_blueprint.route('/events', methods=['GET'])
+@replica_reads
 @users_only(pass_user=True)
 def get_events(user):
     """Get jobs and one time expenses from within a date range"""
     start_date = request.args.get('startDate')
     end_date = request.args.get('endDate')
-    jobs = Job.query.filter(
-            Job.end_date >= start_date,
-            Job.start_date <= end_date).all()
-    expenses = OneTimeExpense.query.filter(
-            OneTimeExpense.date >= start_date,
-            OneTimeExpense.date <= end_date).all()
+
+    def load_events():
+        jobs = job_serializer.query().filter(
+                Job.end_date >= start_date,
+                Job.start_date <= end_date).all()
+        expenses = one_time_expense_serializer.query().filter(
+                OneTimeExpense.date >= start_date,
+                OneTimeExpense.date <= end_date).all()
+        return {
+            'jobs': job_serializer.dump_many(jobs),
+            'expenses': one_time_expense_serializer.dump_many(expenses),
+        }
+
+    events = events_cache.get(start_date, end_date,
+                              request.args.get('format', 'rows'),
+                              load_events)
+    response_object = {
+        'status': 'success',
+        'data': dict(events, user=user)
+    }
+    return api_response(response_object), 200
+
+
+# ========================
+# EXPORT AND IMPORT ROUTES
+# ========================
+
+
+@admin_blueprint.route('/export/<table>.csv', methods=['GET'])
+@route_class('export')
+@users_only()
+def export_csv(table):
+    """
+    Stream a table as CSV.  Only rows whose dates overlap the optional
+    startDate and endDate query parameters are included.
+    """
+    response_object = {
+        'status': 'fail',
+        'message': 'Table does not exist'
+    }
+    csv_table = csv_tables.get(table)
+    if not csv_table:
+        return api_response(response_object), 404
+    try:
+        dates = [datetime.datetime.strptime(value, '%Y-%m-%d').date()
+                 if value else None
+                 for value in (request.args.get('startDate'),
+                               request.args.get('endDate'))]
+    except ValueError:
+        response_object['message'] = ("'startDate' and 'endDate' must be " +
+                                      "dates in the format YYYY-MM-DD.")
+        return api_response(response_object), 400
+    return Response(
+        stream_with_context(csv_table.stream(*dates)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={table}.csv'}
+    )
+
+
+@admin_blueprint.route('/import/<table>.csv', methods=['POST'])
+@route_class('export')
+@users_only()
+def import_csv(table):
+    """
+    Import rows into a table from a CSV file, sent either as the request body
+    or as the 'file' field of a multipart form.  Invalid rows are skipped and
+    reported in the response.
+    """
+    response_object = {
+        'status': 'fail',
+        'message': 'Table does not exist'
+    }
+    csv_table = csv_tables.get(table)
+    if not csv_table:
+        return api_response(response_object), 404
+    if request.mimetype == 'multipart/form-data':
+        csv_file = request.files.get('file')
+        if not csv_file:
+            response_object['message'] = 'Invalid payload.'
+            return api_response(response_object), 400
+        stream = csv_file.stream
+    else:
+        stream = request.stream
+    try:
+        result = csv_table.import_lines(codecs.iterdecode(stream, 'utf-8'))
+        if result.imported:
+            record_reset(table)
+        db.session.commit()
+        if csv_table.model in (Job, OneTimeExpense):
+            events_cache.invalidate_all()
+    except CSVImportError as e:
+        db.session.rollback()
+        response_object['message'] = str(e)
+        return api_response(response_object), 400
+    except UnicodeDecodeError:
+        db.session.rollback()
+        response_object['message'] = 'The CSV file must be UTF-8 encoded.'
+        return api_response(response_object), 400
+    response_object = {
+        'status': 'success',
+        'message': f'{result.imported} rows were imported.',
+        'data': result.to_json()
+    }
+    return api_response(response_object), 200
+
+
+# ===========
+# SYNC ROUTES
+# ===========
+
+
+@admin_blueprint.route('/changes', methods=['GET'])
+@users_only()
+def get_changes():
+    """
+    Get the changes to the jobs and expenses after the 'since' cursor, at
+    most 'limit' of them.  Without 'since', only the current cursor is
+    returned: clients should get it before loading the tables, and then
+    pass it to the next request.
+    """
+    response_object = {
+        'status': 'fail',
+        'message': "'since' and 'limit' must be non-negative integers."
+    }
+    try:
+        since = request.args.get('since')
+        since = int(since) if since is not None else None
+        limit = min(int(request.args.get('limit', CHANGES_PAGE_SIZE)),
+                    CHANGES_PAGE_SIZE)
+    except ValueError:
+        return api_response(response_object), 400
+    if (since is not None and since < 0) or limit < 1:
+        return api_response(response_object), 400
+    if since is None:
+        changes, cursor, more = [], current_cursor(), False
+    elif cursor_expired(since):
+        response_object['message'] = ('The cursor has expired. Reload the '
+                                      'tables and get a new cursor.')
+        return api_response(response_object), 410
+    else:
+        changes, cursor, more = changes_since(since, limit)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'changes': changes,
+            'cursor': cursor,
+            'more': more
+        }
+    }
+    return api_response(response_object), 200
+
+
+def sse_event(event, data):
+    """Format a server-sent event"""
+    return f'event: {event}\ndata: {data}\n\n'
+
+
+@admin_blueprint.route('/stream', methods=['GET'])
+@route_class(None)
+@users_only(token_param='token')
+def stream_changes():
+    """
+    Stream notifications of the changes to the jobs and expenses as
+    server-sent events.  The first event is a 'sync' with the current
+    cursor, followed by a 'change' with the new cursor and the changed rows
+    for every transaction.  Clients get the changes themselves from
+    /admin/changes.  A 'sync' is also sent if notifications may have been
+    missed.
+    """
+    if not current_app.config['STREAM_ENABLED']:
+        response_object = {
+            'status': 'fail',
+            'message': 'Change streams are disabled.'
+        }
+        return api_response(response_object), 404
+    app = current_app._get_current_object()
+    # subscribe first, so that nothing is missed after the cursor
+    subscriber = change_stream.subscribe(app)
+    if subscriber is None:
+        # the streams aren't counted by the load shedding
+        return LoadShedder.busy(app.config)
+    try:
+        cursor = current_cursor()
+    except Exception:
+        change_stream.unsubscribe(subscriber)
+        raise
+
+    # The generator runs after the request has ended and the database
+    # session has been removed, so an idle stream holds no connection.
+    def generate():
+        try:
+            yield sse_event('sync', json.dumps({'cursor': cursor}))
+            heartbeat = app.config['STREAM_HEARTBEAT']
+            end = time.monotonic() + app.config['STREAM_MAX_AGE']
+            while True:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event, data = subscriber.get(
+                        timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    # also finds out whether the client has gone
+                    yield ': heartbeat\n\n'
+                    continue
+                yield sse_event(event, data)
+        finally:
+            change_stream.unsubscribe(subscriber)
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    # also when the generator never starts, like for HEAD requests
+    response.call_on_close(lambda: change_stream.unsubscribe(subscriber))
+    return response
+
+
+# ============
+# CACHE ROUTES
+# ============
+
+
+@admin_blueprint.route('/cache/stats', methods=['GET'])
+@users_only()
+def get_cache_stats():
+    """
+    Get the hit and miss counters of this process's caches, and the state
+    of its connection pool and read replicas
+    """
+    data = cache.stats()
+    data['rowCacheEnabled'] = current_app.config['ROW_CACHE_ENABLED']
+    data['singleFlight'] = single_flight.stats()
+    data['connectionPool'] = pool_stats(db.engine)
+    data['readReplicas'] = replicas.stats(current_app)
+    response_object = {
+        'status': 'success',
+        'data': data
+    }
+    return api_response(response_object), 200
+
+
+# ==============
+# PROFILE ROUTES
+# ==============
+
+
+@admin_blueprint.route('/profiles', methods=['GET'])
+@users_only()
+def get_profiles():
+    """Get the names of the stored request profiles, newest first"""
+    response_object = {
+        'status': 'success',
+        'data': {
+            'profiles': profiler.names(current_app)
+        }
+    }
+    return api_response(response_object), 200
+
+
+@admin_blueprint.route('/profiles/<name>', methods=['GET'])
+@users_only()
+def get_profile(name):
+    """Get a request profile, in the folded format of flamegraph.pl"""
+    if not PROFILE_NAME.match(name):
+        response_object = {
+            'status': 'fail',
+            'message': 'Profile does not exist.'
+        }
+        return api_response(response_object), 404
+    return send_from_directory(current_app.config['PROFILING_DIR'], name,
+                               mimetype='text/plain')
+
+
+# ==============
+# MEMORY ROUTES
+# ==============
+
+
+@admin_blueprint.route('/memory', methods=['GET'])
+@users_only()
+def get_memory():
+    """
+    Get the memory of the process that answers, its growth by route, and
+    the lines of code whose allocations grew the most since its first
+    snapshot, if memory tracing is enabled
+    """
+    directory = current_app.config['MEMORY_SNAPSHOT_DIR']
+    data = memory_monitor.stats(current_app)
+    data['topGrowers'] = top_growers(directory, data['pid']) \
+        if data['tracing'] else None
+    response_object = {
+        'status': 'success',
+        'data': data
+    }
+    return api_response(response_object), 200
+
+
+@admin_blueprint.route('/memory/snapshot', methods=['POST'])
+@users_only()
+def take_memory_snapshot():
+    """
+    Take a snapshot of the allocations of the process that answers, and get
+    the lines of code whose allocations grew the most since its first one
+    """
+    if not memory_monitor.tracing():
+        response_object = {
+            'status': 'fail',
+            'message': 'Memory tracing is disabled.'
+        }
+        return api_response(response_object), 404
+    memory_monitor.snapshot(current_app)
     response_object = {
         'status': 'success',
         'data': {
-            'jobs': [j.to_json() for j in jobs],
-            'expenses': [e.to_json() for e in expenses],
-            'user': user.to_json()
+            'pid': os.getpid(),
+            'topGrowers': top_growers(
+                current_app.config['MEMORY_SNAPSHOT_DIR'], os.getpid())
         }
     }
-    return jsonify(response_object), 200
+    return api_response(response_object), 200
@@ -0,0 +1,198 @@
+# services/flask/project/admin/changes.py
+
+"""
+Change log of the jobs and expenses, for clients that keep a local copy.
+
+Every flush that inserts, updates or deletes a ChangeTracked row also inserts
+a row into the changes table, in the same transaction.  Bulk loads with COPY
+don't go through the ORM, so they record a single reset of the table instead
+(see record_reset).  A client's cursor is the id of the last change it has
+seen, and GET /admin/changes?since=<cursor> returns the changes after it.
+
+That only works if the ids become visible in order.  If a transaction with
+a lower id committed after one with a higher id, a client could move its
+cursor past the lower id before it was visible, and never see that change.
+So every transaction that records changes takes an advisory lock first, and
+holds it until it ends.  That serializes the writes to the tracked tables,
+which is fine at this app's write rates.
+
+When STREAM_ENABLED is set, the transaction also sends a notification to the
+clients' change streams.
+"""
+
+import json
+
+from flask import current_app
+from sqlalchemy import event, func, text
+from sqlalchemy.orm import Session
+
+from project import db
+from project.admin.models import Change, ChangeTracked
+from project.admin.serializers import (job_serializer,
+                                       one_time_expense_serializer,
+                                       recurring_expense_serializer)
+from project.invalidation import MAX_PAYLOAD_SIZE
+from project.replicas import mark_written
+
+
+# Advisory lock held by the transactions that record changes
+CHANGES_LOCK_ID = 0x6368616e676573
+
+# Most changes returned by one request
+CHANGES_PAGE_SIZE = 1000
+
+# mapping from the names of the tracked tables to the serializers of their
+# rows
+change_serializers = {
+    serializer.model.__tablename__: serializer
+    for serializer in (job_serializer, one_time_expense_serializer,
+                       recurring_expense_serializer)
+}
+
+
+def _notify(connection, changes):
+    """
+    Tell the change streams about the changes (see project/stream.py).  The
+    notification is only delivered if the transaction commits.
+    """
+    # The lock is held, so the ids of the changes were the last ones handed
+    # out, and currval is the latest cursor
+    cursor = connection.execute(
+        text("SELECT currval(pg_get_serial_sequence('changes', 'id'))")
+    ).scalar()
+    message = {'cursor': cursor,
+               'changes': [[change['table_name'], change['row_id'],
+                            change['operation'].value]
+                           for change in changes]}
+    payload = json.dumps(message, separators=(',', ':'))
+    if len(payload.encode()) > MAX_PAYLOAD_SIZE:
+        payload = json.dumps({'cursor': cursor}, separators=(',', ':'))
+    connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                       channel=current_app.config['STREAM_CHANNEL'],
+                       payload=payload)
+
+
+def _insert_changes(connection, changes):
+    connection.execute(text('SELECT pg_advisory_xact_lock(:id)'),
+                       id=CHANGES_LOCK_ID)
+    connection.execute(Change.__table__.insert(), changes)
+    if current_app.config['STREAM_ENABLED']:
+        _notify(connection, changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def record_flush(session, flush_context):
+    """Record the changes to ChangeTracked rows that a flush wrote"""
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, ChangeTracked):
+            changes.append({'table_name': obj.__tablename__,
+                            'row_id': obj.id,
+                            'operation': Change.Operation.UPSERT})
+    for obj in session.dirty:
+        if (isinstance(obj, ChangeTracked) and
+                session.is_modified(obj, include_collections=False)):
+            changes.append({'table_name': obj.__tablename__,
+                            'row_id': obj.id,
+                            'operation': Change.Operation.UPSERT})
+    for obj in session.deleted:
+        if isinstance(obj, ChangeTracked):
+            changes.append({'table_name': obj.__tablename__,
+                            'row_id': obj.id,
+                            'operation': Change.Operation.DELETE})
+    if changes:
+        _insert_changes(session.connection(), changes)
+
+
+def record_reset(table_name):
+    """
+    Record that rows were bulk loaded into a table, in the current
+    transaction.  Clients reload the whole table when they see it.
+    """
+    _insert_changes(db.session.connection(),
+                    [{'table_name': table_name, 'row_id': None,
+                      'operation': Change.Operation.RESET}])
+    mark_written(db.session)
+
+
+def current_cursor():
+    """The id of the latest change, or 0 if there are none"""
+    return db.session.query(func.max(Change.id)).scalar() or 0
+
+
+def cursor_expired(since):
+    """
+    Whether changes after ``since`` have been pruned.  prune_changes always
+    keeps the latest change, so a gap before the oldest one means that the
+    client missed something.
+    """
+    oldest = db.session.query(func.min(Change.id)).scalar()
+    return oldest is not None and since < oldest - 1
+
+
+def changes_since(since, limit=CHANGES_PAGE_SIZE):
+    """
+    Return (changes, cursor, more): up to ``limit`` changes after ``since``,
+    the cursor to ask for the next ones with, and whether there are more.
+    Only the last change of each row is returned, with the row's current
+    data for upserts.  A reset replaces the earlier changes of its table.
+    """
+    rows = (db.session.query(Change.id, Change.table_name, Change.row_id,
+                             Change.operation)
+            .filter(Change.id > since)
+            .order_by(Change.id)
+            .limit(limit + 1)
+            .all())
+    more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].id if rows else since
+
+    # mapping from (table, row id) to the last change of the row.  Dicts
+    # keep their insertion order, so re-inserting keeps them in id order.
+    latest = {}
+    for change_id, table_name, row_id, operation in rows:
+        if operation is Change.Operation.RESET:
+            for key in [key for key in latest if key[0] == table_name]:
+                del latest[key]
+        latest.pop((table_name, row_id), None)
+        latest[(table_name, row_id)] = operation
+
+    upserted = {}
+    for (table_name, row_id), operation in latest.items():
+        if operation is Change.Operation.UPSERT:
+            upserted.setdefault(table_name, []).append(row_id)
+    data = {}
+    for table_name, row_ids in upserted.items():
+        serializer = change_serializers[table_name]
+        query = serializer.query().filter(serializer.model.id.in_(row_ids))
+        for row in serializer.dump_rows(query):
+            data[(table_name, row['id'])] = row
+
+    changes = []
+    for (table_name, row_id), operation in latest.items():
+        change = {'table': table_name}
+        if operation is not Change.Operation.RESET:
+            change['id'] = row_id
+        row = data.get((table_name, row_id))
+        if operation is Change.Operation.UPSERT and row is not None:
+            change['operation'] = operation.value
+            change['row'] = row
+        elif operation is Change.Operation.UPSERT:
+            # deleted by a change after this page
+            change['operation'] = Change.Operation.DELETE.value
+        else:
+            change['operation'] = operation.value
+        changes.append(change)
+    return changes, cursor, more
+
+
+def prune_changes(age):
+    """
+    Delete the changes that are older than the timedelta ``age``, except the
+    latest one.  Clients whose cursors are older have to reload everything.
+    Returns the number of changes deleted.
+    """
+    return (Change.query
+            .filter(Change.changed_at < func.now() - age,
+                    Change.id < current_cursor())
+            .delete(synchronize_session=False))
@@ -0,0 +1,325 @@
+# services/flask/project/admin/csv_io.py
+
+import csv
+import datetime
+import enum
+import functools
+import io
+
+import psycopg2
+from sqlalchemy import or_, types
+
+from project import db
+from project.admin.models import Job, OneTimeExpense, RecurringExpense
+
+
+# Flush the CSV buffer to the client once it holds this many characters
+CSV_CHUNK_SIZE = 64 * 1024
+
+# Number of rows fetched from the server-side cursor at a time
+CSV_FETCH_SIZE = 1000
+
+# Number of valid rows sent to the database in each COPY FROM STDIN
+CSV_IMPORT_CHUNK_SIZE = 10000
+
+# Maximum number of row errors included in an import result
+CSV_IMPORT_MAX_ERRORS = 100
+
+TRUE_STRINGS = {'true', 't', 'yes', 'y', '1'}
+FALSE_STRINGS = {'false', 'f', 'no', 'n', '0'}
+
+
+class CSVImportError(Exception):
+    """Raised when a CSV file can't be imported at all"""
+
+
+class CSVImportResult(object):
+    """Counts of imported and rejected rows, plus the first few errors"""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < CSV_IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def to_json(self):
+        return {
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
+
+
+def _column_parser(column):
+    """
+    Build a function that validates a CSV field for the given column and
+    converts it to the text that COPY expects.  Empty fields are NULL.
+    """
+    name = column.name
+    enum_class = getattr(column.type, 'enum_class', None)
+
+    if enum_class is not None:
+        # Enum columns store the member names.  Accept values or names.
+        names = {member.value: member.name for member in enum_class}
+        names.update({member.name: member.name for member in enum_class})
+        valid_values = ', '.join(f"'{member.value}'" for member in enum_class)
+
+        def parse(value):
+            try:
+                return names[value]
+            except KeyError:
+                raise ValueError(f"Invalid '{name}' value. The valid values "
+                                 f"for '{name}' are: {valid_values}")
+    elif isinstance(column.type, types.Boolean):
+        def parse(value):
+            lowered = value.lower()
+            if lowered in TRUE_STRINGS:
+                return 'true'
+            if lowered in FALSE_STRINGS:
+                return 'false'
+            raise ValueError(f"'{name}' must be true or false.")
+    elif isinstance(column.type, types.Float):
+        def parse(value):
+            try:
+                return repr(float(value))
+            except ValueError:
+                raise ValueError(f"'{name}' must be a number.")
+    elif isinstance(column.type, types.Date):
+        # strptime is slow and imported files repeat the same dates a lot
+        @functools.lru_cache(maxsize=4096)
+        def parse(value):
+            try:
+                date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f"'{name}' must be a date in the format "
+                                 "YYYY-MM-DD.")
+            return date.isoformat()
+    else:
+        length = getattr(column.type, 'length', None)
+
+        def parse(value):
+            if length and len(value) > length:
+                raise ValueError(f"'{name}' must be at most {length} "
+                                 "characters long.")
+            return value
+
+    if column.nullable:
+        return lambda value: parse(value) if value else None
+
+    def parse_required(value):
+        if not value:
+            raise ValueError(f"'{name}' is required.")
+        return parse(value)
+    return parse_required
+
+
+class CSVTable(object):
+    """
+    CSV representation of a table.  The CSV columns are the table's columns,
+    in table order, except those marked with info={'csv': False}.  Enums are
+    written as their values and dates in ISO format.  ``start_column`` and
+    ``end_column`` are the columns that a date range is matched against: a
+    row is included if its dates overlap the range.
+
+    Imports accept the same format.  The id column is optional and ignored,
+    since new rows always get new ids.  If ``end_defaults_to_start`` is set,
+    an empty end date is filled in with the start date, like the model does.
+    """
+
+    def __init__(self, model, start_column, end_column,
+                 end_defaults_to_start=False):
+        self.model = model
+        self.columns = [column for column in model.__table__.columns
+                        if column.info.get('csv', True)]
+        self.header = [column.name for column in self.columns]
+        self.start_column = start_column
+        self.end_column = end_column
+        self.end_defaults_to_start = end_defaults_to_start
+        self._enum_indexes = [i for i, column in enumerate(self.columns)
+                              if getattr(column.type, 'enum_class', None)]
+        self.import_columns = [column for column in self.columns
+                               if not column.primary_key]
+        self._parsers = [_column_parser(column)
+                         for column in self.import_columns]
+        self._start_position = self.import_columns.index(start_column)
+        self._end_position = self.import_columns.index(end_column)
+        self._copy_sql = (f'COPY {model.__tablename__} (' +
+                          ', '.join(c.name for c in self.import_columns) +
+                          ') FROM STDIN WITH (FORMAT csv)')
+
+    def date_criteria(self, start_date=None, end_date=None):
+        """Filter criteria for rows that overlap the given date range"""
+        criteria = []
+        if start_date:
+            if self.end_column.nullable:
+                criteria.append(or_(self.end_column >= start_date,
+                                    self.end_column.is_(None)))
+            else:
+                criteria.append(self.end_column >= start_date)
+        if end_date:
+            criteria.append(self.start_column <= end_date)
+        return criteria
+
+    def query(self, start_date=None, end_date=None):
+        """
+        Query the rows in the date range, ordered by id.  The results are
+        streamed from a server-side cursor, so only CSV_FETCH_SIZE rows are
+        held in memory at a time.
+        """
+        return (db.session.query(*self.columns)
+                .filter(*self.date_criteria(start_date, end_date))
+                .order_by(self.model.id)
+                .execution_options(stream_results=True)
+                .yield_per(CSV_FETCH_SIZE))
+
+    def to_csv_row(self, row):
+        row = list(row)
+        for i in self._enum_indexes:
+            if isinstance(row[i], enum.Enum):
+                row[i] = row[i].value
+        return row
+
+    def stream(self, start_date=None, end_date=None):
+        """Generate the CSV text of the rows in chunks"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        for row in self.query(start_date, end_date):
+            writer.writerow(self.to_csv_row(row))
+            if buffer.tell() >= CSV_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _field_indexes(self, header):
+        """
+        Map each import column to its index in the CSV header.  Raises a
+        CSVImportError if the header has unknown or missing columns.
+        """
+        unknown = set(header) - set(self.header)
+        if unknown:
+            raise CSVImportError('Unknown columns: ' +
+                                 ', '.join(sorted(unknown)))
+        indexes = []
+        for column in self.import_columns:
+            if column.name in header:
+                indexes.append(header.index(column.name))
+            elif column.nullable or (self.end_defaults_to_start and
+                                     column is self.end_column):
+                indexes.append(None)
+            else:
+                raise CSVImportError(f"Missing column: '{column.name}'")
+        return indexes
+
+    def parse_row(self, row, indexes):
+        """
+        Validate a CSV row and convert it to a list of COPY values in the
+        order of self.import_columns.  Raises ValueError if it is invalid.
+        """
+        values = []
+        for position, (parse, index) in enumerate(zip(self._parsers,
+                                                      indexes)):
+            field = row[index].strip() if index is not None else ''
+            if (not field and self.end_defaults_to_start and
+                    position == self._end_position):
+                field = values[self._start_position]
+            values.append(parse(field))
+        start = values[self._start_position]
+        end = values[self._end_position]
+        # ISO dates compare correctly as strings
+        if end is not None and end < start:
+            raise ValueError(f"'{self.end_column.name}' must be equal to or "
+                             f"later than '{self.start_column.name}'")
+        return values
+
+    def import_lines(self, lines, chunk_size=CSV_IMPORT_CHUNK_SIZE):
+        """
+        Import CSV text from an iterable of lines.  Rows are parsed as they
+        are read and loaded into the database with COPY FROM STDIN, one chunk
+        at a time.  Invalid rows are reported in the result instead of
+        aborting the import.  The caller is responsible for committing.
+        """
+        reader = csv.reader(lines)
+        header = [name.strip() for name in next(reader, [])]
+        if not header:
+            raise CSVImportError('The CSV file is empty.')
+        indexes = self._field_indexes(header)
+        width = len(header)
+        result = CSVImportResult()
+        cursor = db.session.connection().connection.cursor()
+        try:
+            chunk = []
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != width:
+                    result.add_error(
+                        reader.line_num,
+                        f'Expected {width} fields, got {len(row)}.')
+                    continue
+                try:
+                    chunk.append((reader.line_num,
+                                  self.parse_row(row, indexes)))
+                except ValueError as e:
+                    result.add_error(reader.line_num, str(e))
+                    continue
+                if len(chunk) >= chunk_size:
+                    self._copy_chunk(cursor, chunk, result)
+                    chunk = []
+            if chunk:
+                self._copy_chunk(cursor, chunk, result)
+        finally:
+            cursor.close()
+        return result
+
+    def copy_rows(self, cursor, rows):
+        """
+        Load rows of COPY values, in the order of self.import_columns, with a
+        single COPY FROM STDIN.  The rows are not validated.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(self._copy_sql, buffer)
+
+    def _copy_chunk(self, cursor, chunk, result):
+        """
+        COPY a chunk of parsed rows.  If the database rejects the chunk, roll
+        it back to a savepoint and COPY each half of it again, down to single
+        rows, so that only the rows that the database rejects are reported
+        and the others are still imported.
+        """
+        cursor.execute('SAVEPOINT csv_import_chunk')
+        try:
+            self.copy_rows(cursor, (values for _, values in chunk))
+        except psycopg2.Error as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT csv_import_chunk')
+            cursor.execute('RELEASE SAVEPOINT csv_import_chunk')
+            if len(chunk) == 1:
+                result.add_error(chunk[0][0],
+                                 str(e).strip().split('\n')[0])
+                return
+            middle = len(chunk) // 2
+            self._copy_chunk(cursor, chunk[:middle], result)
+            self._copy_chunk(cursor, chunk[middle:], result)
+        else:
+            cursor.execute('RELEASE SAVEPOINT csv_import_chunk')
+            result.imported += len(chunk)
+
+
+# mapping from table names to their CSV representations
+csv_tables = {
+    'jobs': CSVTable(Job, Job.__table__.c.start_date,
+                     Job.__table__.c.end_date, end_defaults_to_start=True),
+    'one_time_expenses': CSVTable(OneTimeExpense,
+                                  OneTimeExpense.__table__.c.date,
+                                  OneTimeExpense.__table__.c.date),
+    'recurring_expenses': CSVTable(RecurringExpense,
+                                   RecurringExpense.__table__.c.start_date,
+                                   RecurringExpense.__table__.c.end_date),
+}
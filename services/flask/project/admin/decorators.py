@@ -1,19 +1,24 @@
 from functools import wraps
 
-from flask import jsonify, request
+from flask import g, request
 
+from project import row_cache
 from project.admin.models import User
+from project.admin.serializers import api_response, user_serializer
 
 
 class users_only(object):
     """
     Check that the client has an auth_token for a valid user.  If so, run the
-    decorated route_function.  Optinally pass the user info into the route
-    function if pass_user is set to True.
+    decorated route_function.  Optinally pass the user info (as serialized
+    by user_serializer) into the route function if pass_user is set to True.
+    If token_param is set, the token can also be sent in that query
+    parameter, for clients like EventSource that can't set headers.
     """
 
-    def __init__(self, pass_user=False):
+    def __init__(self, pass_user=False, token_param=None):
         self.pass_user = pass_user
+        self.token_param = token_param
 
     def __call__(self, route_function, **kwargs):
 
@@ -26,21 +31,45 @@ class users_only(object):
             auth_header = request.headers.get('Authorization')
             if auth_header:
                 auth_token = auth_header.split(' ')[1]
+            elif self.token_param:
+                auth_token = request.args.get(self.token_param)
+            else:
+                auth_token = None
+            if auth_token:
                 decode_response, _ = User.decode_auth_token(auth_token)
 
                 # If the token is invalid, deny access
                 if not isinstance(decode_response, int):
                     response_object['message'] = 'Auth token invalid.'
-                    return jsonify(response_object), 401
+                    return api_response(response_object), 401
 
                 # If the token is valid, allow access
-                user = User.query.filter_by(id=decode_response).first()
+                g.user_id = decode_response
                 if self.pass_user:
+                    user = row_cache.get(user_serializer, decode_response)
                     return route_function(user, **kwargs)
                 else:
                     return route_function(**kwargs)
 
-            # If no auth_header was provided, return an error
-            return jsonify(response_object), 401
+            # If no token was provided, return an error
+            return api_response(response_object), 401
 
         return wrapper
+
+
+def replica_reads(route_function):
+    """
+    Let the queries of the decorated route_function go to a read replica
+    (see project/replicas.py).  Only for routes that never write, and whose
+    clients don't need to read their own writes straight away.
+    """
+
+    @wraps(route_function)
+    def wrapper(**kwargs):
+        g.replica_reads = True
+        try:
+            return route_function(**kwargs)
+        finally:
+            g.replica_reads = False
+
+    return wrapper
@@ -73,7 +73,41 @@ class User(db.Model):
             return ('Invalid token. Please log in again.', None)
 
 
-class Job(db.Model):
+class ChangeTracked(object):
+    """
+    Mixin for models whose changes are recorded in the changes table (see
+    project/admin/changes.py), so that clients can sync them incrementally.
+    """
+    # Left out of CSV exports and imports
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           server_default=db.func.now(),
+                           onupdate=db.func.now(), info={'csv': False})
+
+
+class Change(db.Model):
+    """
+    An entry in the change log.  The ids are handed out in commit order, so
+    a client that has seen every change up to some id only needs the changes
+    after it.  A reset means that the table was bulk loaded and has to be
+    reloaded as a whole.
+    """
+
+    class Operation(enum.Enum):
+        UPSERT = 'upsert'
+        DELETE = 'delete'
+        RESET = 'reset'
+
+    __tablename__ = 'changes'
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer)
+    operation = db.Column(db.Enum(Operation, name='change_operation'),
+                          nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False,
+                           server_default=db.func.now())
+
+
+class Job(ChangeTracked, db.Model):
 
     class PaidTo(enum.Enum):
         GLADTIMEAUDIO = 'Gladtime Audio'
@@ -135,7 +169,7 @@ class Job(db.Model):
         }
 
 
-class OneTimeExpense(db.Model):
+class OneTimeExpense(ChangeTracked, db.Model):
 
     class PaidBy(enum.Enum):
         GLADTIME_AUDIO = 'Gladtime Audio'
@@ -187,7 +221,7 @@ class OneTimeExpense(db.Model):
         }
 
 
-class RecurringExpense(db.Model):
+class RecurringExpense(ChangeTracked, db.Model):
 
     class Category(enum.Enum):
         HOUSING = 'Housing'
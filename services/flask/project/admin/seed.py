@@ -0,0 +1,208 @@
+# services/flask/project/admin/seed.py
+
+import datetime
+import itertools
+import random
+
+from project import db
+from project.admin.csv_io import csv_tables
+from project.admin.models import Job, OneTimeExpense, RecurringExpense
+
+
+# Number of rows generated and sent to the database in each COPY
+SEED_CHUNK_SIZE = 50000
+
+# Default date range, which is fixed so that a seed gives the same rows on
+# any day
+DEFAULT_END_DATE = datetime.date(2018, 12, 31)
+DEFAULT_YEARS = 5
+
+# Default relative weights of the enum values, keyed by (table, column).
+# Enum columns that aren't listed here are uniformly distributed.
+DEFAULT_ENUM_WEIGHTS = {
+    ('jobs', 'paid_to'): {
+        Job.PaidTo.GLADTIMEAUDIO.value: 6,
+        Job.PaidTo.TYLER.value: 2,
+        Job.PaidTo.MEGHAN.value: 1,
+        Job.PaidTo.TMSEPARATELY.value: 1,
+    },
+    ('jobs', 'worked_by'): {
+        Job.WorkedBy.TYLER.value: 5,
+        Job.WorkedBy.MEGHAN.value: 2,
+        Job.WorkedBy.TYLER_AND_MEGHAN.value: 3,
+    },
+    ('jobs', 'confirmation'): {
+        Job.Confirmation.CONFIRMED.value: 8,
+        Job.Confirmation.PENCILLED_IN.value: 2,
+    },
+    ('one_time_expenses', 'category'): {
+        OneTimeExpense.Category.BUSINESS_EQUIPMENT.value: 2,
+        OneTimeExpense.Category.BUSINESS_SUPPLIES.value: 3,
+        OneTimeExpense.Category.GASOLINE.value: 8,
+        OneTimeExpense.Category.VEHICLE_MAINTENANCE.value: 1,
+        OneTimeExpense.Category.TRAVEL_EXPENSE.value: 2,
+        OneTimeExpense.Category.ENTERTAINMENT.value: 2,
+        OneTimeExpense.Category.FOOD.value: 10,
+    },
+    ('recurring_expenses', 'recurrence'): {
+        RecurringExpense.Recurrence.MONTHLY.value: 10,
+        RecurringExpense.Recurrence.EVERY_OTHER_MONTH.value: 2,
+        RecurringExpense.Recurrence.EVERY_SIX_MONTHS.value: 2,
+        RecurringExpense.Recurrence.ONCE_PER_YEAR.value: 3,
+    },
+}
+
+DESCRIPTION_WORDS = [
+    'audio', 'lighting', 'setup', 'teardown', 'wedding', 'conference',
+    'festival', 'rental', 'mixing', 'stage', 'monitor', 'cables', 'van',
+    'lunch', 'hotel', 'parking', 'repair', 'speaker', 'microphone', 'studio',
+]
+
+
+class SyntheticData(object):
+    """
+    Deterministic generator of realistic looking rows for the jobs,
+    one_time_expenses and recurring_expenses tables.
+
+    Dates fall between ``start_date`` and ``end_date``, which default to
+    the DEFAULT_YEARS up to DEFAULT_END_DATE, except for the end dates of
+    recurring expenses, which may be up to a month later.  A ``date_skew``
+    greater than 1 makes recent dates more common (like a business that
+    grows over time), while 1 spreads them uniformly.  ``enum_weights``
+    overrides DEFAULT_ENUM_WEIGHTS for the given (table, column) keys.
+
+    Each table gets its own random generator derived from ``seed``, so the
+    rows of one table don't depend on how many rows another table gets.  The
+    same seed, row count and chunk size always produce the same rows.
+    """
+
+    def __init__(self, seed=0, start_date=None, end_date=None, date_skew=2.0,
+                 enum_weights=None):
+        self.seed = seed
+        self.end_date = end_date or DEFAULT_END_DATE
+        self.start_date = start_date or (
+                self.end_date - datetime.timedelta(DEFAULT_YEARS * 365))
+        if self.end_date < self.start_date:
+            raise ValueError('end_date must be equal to or later than '
+                             'start_date')
+        self.date_skew = date_skew
+        self.enum_weights = dict(DEFAULT_ENUM_WEIGHTS)
+        self.enum_weights.update(enum_weights or {})
+        self._span = (self.end_date - self.start_date).days
+        # ISO strings for every day in the range, indexed by day offset
+        self._dates = [(self.start_date + datetime.timedelta(i)).isoformat()
+                       for i in range(self._span + 32)]
+
+    def _rng(self, table):
+        return random.Random(f'{self.seed}:{table}')
+
+    def _enum(self, rng, table, column, k):
+        """k enum member names drawn with the configured weights"""
+        column_type = csv_tables[table].model.__table__.c[column].type
+        enum_class = column_type.enum_class
+        weights = self.enum_weights.get((table, column), {})
+        members = list(enum_class)
+        cum_weights = list(itertools.accumulate(
+                weights.get(member.value, 1 if not weights else 0)
+                for member in members))
+        return rng.choices([member.name for member in members],
+                           cum_weights=cum_weights, k=k)
+
+    def _day_offsets(self, rng, k):
+        exponent = 1.0 / self.date_skew
+        span = self._span + 1
+        return [int(span * rng.random() ** exponent) for _ in range(k)]
+
+    def _names(self, rng, prefix, pool_size, k):
+        """Names from a pool where a few names are much more common"""
+        names = [f'{prefix} {i:04d}' for i in range(pool_size)]
+        cum_weights = list(itertools.accumulate(1.0 / (i + 1)
+                                                for i in range(pool_size)))
+        return rng.choices(names, cum_weights=cum_weights, k=k)
+
+    def _descriptions(self, rng, k):
+        return [' '.join(rng.sample(DESCRIPTION_WORDS, 3)) for _ in range(k)]
+
+    def _amounts(self, rng, mu, sigma, k):
+        return [round(rng.lognormvariate(mu, sigma), 2) for _ in range(k)]
+
+    def _booleans(self, rng, probability, k):
+        return ['true' if rng.random() < probability else 'false'
+                for _ in range(k)]
+
+    def jobs(self, rng, k):
+        starts = self._day_offsets(rng, k)
+        # most jobs last a single day, a few run for up to a week, but none
+        # past the end date
+        durations = rng.choices(range(7), cum_weights=[70, 85, 92, 96, 98,
+                                                       99, 100], k=k)
+        return {
+            'client': self._names(rng, 'Client', 500, k),
+            'description': self._descriptions(rng, k),
+            'amount_paid': self._amounts(rng, 6.0, 0.8, k),
+            'paid_to': self._enum(rng, 'jobs', 'paid_to', k),
+            'worked_by': self._enum(rng, 'jobs', 'worked_by', k),
+            'confirmation': self._enum(rng, 'jobs', 'confirmation', k),
+            'has_paid': self._booleans(rng, 0.7, k),
+            'start_date': [self._dates[d] for d in starts],
+            'end_date': [self._dates[min(d + n, self._span)]
+                         for d, n in zip(starts, durations)],
+        }
+
+    def one_time_expenses(self, rng, k):
+        return {
+            'merchant': self._names(rng, 'Merchant', 300, k),
+            'description': self._descriptions(rng, k),
+            'amount_spent': self._amounts(rng, 3.5, 1.0, k),
+            'date': [self._dates[d] for d in self._day_offsets(rng, k)],
+            'paid_by': self._enum(rng, 'one_time_expenses', 'paid_by', k),
+            'tax_deductible': self._booleans(rng, 0.6, k),
+            'category': self._enum(rng, 'one_time_expenses', 'category', k),
+        }
+
+    def recurring_expenses(self, rng, k):
+        starts = self._day_offsets(rng, k)
+        # about a third of recurring expenses have ended
+        end_dates = [None if rng.random() < 0.66 else
+                     self._dates[d + rng.randrange(1, 32)]
+                     for d in starts]
+        return {
+            'merchant': self._names(rng, 'Merchant', 100, k),
+            'description': self._descriptions(rng, k),
+            'amount': self._amounts(rng, 4.5, 0.7, k),
+            'tax_deductible': self._booleans(rng, 0.3, k),
+            'category': self._enum(rng, 'recurring_expenses', 'category', k),
+            'recurrence': self._enum(rng, 'recurring_expenses', 'recurrence',
+                                     k),
+            'paid_by': self._enum(rng, 'recurring_expenses', 'paid_by', k),
+            'start_date': [self._dates[d] for d in starts],
+            'end_date': end_dates,
+        }
+
+    def chunks(self, table, count, chunk_size=SEED_CHUNK_SIZE):
+        """Generate ``count`` rows of COPY values for a table, in chunks"""
+        rng = self._rng(table)
+        generate = getattr(self, table)
+        names = [column.name for column in csv_tables[table].import_columns]
+        remaining = count
+        while remaining > 0:
+            k = min(chunk_size, remaining)
+            columns = generate(rng, k)
+            yield list(zip(*[columns[name] for name in names]))
+            remaining -= k
+
+    def load(self, table, count, chunk_size=SEED_CHUNK_SIZE, progress=None):
+        """
+        Generate and COPY ``count`` rows into a table.  ``progress`` is
+        called with the number of rows loaded so far after every chunk.  The
+        caller is responsible for committing.
+        """
+        cursor = db.session.connection().connection.cursor()
+        loaded = 0
+        for rows in self.chunks(table, count, chunk_size):
+            csv_tables[table].copy_rows(cursor, rows)
+            loaded += len(rows)
+            if progress:
+                progress(loaded)
+        cursor.close()
+        return loaded
@@ -0,0 +1,299 @@
+# services/flask/project/admin/serializers.py
+
+import datetime
+import enum
+import json
+import logging
+import struct
+from operator import attrgetter
+
+import msgpack
+from flask import current_app, request
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+from project import db
+from project.admin.models import User, Job, OneTimeExpense, RecurringExpense
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _default(o):
+    """Fallback for types that the stdlib json module can't encode"""
+    if isinstance(o, enum.Enum):
+        return o.value
+    # Naive datetimes are UTC.  Without an offset, browsers would read them
+    # as local times.
+    if isinstance(o, datetime.datetime) and o.tzinfo is None:
+        return o.isoformat() + '+00:00'
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return o.isoformat()
+    raise TypeError(f'{type(o).__name__} is not JSON serializable')
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """
+    Encoder used by flask.jsonify.  Encodes enums and dates the same way as
+    the dumps function below so that both paths produce identical output.
+    """
+
+    def default(self, o):
+        try:
+            return _default(o)
+        except TypeError:
+            return super().default(o)
+
+
+def _dumps_stdlib(obj):
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+
+def _dumps_orjson(obj):
+    # orjson encodes dates and enums natively, in the same format as _default
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC)
+
+
+# mapping from JSON_BACKEND config values to encoder functions
+json_backends = {
+    'json': _dumps_stdlib,
+    'orjson': _dumps_orjson if orjson else _dumps_stdlib,
+    'auto': _dumps_orjson if orjson else _dumps_stdlib,
+}
+
+
+def init_json_backend(app):
+    """Pick the encoder of the app's JSON_BACKEND.  Called by create_app, so
+    that an unknown backend stops the app from starting."""
+    backend = app.config.setdefault('JSON_BACKEND', 'auto')
+    if backend not in json_backends:
+        raise ValueError(f'Unknown JSON_BACKEND {backend!r}')
+    if backend == 'orjson' and orjson is None:
+        logger.warning("JSON_BACKEND is 'orjson', but orjson isn't "
+                       "installed.  Using the json module instead.")
+    app.extensions['json_dumps'] = json_backends[backend]
+
+
+def dumps(obj):
+    """Encode obj as JSON bytes using the configured JSON_BACKEND"""
+    return current_app.extensions['json_dumps'](obj)
+
+
+# MessagePack extension type for dates.  The payload is the number of days
+# since 1970-01-01 as a big-endian signed 32 bit integer.
+MSGPACK_DATE_EXT = 1
+EPOCH_DATE = datetime.date(1970, 1, 1)
+EPOCH_DATETIME = datetime.datetime(1970, 1, 1)
+
+
+def _msgpack_default(o):
+    """Encode the types that msgpack can't handle on its own"""
+    if isinstance(o, enum.Enum):
+        return o.value
+    # datetime is a subclass of date, so it has to be checked first.  Naive
+    # datetimes are treated as UTC.
+    if isinstance(o, datetime.datetime):
+        delta = o.replace(tzinfo=None) - EPOCH_DATETIME
+        seconds = delta.days * 86400 + delta.seconds
+        return msgpack.Timestamp(seconds, delta.microseconds * 1000)
+    if isinstance(o, datetime.date):
+        days = (o - EPOCH_DATE).days
+        return msgpack.ExtType(MSGPACK_DATE_EXT, struct.pack('>i', days))
+    raise TypeError(f'{type(o).__name__} is not MessagePack serializable')
+
+
+def _msgpack_ext_hook(code, data):
+    if code == MSGPACK_DATE_EXT:
+        return EPOCH_DATE + datetime.timedelta(struct.unpack('>i', data)[0])
+    return msgpack.ExtType(code, data)
+
+
+def packb(obj):
+    """Encode obj as MessagePack bytes"""
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def unpackb(data):
+    """Decode MessagePack bytes, turning dates and timestamps back into
+    date and (UTC) datetime objects"""
+    return msgpack.unpackb(data, raw=False, ext_hook=_msgpack_ext_hook,
+                           timestamp=3)
+
+
+# mapping from the mimetypes that the API can respond with to their encoders.
+# The first entry is the default.
+response_encoders = {
+    'application/json': dumps,
+    'application/msgpack': packb,
+}
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def response_mimetype():
+    """Pick the response mimetype that best matches the Accept header"""
+    accept = request.accept_mimetypes
+    if not accept:
+        return 'application/json'
+    best = accept.best_match(['application/json'] + list(MSGPACK_MIMETYPES),
+                             default='application/json')
+    if best in MSGPACK_MIMETYPES:
+        return 'application/msgpack'
+    return best
+
+
+def api_response(response_object):
+    """
+    Drop-in replacement for jsonify.  Encodes the response object as JSON
+    with the fast encoder, or as MessagePack if the client asked for it.
+    """
+    mimetype = response_mimetype()
+    response = current_app.response_class(
+            response_encoders[mimetype](response_object), mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def get_payload():
+    """
+    Drop-in replacement for request.get_json() that also accepts
+    MessagePack request bodies.  Returns None if the body can't be decoded.
+    """
+    if request.mimetype in MSGPACK_MIMETYPES:
+        try:
+            return unpackb(request.get_data())
+        except (ValueError, msgpack.UnpackException):
+            return None
+    return request.get_json()
+
+
+class ModelSerializer(object):
+    """
+    Precompiled serializer for a model.  ``fields`` is a list of
+    (json_key, attribute_name) pairs.  Values are handed to the encoder
+    untouched, so dates and enums are never converted in Python.  Keys listed
+    in ``omit_if_none`` are left out of the output when their value is None.
+
+    Collections can also be serialized column-wise (see dump_columns), with
+    enum columns dictionary-encoded as indexes into the list of enum values.
+    """
+
+    def __init__(self, model, fields, omit_if_none=()):
+        self.model = model
+        self.keys = tuple(key for key, _ in fields)
+        self.columns = tuple(getattr(model, attr) for _, attr in fields)
+        self._get_values = attrgetter(*[attr for _, attr in fields])
+        self._omit_if_none = tuple(omit_if_none)
+
+        # For each enum column, a mapping from enum member to its index in
+        # the column's dictionary
+        self._enum_codes = {}
+        for key, column in zip(self.keys, self.columns):
+            enum_class = getattr(column.type, 'enum_class', None)
+            if enum_class is not None:
+                self._enum_codes[key] = {member: code for code, member
+                                         in enumerate(enum_class)}
+
+    def query(self):
+        """
+        Query only the serialized columns.  The rows that this returns are
+        plain tuples, which skips building model instances entirely.
+        """
+        return db.session.query(*self.columns)
+
+    def dump_row(self, row):
+        """Serialize a tuple of values in the order of self.keys"""
+        data = dict(zip(self.keys, row))
+        for key in self._omit_if_none:
+            if data[key] is None:
+                del data[key]
+        return data
+
+    def dump(self, obj):
+        """Serialize a single model instance"""
+        return self.dump_row(self._get_values(obj))
+
+    def dump_rows(self, rows):
+        """Serialize the tuples returned by self.query()"""
+        return [self.dump_row(row) for row in rows]
+
+    def dump_columns(self, rows):
+        """
+        Serialize the tuples returned by self.query() as one array per field.
+        Enum columns become {'dictionary': [...], 'codes': [...]}, where each
+        code is an index into the dictionary (or None for NULL).
+        """
+        rows = list(rows)
+        if rows:
+            values_by_key = zip(self.keys, zip(*rows))
+        else:
+            values_by_key = ((key, ()) for key in self.keys)
+        columns = {}
+        for key, values in values_by_key:
+            codes = self._enum_codes.get(key)
+            if codes is None:
+                columns[key] = list(values)
+            else:
+                columns[key] = {
+                    'dictionary': [member.value for member in codes],
+                    'codes': [None if v is None else codes[v]
+                              for v in values],
+                }
+        return {'format': 'columns', 'length': len(rows), 'columns': columns}
+
+    def dump_many(self, rows):
+        """
+        Serialize the tuples returned by self.query() in the format that the
+        client asked for with the 'format' query parameter: 'rows' (the
+        default, a list of objects) or 'columns'.
+        """
+        if request.args.get('format') == 'columns':
+            return self.dump_columns(rows)
+        return self.dump_rows(rows)
+
+
+user_serializer = ModelSerializer(User, [
+    ('id', 'id'),
+    ('username', 'username'),
+    ('email', 'email'),
+])
+
+job_serializer = ModelSerializer(Job, [
+    ('id', 'id'),
+    ('client', 'client'),
+    ('description', 'description'),
+    ('amountPaid', 'amount_paid'),
+    ('paidTo', 'paid_to'),
+    ('workedBy', 'worked_by'),
+    ('confirmation', 'confirmation'),
+    ('hasPaid', 'has_paid'),
+    ('startDate', 'start_date'),
+    ('endDate', 'end_date'),
+])
+
+one_time_expense_serializer = ModelSerializer(OneTimeExpense, [
+    ('id', 'id'),
+    ('merchant', 'merchant'),
+    ('description', 'description'),
+    ('amountSpent', 'amount_spent'),
+    ('date', 'date'),
+    ('paidBy', 'paid_by'),
+    ('taxDeductible', 'tax_deductible'),
+    ('category', 'category'),
+])
+
+recurring_expense_serializer = ModelSerializer(RecurringExpense, [
+    ('id', 'id'),
+    ('merchant', 'merchant'),
+    ('description', 'description'),
+    ('amount', 'amount'),
+    ('taxDeductible', 'tax_deductible'),
+    ('category', 'category'),
+    ('recurrence', 'recurrence'),
+    ('paidBy', 'paid_by'),
+    ('startDate', 'start_date'),
+    ('endDate', 'end_date'),
+], omit_if_none=['endDate'])
@@ -0,0 +1 @@
+# services/flask/project/benchmarks/__init__.py
@@ -0,0 +1,493 @@
+# services/flask/project/benchmarks/endpoints.py
+
+import datetime
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+
+from sqlalchemy import event
+
+from project import db
+from project.admin.models import User, Job, OneTimeExpense, RecurringExpense
+from project.admin.seed import SyntheticData
+
+
+DEFAULT_SCALES = (1000, 100000, 1000000)
+BENCHMARK_USER = {
+    'username': 'benchmarkUser',
+    'email': 'benchmark@email.com',
+    'password': 'benchmarkPassword'
+}
+JOB_PAYLOAD = {
+    'client': 'Benchmark Client',
+    'description': 'Benchmark job',
+    'amountPaid': 500.0,
+    'paidTo': 'Gladtime Audio',
+    'workedBy': 'Tyler',
+    'confirmation': 'Confirmed',
+    'hasPaid': False,
+    'startDate': '2018-03-01',
+    'endDate': '2018-03-02',
+}
+ONE_TIME_EXPENSE_PAYLOAD = {
+    'merchant': 'Benchmark Merchant',
+    'description': 'Benchmark expense',
+    'amountSpent': 25.0,
+    'date': '2018-03-01',
+    'paidBy': 'Tyler',
+    'taxDeductible': True,
+    'category': 'Food',
+}
+RECURRING_EXPENSE_PAYLOAD = {
+    'merchant': 'Benchmark Merchant',
+    'description': 'Benchmark recurring expense',
+    'amount': 100.0,
+    'taxDeductible': False,
+    'category': 'Utilities',
+    'recurrence': 'Monthly',
+    'paidBy': 'Tyler',
+    'startDate': '2018-03-01',
+}
+IMPORT_CSV = ('client,description,amount_paid,paid_to,worked_by,'
+              'confirmation,has_paid,start_date,end_date\n' +
+              'Benchmark Client,Imported job,100,Tyler,Tyler,Confirmed,'
+              'true,2018-03-01,2018-03-01\n' * 100)
+
+
+class Endpoint(object):
+    """
+    A request to benchmark.  ``path`` and ``body`` can be callables that
+    take the BenchmarkContext, which lets them refer to rows that exist at
+    the current scale.  ``setup`` runs untimed before every request.
+    """
+
+    def __init__(self, name, method, path, body=None, auth=True,
+                 content_type='application/json', setup=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.auth = auth
+        self.content_type = content_type
+        self.setup = setup
+
+    def prepare(self, context):
+        """Return the (path, body, headers) for the next request"""
+        if self.setup:
+            self.setup(context)
+        path = self.path(context) if callable(self.path) else self.path
+        body = self.body(context) if callable(self.body) else self.body
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = self.content_type
+        if self.auth:
+            headers['Authorization'] = f'Bearer {context.token}'
+        return path, body, headers
+
+
+class BenchmarkContext(object):
+    """State shared by the endpoints during a benchmark run"""
+
+    def __init__(self, app):
+        self.app = app
+        self.token = None
+        self.user_id = None
+        self.job_id = None
+        self.one_time_expense_id = None
+        self.recurring_expense_id = None
+        self.deletable_id = None
+        self.counter = 0
+        self.month_start = None
+
+    def unique(self):
+        self.counter += 1
+        return self.counter
+
+
+def _insert_job(context):
+    with context.app.app_context():
+        context.deletable_id = _insert(Job(
+            'Benchmark Client', 'To be deleted', 1.0, 'Tyler', 'Tyler',
+            'Confirmed', False, '2018-03-01'))
+
+
+def _insert_one_time_expense(context):
+    with context.app.app_context():
+        context.deletable_id = _insert(OneTimeExpense(
+            'Benchmark Merchant', 'To be deleted', 1.0, '2018-03-01',
+            'Tyler', True, 'Food'))
+
+
+def _insert(row):
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+def _register_body(context):
+    n = context.unique()
+    return {
+        'username': f'benchmarkUser{n}',
+        'email': f'benchmark{n}@email.com',
+        'password': 'benchmarkPassword',
+        'isPrivateDevice': True
+    }
+
+
+def _events_path(context, days):
+    """Events for the ``days`` days up to the end of the calendar month"""
+    end = context.month_start + datetime.timedelta(41)
+    start = end - datetime.timedelta(days)
+    return (f'/admin/events?startDate={start.isoformat()}'
+            f'&endDate={end.isoformat()}')
+
+
+ENDPOINTS = [
+    Endpoint('ping', 'GET', '/admin/ping', auth=False),
+    Endpoint('login', 'POST', '/admin/login', auth=False, body={
+        'username': BENCHMARK_USER['username'],
+        'password': BENCHMARK_USER['password'],
+        'isPrivateDevice': True
+    }),
+    Endpoint('register', 'POST', '/admin/register', auth=False,
+             body=_register_body),
+    Endpoint('logout', 'GET', '/admin/logout'),
+    Endpoint('status', 'GET', '/admin/status'),
+    Endpoint('list users', 'GET', '/admin/users', auth=False),
+    Endpoint('get user', 'GET', lambda c: f'/admin/users/{c.user_id}',
+             auth=False),
+    Endpoint('list jobs', 'GET', '/admin/jobs'),
+    Endpoint('list jobs (columns)', 'GET', '/admin/jobs?format=columns'),
+    Endpoint('get job', 'GET', lambda c: f'/admin/jobs/{c.job_id}'),
+    Endpoint('add job', 'POST', '/admin/jobs', body=JOB_PAYLOAD),
+    Endpoint('update job', 'POST', lambda c: f'/admin/jobs/{c.job_id}',
+             body=JOB_PAYLOAD),
+    Endpoint('delete job', 'DELETE',
+             lambda c: f'/admin/jobs/{c.deletable_id}', setup=_insert_job),
+    Endpoint('list one time expenses', 'GET', '/admin/one-time-expenses',
+             auth=False),
+    Endpoint('get one time expense', 'GET',
+             lambda c: f'/admin/one-time-expenses/{c.one_time_expense_id}',
+             auth=False),
+    Endpoint('add one time expense', 'POST', '/admin/one-time-expenses',
+             body=ONE_TIME_EXPENSE_PAYLOAD, auth=False),
+    Endpoint('update one time expense', 'POST',
+             lambda c: f'/admin/one-time-expenses/{c.one_time_expense_id}',
+             body=ONE_TIME_EXPENSE_PAYLOAD, auth=False),
+    Endpoint('delete one time expense', 'DELETE',
+             lambda c: f'/admin/one-time-expenses/{c.deletable_id}',
+             auth=False, setup=_insert_one_time_expense),
+    Endpoint('list recurring expenses', 'GET', '/admin/recurring-expenses',
+             auth=False),
+    Endpoint('get recurring expense', 'GET',
+             lambda c: f'/admin/recurring-expenses/{c.recurring_expense_id}',
+             auth=False),
+    Endpoint('add recurring expense', 'POST', '/admin/recurring-expenses',
+             body=RECURRING_EXPENSE_PAYLOAD, auth=False),
+    Endpoint('events (month)', 'GET', lambda c: _events_path(c, 41)),
+    Endpoint('events (month, columns)', 'GET',
+             lambda c: _events_path(c, 41) + '&format=columns'),
+    Endpoint('events (year)', 'GET', lambda c: _events_path(c, 365)),
+    Endpoint('export jobs (year)', 'GET',
+             lambda c: '/admin/export/jobs.csv?startDate=' +
+             (c.month_start - datetime.timedelta(365)).isoformat()),
+    Endpoint('import jobs', 'POST', '/admin/import/jobs.csv',
+             body=IMPORT_CSV, content_type='text/csv'),
+]
+
+
+class TestClientTransport(object):
+    """Send requests through the Flask test client"""
+
+    name = 'test-client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body, headers):
+        response = self.client.open(path, method=method, data=body,
+                                    headers=headers)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+    def close(self):
+        pass
+
+
+class HTTPTransport(object):
+    """Send requests over HTTP to a running server, reusing one connection"""
+
+    name = 'http'
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port)
+
+    def request(self, method, path, body, headers):
+        while True:
+            # the connection is only open if it sent a request before
+            reused = self.connection.sock is not None
+            try:
+                self.connection.request(method, path, body=body,
+                                        headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError):
+                # The server closed an idle keep-alive connection before it
+                # got the request, so send it again on a fresh connection.
+                # Anything else may have reached the server, and sending a
+                # write again would duplicate it.
+                self.connection.close()
+                if not reused:
+                    raise
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                raise
+
+    def close(self):
+        self.connection.close()
+
+
+class GunicornServer(object):
+    """Run the app in a gunicorn process for the duration of a benchmark"""
+
+    def __init__(self, database_url, workers=1, startup_timeout=30):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        env = dict(os.environ, ENVIRONMENT_TYPE='production',
+                   DATABASE_URL=database_url)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-b',
+             f'127.0.0.1:{self.port}', '-w', str(workers), 'manage:app'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.url = f'http://127.0.0.1:{self.port}'
+        deadline = time.time() + startup_timeout
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError('gunicorn did not start')
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class QueryCounter(object):
+    """Count the statements that the app executes"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+    def remove(self):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def populate(scale, seed=0):
+    """Recreate the tables and fill them with ``scale`` rows per table"""
+    db.drop_all()
+    db.create_all()
+    data = SyntheticData(seed)
+    data.load('jobs', scale)
+    data.load('one_time_expenses', scale)
+    data.load('recurring_expenses', max(scale // 100, 10))
+    db.session.add(User(**BENCHMARK_USER))
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    return data
+
+
+def make_context(app, transport, data):
+    """
+    Look up the rows that the endpoints refer to and log in.  Must be called
+    from within an app context.
+    """
+    context = BenchmarkContext(app)
+    context.user_id = User.query.filter_by(
+        username=BENCHMARK_USER['username']).first().id
+    context.job_id = db.session.query(db.func.min(Job.id)).scalar()
+    context.one_time_expense_id = db.session.query(
+        db.func.min(OneTimeExpense.id)).scalar()
+    context.recurring_expense_id = db.session.query(
+        db.func.min(RecurringExpense.id)).scalar()
+    # The most recent month, which is where skewed data is densest
+    context.month_start = (data.end_date.replace(day=1) -
+                           datetime.timedelta(7))
+    db.session.remove()
+    login = ENDPOINTS[1]
+    _, body = transport.request('POST', login.path, json.dumps(login.body),
+                                {'Content-Type': 'application/json'})
+    context.token = json.loads(body.decode())['auth_token']
+    return context
+
+
+def run_endpoint(endpoint, transport, context, iterations, warmup,
+                 counter=None):
+    """Time ``iterations`` requests to an endpoint and summarize them"""
+    latencies = []
+    sizes = []
+    queries = []
+    statuses = {}
+    for i in range(warmup + iterations):
+        path, body, headers = endpoint.prepare(context)
+        before = counter.count if counter else 0
+        start = time.perf_counter()
+        status, data = transport.request(endpoint.method, path, body, headers)
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        sizes.append(len(data))
+        if counter:
+            queries.append(counter.count - before)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies.sort()
+    return {
+        'endpoint': endpoint.name,
+        'method': endpoint.method,
+        'iterations': iterations,
+        'statuses': statuses,
+        'latency_ms': {
+            'min': latencies[0],
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+            'mean': statistics.mean(latencies),
+        },
+        'queries': statistics.median(queries) if queries else None,
+        'response_bytes': int(statistics.median(sizes)),
+    }
+
+
+def run_benchmarks(app, scales=DEFAULT_SCALES, iterations=20, warmup=2,
+                   gunicorn=False, endpoint_filter=None, log=print):
+    """
+    Benchmark every endpoint at each scale and return the results as a
+    JSON serializable dict.  The app's database is dropped and repopulated
+    for each scale.
+
+    Requests are made outside of any app context, so that every request
+    gets a fresh database session the way that it does in production.
+    """
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'transport': 'http' if gunicorn else 'test-client',
+            'iterations': iterations,
+            'warmup': warmup,
+        },
+        'results': [],
+    }
+    endpoints = [e for e in ENDPOINTS
+                 if not endpoint_filter or endpoint_filter in e.name]
+    for scale in scales:
+        log(f'Populating the database with {scale} rows per table...')
+        with app.app_context():
+            data = populate(scale)
+            engine = db.engine
+        server = None
+        counter = None
+        if gunicorn:
+            server = GunicornServer(app.config['SQLALCHEMY_DATABASE_URI'])
+            transport = HTTPTransport(server.url)
+        else:
+            transport = TestClientTransport(app)
+            counter = QueryCounter(engine)
+        try:
+            with app.app_context():
+                context = make_context(app, transport, data)
+            for endpoint in endpoints:
+                result = run_endpoint(endpoint, transport, context,
+                                      iterations, warmup, counter)
+                result['scale'] = scale
+                results['results'].append(result)
+                log(format_result(result))
+        finally:
+            transport.close()
+            if counter:
+                counter.remove()
+            if server:
+                server.stop()
+    return results
+
+
+def format_result(result):
+    latency = result['latency_ms']
+    queries = result['queries']
+    return (f"{result['scale']:>8} {result['endpoint']:<28} "
+            f"p50 {latency['p50']:9.2f}ms  p99 {latency['p99']:9.2f}ms  "
+            f"queries {'-' if queries is None else queries:>4}  "
+            f"bytes {result['response_bytes']:>10}")
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare two result sets.  Returns a list of (key, baseline_p50,
+    current_p50, change) for endpoints whose median latency got worse by
+    more than ``threshold``, plus changes in query counts.
+    """
+    def index(results):
+        return {(r['scale'], r['endpoint']): r for r in results['results']}
+
+    old = index(baseline)
+    regressions = []
+    for key, result in sorted(index(current).items()):
+        if key not in old:
+            continue
+        before = old[key]['latency_ms']['p50']
+        after = result['latency_ms']['p50']
+        change = (after - before) / before if before else 0
+        queries_changed = old[key]['queries'] != result['queries']
+        if change > threshold or queries_changed:
+            regressions.append({
+                'scale': key[0],
+                'endpoint': key[1],
+                'baseline_p50_ms': before,
+                'current_p50_ms': after,
+                'change': change,
+                'baseline_queries': old[key]['queries'],
+                'current_queries': result['queries'],
+            })
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
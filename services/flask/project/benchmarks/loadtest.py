@@ -0,0 +1,425 @@
+# services/flask/project/benchmarks/loadtest.py
+"""
+Load generator that replays user sessions against a running server.
+
+Each virtual user behaves like someone using the client app: the app checks
+the user's status, the user logs in, the calendar loads the events of the
+visible month, and then the user browses back and forth through months and
+sometimes adds, edits or deletes jobs and expenses.  The number of virtual
+users is ramped up in steps, and throughput, the rates of server errors and
+of 4xx responses, and latency percentiles are reported per route for every
+step.
+
+This module only uses the standard library, so it can be run from anywhere:
+
+    python -m project.benchmarks.loadtest --url http://localhost:5001 \\
+        --username Tyler --password somepassword --max-users 50
+"""
+
+import argparse
+import calendar
+import datetime
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+
+# Route names group together requests whose paths only differ by ids
+ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+
+def route_name(method, path):
+    return method + ' ' + ID_PATTERN.sub('/<id>', path.split('?')[0])
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class Stats(object):
+    """Thread-safe latency and status records, grouped by route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.routes = {}
+
+    def record(self, route, latency, status):
+        """Record a request.  A status of 0 means that no response came."""
+        with self.lock:
+            latencies, errors = self.routes.setdefault(route, ([], [0, 0]))
+            latencies.append(latency)
+            if status == 0 or status >= 500:
+                errors[0] += 1
+            elif status >= 400:
+                errors[1] += 1
+
+    def summary(self):
+        """Summarize and clear the records made since the last summary"""
+        with self.lock:
+            elapsed = time.time() - self.started
+            routes = self.routes
+            self.started = time.time()
+            self.routes = {}
+        summary = {}
+        for route, (latencies, errors) in sorted(routes.items()):
+            latencies.sort()
+            summary[route] = {
+                'requests': len(latencies),
+                'throughput': len(latencies) / elapsed if elapsed else 0,
+                'error_rate': errors[0] / len(latencies),
+                # expired tokens and rejected payloads, which may mean that
+                # the sessions are broken rather than the server
+                'client_error_rate': errors[1] / len(latencies),
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'max_ms': latencies[-1] * 1000,
+            }
+        return elapsed, summary
+
+
+class Client(object):
+    """A keep-alive HTTP connection that records every request in Stats"""
+
+    def __init__(self, url, stats, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+
+    def _connect(self):
+        self.connection = http.client.HTTPConnection(self.host, self.port,
+                                                     timeout=self.timeout)
+
+    def request(self, method, path, payload=None, params=None):
+        """Send a request and return (status, decoded JSON body or None)"""
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        headers = {}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        status, data = 0, b''
+        while True:
+            start = time.perf_counter()
+            reused = self.connection is not None
+            try:
+                if not reused:
+                    self._connect()
+                self.connection.request(method, self.prefix + path,
+                                        body=body, headers=headers)
+                response = self.connection.getresponse()
+                status, data = response.status, response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+            except (http.client.RemoteDisconnected, BrokenPipeError):
+                self.close()
+                # The server closed an idle keep-alive connection before it
+                # got the request, so send it again on a fresh connection.
+                # Anything else, like a timeout, may have reached the
+                # server, and sending a write again would duplicate it.
+                if reused:
+                    continue
+            except (http.client.HTTPException, OSError):
+                self.close()
+            break
+        latency = time.perf_counter() - start
+        self.stats.record(route_name(method, path), latency, status)
+        try:
+            return status, json.loads(data.decode())
+        except ValueError:
+            return status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def visible_range(month):
+    """
+    First and last visible days of a month view in the calendar, which
+    shows whole weeks starting on Sunday.
+    """
+    first = month.replace(day=1)
+    last = month.replace(day=calendar.monthrange(month.year,
+                                                 month.month)[1])
+    start = first - datetime.timedelta((first.weekday() + 1) % 7)
+    end = last + datetime.timedelta(6 - (last.weekday() + 1) % 7)
+    return start.isoformat(), end.isoformat()
+
+
+def add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1,
+                        day=1)
+
+
+class Session(object):
+    """
+    One visit to the app.  The weights of the actions after the first
+    calendar load mirror how the calendar is used: mostly browsing months,
+    occasionally creating or editing events.
+    """
+
+    ACTIONS = [
+        ('browse_month', 60),
+        ('reload_month', 10),
+        ('add_job', 8),
+        ('update_job', 6),
+        ('delete_job', 3),
+        ('add_expense', 8),
+        ('update_expense', 3),
+        ('delete_expense', 2),
+    ]
+
+    def __init__(self, client, rng, username, password, actions, think_time):
+        self.client = client
+        self.rng = rng
+        self.username = username
+        self.password = password
+        self.actions = actions
+        self.think_time = think_time
+        self.month = datetime.date.today().replace(day=1)
+        self.jobs = []
+        self.expenses = []
+
+    def think(self):
+        if self.think_time:
+            time.sleep(self.rng.expovariate(1.0 / self.think_time))
+
+    def run(self):
+        self.client.token = None
+        # App.componentDidMount checks for a stored token first
+        self.client.request('GET', '/admin/status')
+        status, data = self.client.request('POST', '/admin/login', {
+            'username': self.username,
+            'password': self.password,
+            'isPrivateDevice': self.rng.random() < 0.5,
+        })
+        if status != 200 or not data:
+            return
+        self.client.token = data['auth_token']
+        self.client.request('GET', '/admin/status')
+        self.load_month()
+        names = [name for name, _ in self.ACTIONS]
+        weights = [weight for _, weight in self.ACTIONS]
+        for _ in range(self.actions):
+            self.think()
+            getattr(self, self.rng.choices(names, weights)[0])()
+        self.client.request('GET', '/admin/logout')
+
+    def load_month(self):
+        start, end = visible_range(self.month)
+        status, data = self.client.request(
+            'GET', '/admin/events', params={'startDate': start,
+                                            'endDate': end})
+        if status == 200 and data:
+            self.jobs = [j['id'] for j in data['data']['jobs']]
+            self.expenses = [e['id'] for e in data['data']['expenses']]
+
+    def browse_month(self):
+        self.month = add_months(self.month, self.rng.choice([-1, -1, 1]))
+        self.load_month()
+
+    def reload_month(self):
+        self.load_month()
+
+    def random_day(self):
+        start, _ = visible_range(self.month)
+        day = (datetime.date(*map(int, start.split('-'))) +
+               datetime.timedelta(self.rng.randrange(35)))
+        return day.isoformat()
+
+    def job_payload(self):
+        start = self.random_day()
+        return {
+            'client': f'Load Test Client {self.rng.randrange(100)}',
+            'description': 'Load test job',
+            'amountPaid': round(self.rng.uniform(100, 2000), 2),
+            'paidTo': self.rng.choice(['Gladtime Audio', 'Tyler', 'Meghan']),
+            'workedBy': self.rng.choice(['Tyler', 'Meghan',
+                                         'Tyler and Meghan']),
+            'confirmation': self.rng.choice(['Confirmed', 'Pencilled In']),
+            'hasPaid': self.rng.random() < 0.5,
+            'startDate': start,
+            'endDate': start,
+        }
+
+    def expense_payload(self):
+        return {
+            'merchant': f'Load Test Merchant {self.rng.randrange(100)}',
+            'description': 'Load test expense',
+            'amountSpent': round(self.rng.uniform(5, 200), 2),
+            'date': self.random_day(),
+            'paidBy': self.rng.choice(['Tyler', 'Meghan']),
+            'taxDeductible': self.rng.random() < 0.5,
+            'category': self.rng.choice(['Gasoline', 'Food',
+                                         'Business Supplies']),
+        }
+
+    def add_job(self):
+        status, data = self.client.request('POST', '/admin/jobs',
+                                           self.job_payload())
+        if status == 201 and data:
+            self.jobs.append(data['job']['id'])
+
+    def update_job(self):
+        if self.jobs:
+            job_id = self.rng.choice(self.jobs)
+            self.client.request('POST', f'/admin/jobs/{job_id}',
+                                self.job_payload())
+
+    def delete_job(self):
+        if self.jobs:
+            job_id = self.jobs.pop(self.rng.randrange(len(self.jobs)))
+            self.client.request('DELETE', f'/admin/jobs/{job_id}')
+
+    def add_expense(self):
+        status, data = self.client.request('POST', '/admin/one-time-expenses',
+                                           self.expense_payload())
+        if status == 201 and data:
+            self.expenses.append(data['expense']['id'])
+
+    def update_expense(self):
+        if self.expenses:
+            expense_id = self.rng.choice(self.expenses)
+            self.client.request('POST',
+                                f'/admin/one-time-expenses/{expense_id}',
+                                self.expense_payload())
+
+    def delete_expense(self):
+        if self.expenses:
+            expense_id = self.expenses.pop(
+                    self.rng.randrange(len(self.expenses)))
+            self.client.request('DELETE',
+                                f'/admin/one-time-expenses/{expense_id}')
+
+
+class VirtualUser(threading.Thread):
+    """Runs sessions back to back until it is stopped"""
+
+    def __init__(self, number, options, stats, stop_event):
+        super().__init__(daemon=True)
+        self.options = options
+        self.stop_event = stop_event
+        self.rng = random.Random(f'{options.seed}:{number}')
+        self.client = Client(options.url, stats, options.timeout)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            Session(self.client, self.rng, self.options.username,
+                    self.options.password, self.options.actions,
+                    self.options.think_time).run()
+        self.client.close()
+
+
+def format_summary(users, elapsed, summary):
+    lines = [f'--- {users} users, {elapsed:.1f}s ---']
+    total = sum(r['requests'] for r in summary.values())
+    errors = sum(r['requests'] * r['error_rate'] for r in summary.values())
+    client_errors = sum(r['requests'] * r['client_error_rate']
+                        for r in summary.values())
+    lines.append(f'{"route":<40}{"req/s":>8}{"err%":>7}{"4xx%":>7}'
+                 f'{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+    for route, r in summary.items():
+        lines.append(f'{route:<40}{r["throughput"]:>8.1f}'
+                     f'{r["error_rate"] * 100:>7.1f}'
+                     f'{r["client_error_rate"] * 100:>7.1f}'
+                     f'{r["p50_ms"]:>9.1f}{r["p95_ms"]:>9.1f}'
+                     f'{r["p99_ms"]:>9.1f}{r["max_ms"]:>9.1f}')
+    lines.append(f'{"total":<40}{total / elapsed if elapsed else 0:>8.1f}'
+                 f'{errors / total * 100 if total else 0:>7.1f}'
+                 f'{client_errors / total * 100 if total else 0:>7.1f}')
+    return '\n'.join(lines)
+
+
+def run(options, log=print):
+    """
+    Ramp the number of virtual users from ``start_users`` to ``max_users``
+    in steps of ``step_users``, holding each step for ``step_seconds``.
+    Returns the per-step summaries.
+    """
+    stats = Stats()
+    stop_event = threading.Event()
+    users = []
+    steps = []
+    count = options.start_users
+    try:
+        while count <= options.max_users:
+            while len(users) < count:
+                user = VirtualUser(len(users), options, stats, stop_event)
+                user.start()
+                users.append(user)
+            stats.reset()
+            time.sleep(options.step_seconds)
+            elapsed, summary = stats.summary()
+            steps.append({'users': count, 'seconds': elapsed,
+                          'routes': summary})
+            log(format_summary(count, elapsed, summary))
+            if count == options.max_users:
+                break
+            count = min(count + options.step_users, options.max_users)
+    finally:
+        stop_event.set()
+        for user in users:
+            user.join(options.timeout)
+    return steps
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:5001',
+                        help='Base URL of the server.')
+    parser.add_argument('--username', default='Tyler')
+    parser.add_argument('--password', default='somepassword')
+    parser.add_argument('--start-users', type=int, default=1)
+    parser.add_argument('--step-users', type=int, default=5)
+    parser.add_argument('--max-users', type=int, default=25)
+    parser.add_argument('--step-seconds', type=float, default=30)
+    parser.add_argument('--actions', type=int, default=20,
+                        help='Actions per session after the first load.')
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help='Mean seconds between actions. 0 disables.')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='File to write the results to as JSON.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    steps = run(options)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump({'options': vars(options), 'steps': steps},
+                      output_file, indent=2)
+    errors = sum(r['error_rate'] * r['requests']
+                 for step in steps for r in step['routes'].values())
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,744 @@
+# services/flask/project/cache.py
+
+"""
+Caches shared by the app.
+
+The Cache extension holds one backend per app, picked by CACHE_BACKEND:
+
+* 'memory': an LRU dict in the process.  It's the default, and needs nothing
+  else, but every worker has its own copy.
+* 'redis': any server that speaks the Redis protocol, at CACHE_URL.
+* 'postgres': an UNLOGGED table, in the database at CACHE_URL or the app's
+  own database.  Unlogged tables skip the write-ahead log, and are emptied
+  after a crash, which is fine for a cache.
+
+Every backend has the same interface, with bulk get/set/delete and a time
+to live in seconds for each key (None means the key doesn't expire).  Code
+that caches something asks for a Namespace, which keeps its keys apart from
+everyone else's and counts its hits and misses.  If a shared backend can't
+be reached, the namespace logs the error and carries on as if the cache were
+empty, so the app keeps working on the database alone.
+"""
+
+import datetime
+import hashlib
+import logging
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from flask import current_app
+from sqlalchemy import (Column, Float, LargeBinary, MetaData, Table, Text,
+                        create_engine)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheError(Exception):
+    """Raised by a backend that can't reach its server"""
+
+
+class RedisError(CacheError):
+    """An error reply from a Redis server"""
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that holds at most ``maxsize`` keys, evicting the
+    least recently used key to make room for a new one.  Counts hits, misses
+    and evictions, so that the size can be tuned.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# ========
+# BACKENDS
+# ========
+
+
+class CacheBackend(object):
+    """
+    Base class of the backends.  Keys are strings, values are anything that
+    serializers.packb can encode.  Subclasses implement the bulk methods.
+    """
+
+    name = None
+
+    def get_many(self, keys):
+        """A dict of the values of the keys that are in the cache"""
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl=None):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """Delete every key that starts with prefix"""
+        raise NotImplementedError
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Keeps the values in an LRUCache in this process.  The values aren't
+    copied, so callers mustn't modify what they get back.
+    """
+
+    name = 'memory'
+
+    def __init__(self, maxsize=10000):
+        self._lru = LRUCache(maxsize)
+
+    def get_many(self, keys):
+        now = time.time()
+        values = {}
+        for key in keys:
+            entry = self._lru.get(key)
+            if entry is None:
+                continue
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= now:
+                self._lru.delete(key)
+                continue
+            values[key] = value
+        return values
+
+    def set_many(self, mapping, ttl=None):
+        expires_at = None if ttl is None else time.time() + ttl
+        for key, value in mapping.items():
+            self._lru.set(key, (expires_at, value))
+
+    def delete_many(self, keys):
+        for key in keys:
+            self._lru.delete(key)
+
+    def delete_prefix(self, prefix):
+        self.delete_many([k for k in self._lru.keys() if k.startswith(prefix)])
+
+    def stats(self):
+        return self._lru.stats()
+
+
+class RedisBackend(CacheBackend):
+    """
+    A client for the small part of the Redis protocol (RESP) that a cache
+    needs: GET, MGET, SET with PX, DEL and SCAN.  Commands for several keys
+    are pipelined in a single round trip.  Each thread has its own
+    connection, which is reopened after an error.
+
+    ``url`` looks like redis://[:password@]host[:port][/db].
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, timeout=1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read_reply(self, stream):
+        line = stream.readline()
+        if not line.endswith(b'\r\n'):
+            raise CacheError('Connection closed by the Redis server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = stream.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply(stream) for _ in range(length)]
+        raise CacheError(f'Unexpected reply from the Redis server: {line!r}')
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.stream = sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(['AUTH', self.password])
+        if self.db:
+            setup.append(['SELECT', self.db])
+        if setup:
+            self._send(setup)
+
+    def _send(self, commands):
+        self._local.sock.sendall(b''.join(self._encode(c) for c in commands))
+        return [self._read_reply(self._local.stream) for _ in commands]
+
+    def execute(self, *commands):
+        """
+        Send the commands in one round trip, and return their replies.  If
+        a connection that was opened earlier has gone away (say, because the
+        server restarted), the commands are sent again on a new one.  That's
+        safe because all of the commands that the cache uses are idempotent.
+        """
+        reused = getattr(self._local, 'sock', None) is not None
+        try:
+            if not reused:
+                self._connect()
+            return self._send(commands)
+        except (OSError, CacheError) as e:
+            self.close()
+            if reused and not isinstance(e, RedisError):
+                return self.execute(*commands)
+            raise CacheError(str(e)) from e
+
+    def get_many(self, keys):
+        from project.admin.serializers import unpackb
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.execute(['MGET'] + keys)[0]
+        return {key: unpackb(value) for key, value in zip(keys, values)
+                if value is not None}
+
+    def set_many(self, mapping, ttl=None):
+        from project.admin.serializers import packb
+        expiry = [] if ttl is None else ['PX', int(ttl * 1000)]
+        commands = [['SET', key, packb(value)] + expiry
+                    for key, value in mapping.items()]
+        if commands:
+            self.execute(*commands)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self.execute(['DEL'] + keys)
+
+    def delete_prefix(self, prefix):
+        pattern = ''.join('\\' + c if c in '*?[]\\' else c for c in prefix)
+        cursor = '0'
+        while True:
+            cursor, keys = self.execute(
+                ['SCAN', cursor, 'MATCH', pattern + '*', 'COUNT', 1000])[0]
+            cursor = cursor.decode()
+            if keys:
+                self.execute(['DEL'] + keys)
+            if cursor == '0':
+                break
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.stream.close()
+            sock.close()
+        self._local.sock = None
+
+
+cache_metadata = MetaData()
+
+cache_entries = Table(
+    'cache_entries', cache_metadata,
+    Column('key', Text, primary_key=True),
+    Column('value', LargeBinary, nullable=False),
+    # seconds since the epoch, or NULL for keys that don't expire
+    Column('expires_at', Float),
+    prefixes=['UNLOGGED'],
+)
+
+
+class PostgresBackend(CacheBackend):
+    """
+    Keeps the values in the UNLOGGED cache_entries table.  The migrations
+    create it in the app's database, and `python manage.py
+    create-cache-table` in the database at CACHE_URL.  Every call runs in its
+    own short transaction on its own connection, so nothing that's cached is
+    rolled back with a request.  Expired rows are skipped when reading, and
+    deleted at most once every PURGE_INTERVAL seconds when writing.
+    """
+
+    name = 'postgres'
+    PURGE_INTERVAL = 60
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._last_purge = 0
+
+    def _run(self, function):
+        try:
+            with self.engine.begin() as connection:
+                return function(connection)
+        except SQLAlchemyError as e:
+            raise CacheError(str(e)) from e
+
+    def get_many(self, keys):
+        from project.admin.serializers import unpackb
+        keys = list(keys)
+        if not keys:
+            return {}
+        query = cache_entries.select().where(
+                cache_entries.c.key.in_(keys) &
+                ((cache_entries.c.expires_at == None) |  # noqa: E711
+                 (cache_entries.c.expires_at > time.time())))
+        rows = self._run(lambda c: c.execute(query).fetchall())
+        return {row.key: unpackb(row.value) for row in rows}
+
+    def set_many(self, mapping, ttl=None):
+        from project.admin.serializers import packb
+        if not mapping:
+            return
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        statement = insert(cache_entries).values([
+            {'key': key, 'value': packb(value), 'expires_at': expires_at}
+            for key, value in mapping.items()])
+        statement = statement.on_conflict_do_update(
+                index_elements=[cache_entries.c.key],
+                set_={'value': statement.excluded.value,
+                      'expires_at': statement.excluded.expires_at})
+
+        def write(connection):
+            connection.execute(statement)
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                connection.execute(cache_entries.delete().where(
+                        cache_entries.c.expires_at <= now))
+        self._run(write)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self._run(lambda c: c.execute(cache_entries.delete().where(
+                    cache_entries.c.key.in_(keys))))
+
+    def delete_prefix(self, prefix):
+        self._run(lambda c: c.execute(cache_entries.delete().where(
+                cache_entries.c.key.startswith(prefix, autoescape=True))))
+
+    def close(self):
+        self.engine.dispose()
+
+
+# ==========
+# EXTENSIONS
+# ==========
+
+
+class Namespace(object):
+    """
+    A view of the app's cache backend where every key is prefixed with
+    CACHE_KEY_PREFIX and the namespace's name.  ``ttl`` is the default time
+    to live of the keys, in seconds.  Errors from the backend are logged and
+    treated as misses.
+    """
+
+    def __init__(self, cache, name, ttl=None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _prefix(self):
+        return f"{current_app.config['CACHE_KEY_PREFIX']}:{self.name}:"
+
+    def _failed(self, operation, error):
+        self.errors += 1
+        logger.warning('Cache %s in %r failed: %s', operation, self.name,
+                       error)
+
+    def get_many(self, keys):
+        prefix = self._prefix()
+        keys = list(keys)
+        try:
+            found = self.cache.backend.get_many([prefix + str(key)
+                                                 for key in keys])
+        except CacheError as e:
+            self._failed('get', e)
+            found = {}
+        values = {}
+        for key in keys:
+            value = found.get(prefix + str(key))
+            if value is not None:
+                values[key] = value
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, mapping, ttl=None):
+        prefix = self._prefix()
+        try:
+            self.cache.backend.set_many(
+                {prefix + str(key): value for key, value in mapping.items()},
+                self.ttl if ttl is None else ttl)
+        except CacheError as e:
+            self._failed('set', e)
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def delete_many(self, keys):
+        prefix = self._prefix()
+        try:
+            self.cache.backend.delete_many([prefix + str(key)
+                                            for key in keys])
+        except CacheError as e:
+            self._failed('delete', e)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def clear(self):
+        try:
+            self.cache.backend.delete_prefix(self._prefix())
+        except CacheError as e:
+            self._failed('clear', e)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors}
+
+
+class Cache(object):
+    """
+    Flask extension that creates the app's cache backend from its config.
+    The backend lives in app.extensions['cache'].
+    """
+
+    def __init__(self, app=None):
+        self.namespaces = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_URL', None)
+        app.config.setdefault('CACHE_KEY_PREFIX', 'gta')
+        app.config.setdefault('CACHE_MAX_SIZE', 10000)
+        app.extensions['cache'] = self.create_backend(app)
+
+    @staticmethod
+    def create_backend(app):
+        backend = app.config['CACHE_BACKEND']
+        url = app.config['CACHE_URL']
+        if backend == 'memory':
+            return MemoryBackend(app.config['CACHE_MAX_SIZE'])
+        if backend == 'redis':
+            return RedisBackend(url or 'redis://localhost:6379/0')
+        if backend == 'postgres':
+            if url:
+                return PostgresBackend(create_engine(url))
+            from project import db
+            return PostgresBackend(db.get_engine(app))
+        raise ValueError(f'Unknown CACHE_BACKEND {backend!r}')
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    def clear(self):
+        """Delete all of the app's keys, in every namespace"""
+        self.backend.delete_prefix(current_app.config['CACHE_KEY_PREFIX'] +
+                                   ':')
+
+    def namespace(self, name, ttl=None):
+        """The namespace with this name, created on first use"""
+        if name not in self.namespaces:
+            self.namespaces[name] = Namespace(self, name, ttl)
+        return self.namespaces[name]
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'backendStats': self.backend.stats(),
+            'namespaces': {name: namespace.stats()
+                           for name, namespace in self.namespaces.items()},
+        }
+
+
+class RowCache(object):
+    """
+    Read-through cache of single rows, keyed by table name and id, holding
+    each row the way a ModelSerializer dumps it.  It's only used when
+    ROW_CACHE_ENABLED is set, and keeps rows in the 'rows' namespace of the
+    app's cache for ROW_CACHE_TTL seconds.
+
+    Routes that change or delete a row must call invalidate() after
+    committing, which also invalidates the row in the other processes
+    through ``bus``.  The rows returned by get() may be shared, so don't
+    modify them.
+    """
+
+    def __init__(self, cache, bus, app=None):
+        self._rows = cache.namespace('rows')
+        self._bus = bus
+        self._bus.subscribe('rows', self._apply)
+        # Bumped by every invalidation, so that a row loaded while it was
+        # being changed is never put in the cache
+        self._generation = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ROW_CACHE_ENABLED', False)
+        app.config.setdefault('ROW_CACHE_TTL', 3600)
+
+    @staticmethod
+    def key(model, id):
+        return f'{model.__tablename__}:{id}'
+
+    def load(self, serializer, id):
+        """Load a serialized row from the database, or None"""
+        row = serializer.query().filter(serializer.model.id == id).first()
+        if row is None:
+            return None
+        return serializer.dump_row(row)
+
+    def get(self, serializer, id):
+        """The serialized row of serializer.model with this id, or None"""
+        if not current_app.config['ROW_CACHE_ENABLED']:
+            return self.load(serializer, id)
+        key = self.key(serializer.model, id)
+        row = self._rows.get(key)
+        if row is None:
+            generation = self._generation
+            row = self.load(serializer, id)
+            if row is not None and generation == self._generation:
+                self._rows.set(key, row, current_app.config['ROW_CACHE_TTL'])
+        return row
+
+    def invalidate(self, model, id):
+        self._bus.publish({'n': 'rows', 'k': [self.key(model, id)]})
+
+    def _apply(self, message):
+        """Apply an invalidation message from the bus"""
+        if message.get('clear'):
+            self.clear()
+        else:
+            self._generation += 1
+            self._rows.delete_many(message['k'])
+
+    def clear(self):
+        self._generation += 1
+        self._rows.clear()
+
+    def stats(self):
+        return self._rows.stats()
+
+
+class EventsCache(object):
+    """
+    Cache of the jobs and expenses that /events returns for a date window.
+
+    Every day has a generation token, and each cached payload is stored
+    under its window, its filters and a digest of the tokens of the days in
+    the window.  Writing a row gives every day that the row covers a new
+    token, so windows that include any of those days can't be found any
+    more, while windows that don't include them stay cached.  Since the
+    tokens are kept in the cache backend next to the payloads, this works
+    the same with every backend.  With the memory backend, the bus passes
+    the days that were written to the other processes.
+
+    Only used when EVENTS_CACHE_ENABLED is set, and only for windows of at
+    most EVENTS_CACHE_MAX_DAYS days.  Payloads and tokens expire after
+    EVENTS_CACHE_TTL seconds.  Identical loads that run at the same time
+    are coalesced by ``flight``, whether the cache is used or not.
+    """
+
+    def __init__(self, cache, bus, flight, app=None):
+        self._events = cache.namespace('events')
+        self._generations = cache.namespace('event-generations')
+        self._bus = bus
+        self._flight = flight
+        self._bus.subscribe('events', self._apply)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_CACHE_ENABLED', False)
+        app.config.setdefault('EVENTS_CACHE_TTL', 3600)
+        app.config.setdefault('EVENTS_CACHE_MAX_DAYS', 400)
+
+    @staticmethod
+    def _date(value):
+        if isinstance(value, datetime.date):
+            return value
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+    @staticmethod
+    def _days(start, end):
+        return [(start + datetime.timedelta(i)).isoformat()
+                for i in range((end - start).days + 1)]
+
+    def _new_tokens(self, days):
+        tokens = {day: uuid.uuid4().hex[:8] for day in days}
+        self._generations.set_many(tokens,
+                                   current_app.config['EVENTS_CACHE_TTL'])
+        return tokens
+
+    def _window_key(self, start, end, filters):
+        days = self._days(start, end)
+        tokens = self._generations.get_many(days)
+        missing = [day for day in days if day not in tokens]
+        if missing:
+            # A day without a token may have had one that expired or was
+            # evicted, so it gets a new one rather than matching a payload
+            # that was stored before that.
+            tokens.update(self._new_tokens(missing))
+        digest = hashlib.sha1(
+                ''.join(tokens[day] for day in days).encode()).hexdigest()
+        return f'{start}:{end}:{filters}:{digest[:16]}'
+
+    def get(self, start_date, end_date, filters, load):
+        """
+        The payload for the window, from the cache or else from load().
+        ``filters`` is a string with everything else the payload depends on.
+        """
+        config = current_app.config
+        try:
+            start = self._date(start_date)
+            end = self._date(end_date)
+        except (TypeError, ValueError):
+            return load()
+        if not config['EVENTS_CACHE_ENABLED'] or \
+                not 0 <= (end - start).days < config['EVENTS_CACHE_MAX_DAYS']:
+            if not config['SINGLE_FLIGHT_ENABLED']:
+                return load()
+            # like the lists of all rows, these keys don't change with writes
+            from project import db
+            from project.singleflight import visible_transactions
+            return self._flight.do(('events', start, end, filters,
+                                    visible_transactions(db.session)), load)
+        key = self._window_key(start, end, filters)
+        payload = self._events.get(key)
+        if payload is None:
+            def load_and_store():
+                payload = load()
+                self._events.set(key, payload, config['EVENTS_CACHE_TTL'])
+                return payload
+            payload = self._flight.do(('events', key), load_and_store,
+                                      recheck=lambda: self._events.get(key))
+        return payload
+
+    def invalidate(self, *ranges):
+        """
+        Drop the cached windows that overlap any of the (start, end) date
+        ranges, in every process.  Call this after committing.
+        """
+        self._bus.publish({'n': 'events', 'r': [
+            [self._date(start).isoformat(), self._date(end).isoformat()]
+            for start, end in ranges]})
+
+    def invalidate_all(self):
+        self._bus.publish({'n': 'events', 'clear': True})
+
+    def _apply(self, message):
+        """Apply an invalidation message from the bus"""
+        if message.get('clear'):
+            self.clear()
+            return
+        max_days = current_app.config['EVENTS_CACHE_MAX_DAYS']
+        days = set()
+        for start, end in message['r']:
+            start, end = self._date(start), self._date(end)
+            if (end - start).days >= max_days:
+                # a window can't be that long, so nothing else is cached
+                self.clear()
+                return
+            days.update(self._days(start, end))
+        self._new_tokens(days)
+
+    def clear(self):
+        self._events.clear()
+        self._generations.clear()
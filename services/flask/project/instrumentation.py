@@ -0,0 +1,129 @@
+# services/flask/project/instrumentation.py
+
+"""
+Per-request instrumentation of the SQL statements that the app runs.
+
+Every statement that a request runs, on any engine, is counted along with
+the time it took and the rows it returned or changed.  Statements that take
+longer than SQL_SLOW_QUERY_TIME seconds are logged with their parameters.
+A statement that a request runs SQL_REPEATED_QUERY_THRESHOLD times is
+logged once as a likely N+1 query: one query per row of an earlier result,
+where a join or an IN would do.  Statements are compared by their text,
+which is the same for every run of a query, since the values are bound
+parameters.
+
+With SERVER_TIMING_ENABLED, the totals of each response are sent in a
+Server-Timing header, which the developer tools of browsers show next to
+the request.
+"""
+
+import collections
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+# Longest repr of the parameters of a slow statement that is logged
+MAX_LOGGED_PARAMETERS = 1000
+
+
+class QueryStats(object):
+    """The statements of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self.rows = 0
+        self.statements = collections.Counter()
+
+
+def request_stats():
+    """The QueryStats of the current request, or None if it isn't
+    instrumented"""
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+class QueryInstrumentation(object):
+    """
+    Flask extension that collects the QueryStats of each request, if
+    SQL_INSTRUMENTATION_ENABLED is set.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_INSTRUMENTATION_ENABLED', True)
+        app.config.setdefault('SQL_SLOW_QUERY_TIME', 0.5)
+        app.config.setdefault('SQL_REPEATED_QUERY_THRESHOLD', 10)
+        app.config.setdefault('SERVER_TIMING_ENABLED', False)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        # g outlives the request when the app context is reused, as it is
+        # by the test client
+        g.query_stats = None
+        if current_app.config['SQL_INSTRUMENTATION_ENABLED']:
+            g.request_start = time.perf_counter()
+            g.query_stats = QueryStats()
+
+    def _finish(self, response):
+        stats = request_stats()
+        if stats is not None and current_app.config['SERVER_TIMING_ENABLED']:
+            total = (time.perf_counter() - g.request_start) * 1000
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={stats.time * 1000:.1f};desc="{stats.queries} '
+                f'queries, {stats.rows} rows"')
+            response.headers.add('Server-Timing', f'total;dur={total:.1f}')
+        return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(connection, cursor, statement, parameters, context,
+                    executemany):
+    if request_stats() is not None:
+        connection.info.setdefault('query_start', []).append(
+            time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(connection, cursor, statement, parameters, context,
+                   executemany):
+    stats = request_stats()
+    if stats is None or not connection.info.get('query_start'):
+        return
+    duration = time.perf_counter() - connection.info['query_start'].pop()
+    stats.queries += 1
+    stats.time += duration
+    # -1 for server-side cursors, which haven't fetched anything yet
+    stats.rows += max(cursor.rowcount, 0)
+    stats.statements[statement] += 1
+    config = current_app.config
+    if duration >= config['SQL_SLOW_QUERY_TIME']:
+        logger.warning('Slow statement (%.3fs) in %s %s: %s\nParameters: %s',
+                       duration, request.method, request.path, statement,
+                       repr(parameters)[:MAX_LOGGED_PARAMETERS])
+    if stats.statements[statement] == config['SQL_REPEATED_QUERY_THRESHOLD']:
+        logger.warning('Likely N+1 query: %s %s has run this statement %d '
+                       'times: %s', request.method, request.path,
+                       stats.statements[statement], statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed(context):
+    # there's no connection if connecting failed
+    if context.connection is None or request_stats() is None:
+        return
+    starts = context.connection.info.get('query_start')
+    if starts:
+        starts.pop()
@@ -0,0 +1,236 @@
+# services/flask/project/invalidation.py
+
+"""
+Cache invalidation across processes, over Postgres LISTEN/NOTIFY.
+
+When a route changes rows that a cache may hold, it publishes a message
+after committing.  The message is applied to this process's caches straight
+away, and sent with NOTIFY to every other process that runs the app.  Each
+of those has a listener thread, started before its first request, that
+applies the message to its own caches.  This lets every gunicorn worker or
+container cache in its own memory without serving stale data for longer
+than it takes a notification to arrive (usually about a millisecond).
+
+Messages are small JSON objects with the name of the cache (the 'n' key)
+and whatever that cache needs to know, like the keys to drop.  Caches
+register a handler for their name with subscribe().  If the listener loses
+its connection, it may have missed messages, so every subscribed cache is
+cleared when it reconnects.
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+
+from flask import current_app
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must be shorter than 8000 bytes.  Bigger messages are
+# replaced by one that clears the whole cache.
+MAX_PAYLOAD_SIZE = 7900
+
+
+class InvalidationBus(object):
+    """
+    Flask extension that publishes invalidation messages to the other
+    processes, and applies the messages that they publish.  Only used when
+    CACHE_INVALIDATION_ENABLED is set; otherwise messages are just applied
+    to the local caches.
+    """
+
+    def __init__(self, app=None):
+        # Identifies this process, so that it can skip its own messages
+        self.sender = uuid.uuid4().hex[:12]
+        self._handlers = {}
+        self._listener = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_INVALIDATION_ENABLED', False)
+        app.config.setdefault('CACHE_INVALIDATION_CHANNEL',
+                              'cache_invalidation')
+        app.before_first_request(lambda: self.start_listener(app))
+
+    def subscribe(self, name, handler):
+        """
+        Call handler(message) for every message for the cache called name.
+        A message of {'n': name, 'clear': True} means that the handler
+        should drop everything.
+        """
+        self._handlers[name] = handler
+
+    def apply(self, message):
+        handler = self._handlers.get(message['n'])
+        if handler is not None:
+            handler(message)
+
+    def clear_all(self):
+        for name in list(self._handlers):
+            self.apply({'n': name, 'clear': True})
+
+    def encode(self, message):
+        payload = json.dumps(dict(message, w=self.sender),
+                             separators=(',', ':'))
+        if len(payload.encode()) > MAX_PAYLOAD_SIZE:
+            payload = json.dumps({'n': message['n'], 'clear': True,
+                                  'w': self.sender}, separators=(',', ':'))
+        return payload
+
+    def publish(self, message, app=None):
+        """
+        Apply the message here, and send it to the other processes.  Call
+        this after committing the change that the message is about, so that
+        nobody reloads the old data in the meantime.
+        """
+        from project import db
+        app = app or current_app
+        self.apply(message)
+        if not app.config['CACHE_INVALIDATION_ENABLED']:
+            return
+        statement = text('SELECT pg_notify(:channel, :payload)')
+        try:
+            with db.get_engine(app).connect() as connection:
+                connection.execute(
+                    statement.execution_options(autocommit=True),
+                    channel=app.config['CACHE_INVALIDATION_CHANNEL'],
+                    payload=self.encode(message))
+        except Exception:
+            # The change has been committed, so the request has to succeed.
+            # The other processes will serve stale data until the cached
+            # values expire.
+            logger.exception('Could not publish a cache invalidation')
+
+    def handle(self, payload):
+        """Apply a message that was received from NOTIFY"""
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning('Ignoring invalid cache invalidation %r', payload)
+            return
+        if message.pop('w', None) != self.sender:
+            self.apply(message)
+
+    def start_listener(self, app):
+        """
+        Start the listener thread, unless it's disabled or already running
+        in this process.  Called before the app's first request, which
+        happens in each gunicorn worker after it's forked.
+        """
+        if not app.config['CACHE_INVALIDATION_ENABLED']:
+            return None
+        if self._listener is not None and self._pid == os.getpid():
+            return self._listener
+        self._pid = os.getpid()
+        self._listener = Listener(
+            app, app.config['CACHE_INVALIDATION_CHANNEL'], self.handle,
+            reconnected=self.clear_all, name='cache-invalidation-listener')
+        self._listener.start()
+        return self._listener
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+class Listener(threading.Thread):
+    """
+    Thread that LISTENs on a channel with its own connection, which is taken
+    out of the app's pool, or opened to SQLALCHEMY_DIRECT_URI if that's set,
+    and calls handle(payload) for every notification.
+    Reconnects after errors, and then calls reconnected(), since
+    notifications may have been missed in the meantime.  Both are called in
+    an app context.
+    """
+
+    POLL_INTERVAL = 1.0
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, app, channel, handle, reconnected=None,
+                 name='listener'):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.channel = channel
+        self.handle = handle
+        self.reconnected = reconnected
+        self.listening = threading.Event()
+        self._stopped = threading.Event()
+        self._connection = None
+        if (app.config['SQLALCHEMY_PGBOUNCER'] and
+                not app.config['SQLALCHEMY_DIRECT_URI']):
+            logger.warning('Listening on %s through PgBouncer, which only '
+                           'works in session pooling mode', channel)
+
+    def connect(self):
+        from project import db
+        uri = self.app.config['SQLALCHEMY_DIRECT_URI']
+        if uri:
+            engine = create_engine(uri, poolclass=NullPool)
+        else:
+            engine = db.get_engine(self.app)
+        connection = engine.raw_connection()
+        # keep the connection for good, instead of returning it to the pool
+        connection.detach()
+        connection = connection.connection
+        # the pre-ping leaves a transaction open
+        connection.rollback()
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(f'LISTEN "{self.channel}"')
+        cursor.close()
+        return connection
+
+    def run(self):
+        first = True
+        while not self._stopped.is_set():
+            try:
+                self._connection = self.connect()
+                if not first and self.reconnected is not None:
+                    with self.app.app_context():
+                        self.reconnected()
+                first = False
+                self.listening.set()
+                self.listen()
+            except Exception:
+                if self._stopped.is_set():
+                    break
+                logger.exception('Listener on %s failed', self.channel)
+                self.listening.clear()
+                self._close()
+                self._stopped.wait(self.RECONNECT_DELAY)
+        self._close()
+
+    def listen(self):
+        connection = self._connection
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([connection], [], [],
+                                           self.POLL_INTERVAL)
+            if not readable:
+                continue
+            connection.poll()
+            if connection.notifies:
+                with self.app.app_context():
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.handle(notify.payload)
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        self.join(timeout)
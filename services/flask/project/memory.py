@@ -0,0 +1,267 @@
+# services/flask/project/memory.py
+
+"""
+Memory diagnostics of the worker processes, and their recycling.
+
+Workers are replaced once they have grown too big, instead of after a fixed
+number of requests.  Each worker's watermark is MEMORY_RSS_LIMIT megabytes,
+less a random share of up to MEMORY_RSS_JITTER of it, so that workers that
+grow at the same pace don't all restart together.  After a request that
+leaves its resident set size (RSS) above the watermark, a worker tells
+gunicorn to replace it: it stops accepting requests, finishes the ones it
+has, and exits, while the master starts a new worker.  That only happens
+under gunicorn (see gunicorn_config.py), not on the development server.
+
+MEMORY_TRACING_ENABLED is a diagnostic mode that traces the allocations of
+each worker with tracemalloc, which makes allocating slower and takes about
+as much memory again, so it isn't meant to stay on.  While it's on:
+
+- Each route counts its requests and how much the traced memory grew over
+  them.  Other threads allocate at the same time, so that's a guide to the
+  routes that leave memory behind, rather than an exact figure.
+- Each worker takes a snapshot of its allocations MEMORY_SNAPSHOT_INTERVAL
+  seconds after it starts tracing, and writes it to MEMORY_SNAPSHOT_DIR as
+  its baseline.  It takes another one every MEMORY_SNAPSHOT_INTERVAL
+  seconds after that, which replaces its latest snapshot.  The lines of
+  code whose allocations grew the most between the two are the likely
+  leaks.  /admin/memory shows them for the worker that answers, and
+  `python manage.py memory-growers` for any worker, including the ones that
+  have been recycled.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+from flask import current_app, g, request
+
+
+logger = logging.getLogger(__name__)
+
+# Allocations made by the tracing itself and by imports aren't of interest
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def rss():
+    """The resident set size of this process in bytes, or None where it
+    can't be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def snapshot_paths(directory, pid):
+    """The paths of the baseline and the latest snapshot of a process"""
+    return (os.path.join(directory, f'{pid}-first.tracemalloc'),
+            os.path.join(directory, f'{pid}-latest.tracemalloc'))
+
+
+def snapshot_pids(directory):
+    """The processes that have snapshots in directory, most recently
+    written first"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    times = {}
+    for name in names:
+        pid, _, kind = name.partition('-')
+        if pid.isdigit() and kind.endswith('.tracemalloc'):
+            try:
+                mtime = os.path.getmtime(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            times[int(pid)] = max(times.get(int(pid), 0), mtime)
+    return sorted(times, key=times.get, reverse=True)
+
+
+def top_growers(directory, pid, limit=20):
+    """
+    The lines of code whose allocations grew the most between the baseline
+    and the latest snapshot of a process, or None if it doesn't have both.
+    """
+    first, latest = snapshot_paths(directory, pid)
+    try:
+        old = tracemalloc.Snapshot.load(first)
+        new = tracemalloc.Snapshot.load(latest)
+    except FileNotFoundError:
+        return None
+    growers = []
+    for stat in new.compare_to(old, 'lineno')[:limit]:
+        frame = stat.traceback[0]
+        growers.append({
+            'file': frame.filename,
+            'line': frame.lineno,
+            'size': stat.size,
+            'sizeDiff': stat.size_diff,
+            'count': stat.count,
+            'countDiff': stat.count_diff,
+        })
+    return growers
+
+
+class MemoryMonitor(object):
+    """
+    Flask extension that recycles the process when its RSS passes its
+    watermark, and traces its allocations if MEMORY_TRACING_ENABLED is set.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._recycle = None
+        self._recycling = False
+        self._limit = None
+        self._baseline_pid = None
+        self._next_snapshot = None
+        # route: [requests, growth of the traced memory in bytes]
+        self.routes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MEMORY_RSS_LIMIT', None)
+        app.config.setdefault('MEMORY_RSS_JITTER', 0.1)
+        app.config.setdefault('MEMORY_TRACING_ENABLED', False)
+        app.config.setdefault('MEMORY_TRACING_FRAMES', 10)
+        app.config.setdefault('MEMORY_SNAPSHOT_DIR', '/tmp/memory')
+        app.config.setdefault('MEMORY_SNAPSHOT_INTERVAL', 300)
+        app.config.setdefault('MEMORY_MAX_SNAPSHOT_PROCESSES', 10)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    # Recycling
+
+    def watch(self, recycle):
+        """Call recycle() after a request that leaves the RSS of this
+        process above its watermark"""
+        self._recycle = recycle
+        self._recycling = False
+
+    def rss_limit(self, app):
+        """This process's watermark in bytes, or None if there isn't one"""
+        limit = app.config['MEMORY_RSS_LIMIT']
+        if not limit:
+            return None
+        key = (limit, app.config['MEMORY_RSS_JITTER'], os.getpid())
+        if self._limit is None or self._limit[0] != key:
+            # not the random module, whose state forked workers may share
+            share = random.SystemRandom().uniform(0, key[1])
+            self._limit = (key, int(limit * 1024 * 1024 * (1 - share)))
+        return self._limit[1]
+
+    def _check_rss(self, app):
+        if self._recycle is None or self._recycling:
+            return
+        limit = self.rss_limit(app)
+        current = rss()
+        if limit is None or current is None or current <= limit:
+            return
+        self._recycling = True
+        logger.warning('Recycling process %d, whose RSS of %d MB is above '
+                       'its watermark of %d MB', os.getpid(), current >> 20,
+                       limit >> 20)
+        self._recycle()
+
+    # Tracing
+
+    def _start(self):
+        g.memory_start = None
+        if current_app.config['MEMORY_TRACING_ENABLED']:
+            self.start_tracing(current_app)
+            g.memory_start = tracemalloc.get_traced_memory()[0]
+
+    def _finish(self, response):
+        start = g.pop('memory_start', None)
+        if start is not None and tracemalloc.is_tracing():
+            growth = tracemalloc.get_traced_memory()[0] - start
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            with self._lock:
+                stats = self.routes.setdefault(route, [0, 0])
+                stats[0] += 1
+                stats[1] += growth
+            if time.monotonic() >= self._next_snapshot:
+                self.snapshot(current_app)
+        self._check_rss(current_app)
+        return response
+
+    def start_tracing(self, app):
+        if tracemalloc.is_tracing() and self._next_snapshot is not None:
+            return
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                self.routes = {}
+                self._baseline_pid = None
+                self._next_snapshot = None
+                tracemalloc.start(app.config['MEMORY_TRACING_FRAMES'])
+            # tracing may have been started before, like by PYTHONTRACEMALLOC
+            if self._next_snapshot is None:
+                self._next_snapshot = (time.monotonic() +
+                                       app.config['MEMORY_SNAPSHOT_INTERVAL'])
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+
+    @staticmethod
+    def tracing():
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, app):
+        """
+        Write a snapshot of this process's traced allocations to
+        MEMORY_SNAPSHOT_DIR.  The first one is the baseline, and the later
+        ones replace the latest snapshot.  Only the snapshots of the
+        MEMORY_MAX_SNAPSHOT_PROCESSES processes that wrote last are kept.
+        """
+        interval = app.config['MEMORY_SNAPSHOT_INTERVAL']
+        with self._lock:
+            self._next_snapshot = time.monotonic() + interval
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        directory = app.config['MEMORY_SNAPSHOT_DIR']
+        os.makedirs(directory, exist_ok=True)
+        pid = os.getpid()
+        first, latest = snapshot_paths(directory, pid)
+        if self._baseline_pid != pid:
+            # the files of an earlier process with the same pid go
+            for path in (first, latest):
+                if os.path.exists(path):
+                    os.remove(path)
+            snapshot.dump(first)
+            self._baseline_pid = pid
+        else:
+            snapshot.dump(latest)
+        for old in snapshot_pids(directory)[
+                app.config['MEMORY_MAX_SNAPSHOT_PROCESSES']:]:
+            for path in snapshot_paths(directory, old):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self, app):
+        """The memory of this process, and its growth by route"""
+        with self._lock:
+            routes = [{'route': route, 'requests': requests,
+                       'growth': growth,
+                       'growthPerRequest': growth // requests}
+                      for route, (requests, growth) in self.routes.items()]
+        routes.sort(key=lambda route: route['growth'], reverse=True)
+        tracing = self.tracing()
+        return {
+            'pid': os.getpid(),
+            'rss': rss(),
+            'rssLimit': self.rss_limit(app),
+            'tracing': tracing,
+            'tracedMemory': tracemalloc.get_traced_memory()[0]
+            if tracing else None,
+            'routes': routes,
+        }
@@ -0,0 +1,517 @@
+# services/flask/project/metrics.py
+
+"""
+Metrics of the app, served at /metrics in the Prometheus text format.
+
+Each process counts its requests by route, method and status, times them,
+and adds up the SQL statements that project/instrumentation.py counted for
+them.  The state of the connection pools and of the load shedding, the
+cache counters, the password hashes in progress and the resident memory
+are read when the metrics are collected.
+
+gunicorn runs several worker processes, and a scrape only reaches one of
+them.  So with METRICS_DIR set, every process writes its metrics to a file
+of its own in that directory every METRICS_FLUSH_INTERVAL seconds, and a
+scrape adds up the files of every process.  When a worker exits, the
+gunicorn master folds its counters and histograms into the file of the
+processes that have gone (see mark_process_dead()), so that they never go
+down, while its gauges are dropped.  The directory must only be shared by
+the processes of one gunicorn master, and emptied when it starts.
+"""
+
+import collections
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from flask import Response, current_app, g, request
+from flask_bcrypt import Bcrypt
+
+from project.instrumentation import request_stats
+from project.memory import rss
+from project.shedding import route_class
+
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+BCRYPT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# name: (type, help, buckets of histograms)
+METRICS = collections.OrderedDict([
+    ('http_requests_total',
+     (COUNTER, 'Requests by route, method and status.', None)),
+    ('http_request_duration_seconds',
+     (HISTOGRAM, 'Time taken to respond to requests, by route and method.',
+      DURATION_BUCKETS)),
+    ('db_statements_total',
+     (COUNTER, 'SQL statements run by requests, by route.', None)),
+    ('db_statement_seconds_total',
+     (COUNTER, 'Time taken by the SQL statements of requests, by route.',
+      None)),
+    ('db_pool_size',
+     (GAUGE, 'Connections that the pools keep open.', None)),
+    ('db_pool_open_connections',
+     (GAUGE, 'Open connections of the pools.', None)),
+    ('db_pool_checked_out_connections',
+     (GAUGE, 'Connections of the pools that are in use.', None)),
+    ('db_pool_overflow_connections',
+     (GAUGE, 'Connections opened beyond the size of the pools.', None)),
+    ('db_pool_checkouts_total',
+     (COUNTER, 'Connections checked out of the pools.', None)),
+    ('db_pool_timeouts_total',
+     (COUNTER, 'Checkouts that gave up waiting for a free connection.',
+      None)),
+    ('db_pool_wait_seconds_total',
+     (COUNTER, 'Time taken by checkouts, including connecting.', None)),
+    ('cache_hits_total',
+     (COUNTER, 'Cache lookups that found a value, by namespace.', None)),
+    ('cache_misses_total',
+     (COUNTER, 'Cache lookups that found nothing, by namespace.  The hit '
+               'ratio is hits / (hits + misses).', None)),
+    ('cache_errors_total',
+     (COUNTER, 'Cache operations that failed, by namespace.', None)),
+    ('bcrypt_in_progress',
+     (GAUGE, 'Password hashes being computed or checked.', None)),
+    ('bcrypt_duration_seconds',
+     (HISTOGRAM, 'Time taken to compute or check a password hash.',
+      BCRYPT_BUCKETS)),
+    ('access_log_dropped_total',
+     (COUNTER, 'Access log records dropped because the queue was full.',
+      None)),
+    ('load_shedding_in_progress',
+     (GAUGE, 'Requests running, by class of routes.', None)),
+    ('load_shedding_waiting',
+     (GAUGE, 'Requests waiting for a turn, by class of routes.', None)),
+    ('load_shedding_rejected_total',
+     (COUNTER, 'Requests turned away with a 503, by class of routes.',
+      None)),
+    ('process_resident_memory_bytes',
+     (GAUGE, 'Resident memory of the processes.', None)),
+])
+
+DEAD_FILE = 'dead.json'
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry(object):
+    """The counters and histograms of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        # (name, labels): [count of each bucket and of +Inf, sum]
+        self._histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, label_key(labels))] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, label_key(labels))
+        with self._lock:
+            counts, total = self._histograms.get(
+                key, ([0] * (len(buckets) + 1), 0.0))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(buckets)
+            counts[i] += 1
+            self._histograms[key] = (counts, total + value)
+
+    def snapshot(self):
+        """The values as JSON, like the files of METRICS_DIR"""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self._counters.items()],
+                'gauges': [],
+                'histograms': [[name, labels, list(counts), total]
+                               for (name, labels), (counts, total)
+                               in self._histograms.items()],
+            }
+
+
+def merge(snapshots, gauges=True):
+    """Add up the values of snapshots, leaving out the gauges unless
+    ``gauges`` is set"""
+    merged = {'counters': collections.defaultdict(float),
+              'gauges': collections.defaultdict(float),
+              'histograms': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges') if gauges else ('counters',):
+            for name, labels, value in snapshot[kind]:
+                merged[kind][(name, label_key(dict(labels)))] += value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, label_key(dict(labels)))
+            if key in merged['histograms']:
+                old_counts, old_total = merged['histograms'][key]
+                counts = [a + b for a, b in zip(old_counts, counts)]
+                total += old_total
+            merged['histograms'][key] = (counts, total)
+    return merged
+
+
+def to_snapshot(merged):
+    return {
+        'counters': [[name, labels, value] for (name, labels), value
+                     in merged['counters'].items()],
+        'gauges': [[name, labels, value] for (name, labels), value
+                   in merged['gauges'].items()],
+        'histograms': [[name, labels, counts, total]
+                       for (name, labels), (counts, total)
+                       in merged['histograms'].items()],
+    }
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path, value):
+    """Replace a file in one step, so that readers never see half of it"""
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(value, f)
+    os.replace(temporary, path)
+
+
+def mark_process_dead(directory, pid):
+    """
+    Fold the counters and histograms of a process that has exited into the
+    file of the dead processes, and delete its file.  Only call this from
+    the gunicorn master, which is the only process that writes that file.
+    """
+    paths = glob.glob(os.path.join(directory, f'{pid}-*.json'))
+    if not paths:
+        return
+    dead_path = os.path.join(directory, DEAD_FILE)
+    dead = read_json(dead_path) or {'files': [], 'snapshot': None}
+    snapshots = [read_json(path) for path in paths]
+    if dead['snapshot'] is not None:
+        snapshots.append(dead['snapshot'])
+    existing = set(os.listdir(directory))
+    # A scrape skips the files of processes that are already in here, in
+    # case it read one before it was deleted
+    files = [name for name in dead['files'] if name in existing]
+    files.extend(os.path.basename(path) for path in paths)
+    write_json(dead_path, {
+        'files': files,
+        'snapshot': to_snapshot(merge(
+            [snapshot for snapshot in snapshots if snapshot is not None],
+            gauges=False)),
+    })
+    for path in paths:
+        os.remove(path)
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def render(merged):
+    """The merged metrics in the Prometheus text format"""
+    samples = collections.defaultdict(list)
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in sorted(merged[kind].items()):
+            samples[name].append(
+                f'{name}{format_labels(labels)} {format_value(value)}')
+    for (name, labels), (counts, total) in sorted(
+            merged['histograms'].items()):
+        buckets = METRICS[name][2]
+        cumulative = 0
+        for bound, count in zip(buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples[name].append(
+                f'{name}_bucket{format_labels(labels + (("le", le),))} '
+                f'{format_value(cumulative)}')
+        samples[name].append(
+            f'{name}_sum{format_labels(labels)} {format_value(total)}')
+        samples[name].append(
+            f'{name}_count{format_labels(labels)} '
+            f'{format_value(cumulative)}')
+    lines = []
+    for name, (kind, help, _) in METRICS.items():
+        if samples[name]:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics(object):
+    """
+    Flask extension that records the metrics of each request, and serves
+    /metrics, if METRICS_ENABLED is set.  If METRICS_TOKEN is set too,
+    scrapes must send it as a bearer token.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self._flusher = None
+        self._pid = None
+        self._filename = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.before_first_request(lambda: self.start_flusher(app))
+
+    # Recording
+
+    def _start(self):
+        g.metrics_start = None
+        if current_app.config['METRICS_ENABLED']:
+            g.metrics_start = time.perf_counter()
+
+    def _finish(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown(self, exception):
+        # after_request isn't called when a route raises
+        if exception is not None:
+            self._record(500)
+
+    def _record(self, status):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        # the rule, not the path, so that there's one series per route
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.registry.inc('http_requests_total', {
+            'route': route, 'method': request.method, 'status': str(status)})
+        self.registry.observe('http_request_duration_seconds', {
+            'route': route, 'method': request.method}, duration)
+        stats = request_stats()
+        if stats is not None:
+            self.registry.inc('db_statements_total', {'route': route},
+                              stats.queries)
+            self.registry.inc('db_statement_seconds_total', {'route': route},
+                              stats.time)
+
+    # Collecting
+
+    def collect_gauges(self, app):
+        """(type, name, labels, value) of the values that are read when the
+        metrics are collected"""
+        from project import (access_log, bcrypt, cache, db, load_shedder,
+                             replicas)
+        from project.pool import pool_stats
+        engines = [('primary', db.get_engine(app))]
+        engines.extend((f'replica{i}', replica.engine)
+                       for i, replica in enumerate(replicas.replicas(app)))
+        for database, engine in engines:
+            labels = {'database': database}
+            stats = pool_stats(engine)
+            yield GAUGE, 'db_pool_size', labels, stats['size']
+            yield GAUGE, 'db_pool_open_connections', labels, stats['open']
+            yield (GAUGE, 'db_pool_checked_out_connections', labels,
+                   stats['checkedOut'])
+            yield (GAUGE, 'db_pool_overflow_connections', labels,
+                   stats['overflow'])
+            if 'checkouts' in stats:
+                yield (COUNTER, 'db_pool_checkouts_total', labels,
+                       stats['checkouts'])
+                yield (COUNTER, 'db_pool_timeouts_total', labels,
+                       stats['timeouts'])
+                yield (COUNTER, 'db_pool_wait_seconds_total', labels,
+                       stats['waitTime'])
+        for namespace, stats in cache.stats()['namespaces'].items():
+            labels = {'namespace': namespace}
+            yield COUNTER, 'cache_hits_total', labels, stats['hits']
+            yield COUNTER, 'cache_misses_total', labels, stats['misses']
+            yield COUNTER, 'cache_errors_total', labels, stats['errors']
+        if isinstance(bcrypt, MeteredBcrypt):
+            yield GAUGE, 'bcrypt_in_progress', {}, bcrypt.in_progress
+        yield COUNTER, 'access_log_dropped_total', {}, access_log.dropped
+        for name, limiter in load_shedder.limiters(app).items():
+            labels = {'class': name}
+            yield (GAUGE, 'load_shedding_in_progress', labels,
+                   limiter.in_progress)
+            yield GAUGE, 'load_shedding_waiting', labels, limiter.waiting
+            yield (COUNTER, 'load_shedding_rejected_total', labels,
+                   limiter.rejected)
+        resident = rss()
+        if resident is not None:
+            yield GAUGE, 'process_resident_memory_bytes', {}, resident
+
+    def snapshot(self, app):
+        """This process's metrics, as JSON"""
+        snapshot = self.registry.snapshot()
+        with app.app_context():
+            for kind, name, labels, value in self.collect_gauges(app):
+                snapshot[kind + 's'].append(
+                    [name, label_key(labels), value])
+        return snapshot
+
+    def collect(self, app):
+        """The merged metrics of every process"""
+        snapshot = self.snapshot(app)
+        directory = app.config['METRICS_DIR']
+        if not directory:
+            return merge([snapshot])
+        own = self._write(directory, snapshot)
+        # The files are read before the file of the dead processes, so that
+        # a process that is folded into it in the meantime isn't missed
+        snapshots = {}
+        for path in glob.glob(os.path.join(directory, '*-*.json')):
+            name = os.path.basename(path)
+            if name != own:
+                other = read_json(path)
+                if other is not None:
+                    snapshots[name] = other
+        dead = read_json(os.path.join(directory, DEAD_FILE))
+        if dead is not None:
+            for name in dead['files']:
+                snapshots.pop(name, None)
+            snapshots[DEAD_FILE] = dead['snapshot']
+        return merge([snapshot] + list(snapshots.values()))
+
+    def _write(self, directory, snapshot):
+        if self._pid != os.getpid():
+            # a forked process has metrics of its own
+            self._pid = os.getpid()
+            self._filename = f'{self._pid}-{uuid.uuid4().hex[:8]}.json'
+        write_json(os.path.join(directory, self._filename), snapshot)
+        return self._filename
+
+    def flush(self, app):
+        """Write this process's metrics to METRICS_DIR"""
+        directory = app.config['METRICS_DIR']
+        if directory:
+            self._write(directory, self.snapshot(app))
+
+    def start_flusher(self, app):
+        """
+        Start the thread that flushes the metrics, unless they're disabled,
+        or only kept in memory, or it's already running in this process.
+        """
+        if not (app.config['METRICS_ENABLED'] and app.config['METRICS_DIR']):
+            return None
+        if self._flusher is not None and self._flusher.pid == os.getpid():
+            return self._flusher
+        self._flusher = Flusher(self, app)
+        self._flusher.start()
+        return self._flusher
+
+    def stop_flusher(self):
+        if self._flusher is not None:
+            self._flusher.stop()
+            self._flusher = None
+
+    # Serving
+
+    @route_class(None)
+    def view(self):
+        config = current_app.config
+        if not config['METRICS_ENABLED']:
+            return Response('Metrics are disabled.\n', 404,
+                            mimetype='text/plain')
+        token = config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(
+                request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('Invalid token.\n', 401, mimetype='text/plain')
+        app = current_app._get_current_object()
+        return Response(render(self.collect(app)),
+                        content_type=self.CONTENT_TYPE)
+
+
+class Flusher(threading.Thread):
+    """Thread that writes the metrics of its process to METRICS_DIR every
+    METRICS_FLUSH_INTERVAL seconds"""
+
+    def __init__(self, metrics, app):
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.metrics = metrics
+        self.app = app
+        self.pid = os.getpid()
+        self._stopped = threading.Event()
+
+    def run(self):
+        interval = self.app.config['METRICS_FLUSH_INTERVAL']
+        while not self._stopped.wait(interval):
+            try:
+                self.metrics.flush(self.app)
+            except Exception:
+                logger.exception('Could not flush the metrics')
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        self.join(timeout)
+
+
+class MeteredBcrypt(Bcrypt):
+    """
+    Flask-Bcrypt, counting the hashes in progress and timing them.  Hashing
+    is slow on purpose, so logins that arrive together queue up for the
+    CPU, which shows up as hashes in progress.
+    """
+
+    def __init__(self, metrics, app=None):
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self.in_progress = 0
+        super().__init__(app)
+
+    def _metered(self, function, *args):
+        with self._lock:
+            self.in_progress += 1
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.in_progress -= 1
+            self._metrics.registry.observe(
+                'bcrypt_duration_seconds', {}, time.perf_counter() - start)
+
+    def generate_password_hash(self, password, rounds=None):
+        return self._metered(super().generate_password_hash, password,
+                             rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._metered(super().check_password_hash, pw_hash, password)
@@ -0,0 +1,142 @@
+# services/flask/project/pool.py
+
+"""
+Settings and telemetry for the pools of database connections.
+
+Each process keeps up to SQLALCHEMY_POOL_SIZE connections open to each
+database, and opens up to SQLALCHEMY_MAX_OVERFLOW more, which are closed
+again when they're returned, while all of those are in use.  A request that
+finds no free connection waits up to SQLALCHEMY_POOL_TIMEOUT seconds for
+one.  The pools count their checkouts and how long they took, which
+includes waiting for a free connection, opening a new one and the pre-ping,
+so that a pool that is too small shows up as wait time.
+
+With SQLALCHEMY_PGBOUNCER set, the app connects through PgBouncer in
+transaction pooling mode, where consecutive transactions of a connection
+may run on different server connections.  Nothing may rely on the state of
+a server session then: the statement timeout is set at the start of each
+transaction instead of once per connection, and the LISTEN connections go
+straight to the database at SQLALCHEMY_DIRECT_URI.
+"""
+
+import logging
+import threading
+import time
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that counts its checkouts, and how long they took"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _timed(self, checkout):
+        start = time.monotonic()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        wait = time.monotonic() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_time += wait
+            self.max_wait_time = max(self.max_wait_time, wait)
+        return connection
+
+    # Engines check out with unique_connection(), and connect() is what the
+    # pool's users call directly
+    def connect(self):
+        return self._timed(super().connect)
+
+    def unique_connection(self):
+        return self._timed(super().unique_connection)
+
+
+def statement_timeout_ms(config):
+    timeout = config['SQLALCHEMY_STATEMENT_TIMEOUT']
+    return int(timeout * 1000) if timeout else None
+
+
+def engine_options(config):
+    """The options of create_engine() for the pool settings in config"""
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_pre_ping': config['SQLALCHEMY_POOL_PRE_PING'],
+    }
+    for option, key in (('pool_size', 'SQLALCHEMY_POOL_SIZE'),
+                        ('max_overflow', 'SQLALCHEMY_MAX_OVERFLOW'),
+                        ('pool_timeout', 'SQLALCHEMY_POOL_TIMEOUT'),
+                        ('pool_recycle', 'SQLALCHEMY_POOL_RECYCLE')):
+        if config[key] is not None:
+            options[option] = config[key]
+    timeout = statement_timeout_ms(config)
+    if timeout and not config['SQLALCHEMY_PGBOUNCER']:
+        # PgBouncer refuses startup options, but the server applies them to
+        # the whole session, including statements outside of the ORM
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+@event.listens_for(SignallingSession, 'after_begin')
+def _set_statement_timeout(session, transaction, connection):
+    config = session.app.config
+    timeout = statement_timeout_ms(config)
+    if timeout and config['SQLALCHEMY_PGBOUNCER']:
+        connection.execute(f'SET LOCAL statement_timeout = {timeout}')
+
+
+def prewarm(app):
+    """
+    Open SQLALCHEMY_POOL_PREWARM connections of the app's pool, at most
+    SQLALCHEMY_POOL_SIZE, so that the first requests of a new worker don't
+    have to.  Returns the number of connections that were opened.
+    """
+    from project import db
+    engine = db.get_engine(app)
+    count = min(app.config['SQLALCHEMY_POOL_PREWARM'], engine.pool.size())
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.raw_connection())
+    except exc.DBAPIError as e:
+        # the requests will connect when they need to
+        logger.warning('Could not prewarm the connection pool: %s', e)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def pool_stats(engine):
+    """The state of an engine's pool, and its counters since it was
+    created"""
+    pool = engine.pool
+    stats = {
+        'size': pool.size(),
+        'open': pool.size() + pool.overflow(),
+        'checkedOut': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'waitTime': pool.wait_time,
+            'maxWaitTime': pool.max_wait_time,
+        })
+    return stats
@@ -0,0 +1,213 @@
+# services/flask/project/profiling.py
+
+"""
+Sampling profiler for single requests, safe to use on production traffic.
+
+While a request is profiled, a thread of its own looks at the request's
+stack every PROFILING_INTERVAL seconds, and counts how often it saw each
+stack.  That's wall clock time, so waiting for the database or a lock shows
+up as well as computing.  The counts are written to PROFILING_DIR in the
+folded format of flamegraph.pl, which speedscope and most other flame graph
+viewers read too: one line per stack, with the frames from the root to the
+leaf separated by semicolons, and the number of samples.
+
+Requests are profiled when:
+
+- PROFILING_ENABLED is set and a client with a valid auth token sends the
+  PROFILING_HEADER header.  The response says where to get the profile in
+  its X-Profile-Id header (see the /admin/profiles routes).
+- PROFILING_SAMPLE_RATE is above zero, for that fraction of all requests.
+
+At most PROFILING_MAX_CONCURRENT requests are profiled at the same time,
+and only the newest PROFILING_MAX_FILES profiles are kept.
+"""
+
+import collections
+import datetime
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+
+from flask import current_app, g, request
+
+
+# Names that the profiles are stored under
+PROFILE_NAME = re.compile(r'^[\w.-]+\.folded$')
+
+
+class Sampler(threading.Thread):
+    """Thread that samples the stack of another thread until it's
+    stopped"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._names = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[self._stack(frame)] += 1
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            name = self._names.get(code)
+            if name is None:
+                name = self._names[code] = frame_name(code)
+            stack.append(name)
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        """The samples in the folded format"""
+        return ''.join(f'{";".join(stack)} {count}\n'
+                       for stack, count in self.stacks.most_common())
+
+
+def frame_name(code):
+    """The name of a function in a profile, like
+    'get_events (project/admin/api.py:512)'"""
+    filename = code.co_filename
+    # the path from the directory it was imported from
+    for path in sorted(filter(None, sys.path), key=len, reverse=True):
+        if filename.startswith(path + os.sep):
+            filename = filename[len(path) + 1:]
+            break
+    name = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return name.replace(';', ':')
+
+
+class Profiler(object):
+    """
+    Flask extension that profiles the requests that ask for it, and a
+    sample of all requests.
+    """
+
+    def __init__(self, app=None):
+        self._slots = None
+        self._slots_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILING_INTERVAL', 0.005)
+        app.config.setdefault('PROFILING_DIR', '/tmp/profiles')
+        app.config.setdefault('PROFILING_MAX_FILES', 500)
+        app.config.setdefault('PROFILING_MAX_CONCURRENT', 4)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _acquire(self, config):
+        """Take one of the PROFILING_MAX_CONCURRENT slots, if there's one
+        free"""
+        with self._slots_lock:
+            if self._slots is None or \
+                    self._slots[0] != config['PROFILING_MAX_CONCURRENT']:
+                maximum = config['PROFILING_MAX_CONCURRENT']
+                self._slots = (maximum, threading.BoundedSemaphore(maximum)
+                               if maximum > 0 else None)
+            slots = self._slots[1]
+        if slots is None or not slots.acquire(blocking=False):
+            return None
+        return slots
+
+    def requested(self):
+        """Whether the client asked for a profile, with a valid token"""
+        from project.admin.models import User
+        config = current_app.config
+        if not (config['PROFILING_ENABLED'] and
+                request.headers.get(config['PROFILING_HEADER'])):
+            return False
+        auth_header = request.headers.get('Authorization', '')
+        auth_token = auth_header.split(' ')[-1]
+        if not auth_token:
+            return False
+        user_id, _ = User.decode_auth_token(auth_token)
+        return isinstance(user_id, int)
+
+    def _start(self):
+        g.profile = None
+        config = current_app.config
+        requested = self.requested()
+        if not requested and random.random() >= \
+                config['PROFILING_SAMPLE_RATE']:
+            return
+        slots = self._acquire(config)
+        if slots is None:
+            return
+        sampler = Sampler(threading.get_ident(),
+                          config['PROFILING_INTERVAL'])
+        g.profile = (sampler, slots, requested)
+        sampler.start()
+
+    def _stop(self):
+        """Stop profiling the request, and save the profile.  Returns its
+        name, or None if the request wasn't profiled, and whether the client
+        asked for it."""
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None, False
+        sampler, slots, requested = profile
+        try:
+            sampler.stop()
+            return self.save(sampler), requested
+        finally:
+            slots.release()
+
+    def _finish(self, response):
+        name, requested = self._stop()
+        if name is not None and requested:
+            response.headers['X-Profile-Id'] = name
+        return response
+
+    def _teardown(self, exception):
+        # after_request isn't called when a route raises
+        self._stop()
+
+    def save(self, sampler):
+        """Write a profile to PROFILING_DIR, and delete the oldest ones
+        beyond PROFILING_MAX_FILES"""
+        config = current_app.config
+        directory = config['PROFILING_DIR']
+        os.makedirs(directory, exist_ok=True)
+        route = re.sub(r'[^\w]+', '-', request.path).strip('-')
+        # the time first, so that the names sort from oldest to newest
+        now = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')
+        name = f'{now}-{request.method}-{route}-{uuid.uuid4().hex[:8]}.folded'
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(sampler.folded())
+        names = self.names(current_app)
+        for old in names[config['PROFILING_MAX_FILES']:]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+        return name
+
+    @staticmethod
+    def names(app):
+        """The names of the stored profiles, newest first"""
+        try:
+            names = os.listdir(app.config['PROFILING_DIR'])
+        except FileNotFoundError:
+            return []
+        return sorted((name for name in names if PROFILE_NAME.match(name)),
+                      reverse=True)
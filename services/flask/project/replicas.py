@@ -0,0 +1,235 @@
+# services/flask/project/replicas.py
+
+"""
+Routing of read-only queries to read replicas of the database.
+
+The queries of routes that are decorated with replica_reads (see
+project/admin/decorators.py) go to one of the SQLALCHEMY_REPLICA_URIS, in
+turn.  Everything else, and everything that a session does after it has
+written, uses the primary.
+
+The replication lag of each replica is checked at most every
+REPLICA_CHECK_INTERVAL seconds, by the next request that needs it.  A
+replica that lags by more than REPLICA_MAX_LAG seconds, or that can't be
+reached, isn't used until a later check finds it healthy again.  When no
+replica is healthy, reads go to the primary.
+
+Even a healthy replica may be missing the latest writes, so after every
+commit that wrote something, all reads go to the primary until the replicas
+must have caught up.  That's for every client, not just the one that wrote,
+since the change streams make the other clients read straight after a
+write.  The other processes hear about the write through the invalidation
+bus, so with more than one process, CACHE_INVALIDATION_ENABLED is needed to
+read your own writes.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, exc, orm, text
+
+from project.pool import engine_options, pool_stats
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, or 0 if everything that was
+# received has been replayed.  Servers that aren't standbys have no lag.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+                              now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica(object):
+    """A read replica, and what its last check found"""
+
+    def __init__(self, uri, config):
+        self.engine = create_engine(uri, **engine_options(config))
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        event.listen(self.engine, 'handle_error', self._failed)
+
+    def _failed(self, context):
+        # Stop using the replica until the next check if it has gone away
+        if isinstance(context.sqlalchemy_exception, exc.OperationalError):
+            self.healthy = False
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as connection:
+                self.lag = float(connection.execute(LAG_QUERY).scalar())
+        except exc.DBAPIError as e:
+            logger.warning('Read replica %s is unavailable: %s',
+                           self.engine.url, e)
+            self.healthy = False
+            self.lag = None
+        else:
+            self.healthy = self.lag <= max_lag
+        self.checked_at = time.monotonic()
+
+    def to_json(self):
+        return {
+            'url': repr(self.engine.url),
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'pool': pool_stats(self.engine)
+        }
+
+
+class Replicas(object):
+    """
+    Flask extension that picks the engine for read-only queries.  ``bus`` is
+    the invalidation bus that tells the other processes about writes.
+    """
+
+    def __init__(self, bus, app=None):
+        self._bus = bus
+        self._bus.subscribe('replicas', self._apply)
+        self._check_lock = threading.Lock()
+        self._turn = itertools.count()
+        # monotonic time until which every read goes to the primary
+        self._primary_until = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_MAX_LAG', 5.0)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 1.0)
+        app.extensions['replicas'] = self
+
+    def replicas(self, app):
+        """The app's replicas, created when first needed"""
+        uris = tuple(app.config['SQLALCHEMY_REPLICA_URIS'])
+        state = app.extensions.get('replica_engines')
+        if state is None or state[0] != uris:
+            if state is not None:
+                for replica in state[1]:
+                    replica.engine.dispose()
+            state = app.extensions['replica_engines'] = (
+                uris, [Replica(uri, app.config) for uri in uris])
+        return state[1]
+
+    def engine_for_reads(self, app):
+        """The engine of a healthy replica, or None to use the primary"""
+        replicas = self.replicas(app)
+        if not replicas or time.monotonic() < self._primary_until:
+            return None
+        self._check(app, replicas)
+        healthy = [replica for replica in replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)].engine
+
+    def _check(self, app, replicas):
+        """Check the replicas that are due.  Requests that come along in the
+        meantime don't wait, and go by the last checks."""
+        interval = app.config['REPLICA_CHECK_INTERVAL']
+        now = time.monotonic()
+        due = [replica for replica in replicas
+               if replica.checked_at is None or
+               now - replica.checked_at >= interval]
+        if not due or not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            for replica in due:
+                replica.check(app.config['REPLICA_MAX_LAG'])
+        finally:
+            self._check_lock.release()
+
+    def wrote(self, app):
+        """Send every read to the primary for a while, in every process"""
+        if app.config['SQLALCHEMY_REPLICA_URIS']:
+            self._bus.publish({'n': 'replicas'}, app)
+
+    def _apply(self, message):
+        """Apply a message from the bus, which is always about a write.  A
+        clear message is sent when writes may have been missed, so it's
+        treated the same."""
+        config = current_app.config
+        until = (time.monotonic() + config['REPLICA_MAX_LAG'] +
+                 config['REPLICA_CHECK_INTERVAL'])
+        self._primary_until = max(self._primary_until, until)
+
+    def stats(self, app):
+        return {
+            'primaryOnly': time.monotonic() < self._primary_until,
+            'replicas': [replica.to_json()
+                         for replica in self.replicas(app)]
+        }
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends the queries of replica_reads routes to a replica,
+    until it writes something.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if (has_request_context() and g.get('replica_reads') and
+                not self._flushing and not self.info.get('wrote')):
+            replicas = self.app.extensions.get('replicas')
+            engine = replicas and replicas.engine_for_reads(self.app)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+def mark_written(session):
+    """Note that a session has written to the primary.  Flushes are noted
+    automatically; call this after writing with plain SQL."""
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    mark_written(session)
+
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def _after_bulk(update_context):
+    mark_written(update_context.session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('wrote', False):
+        replicas = session.app.extensions.get('replicas')
+        if replicas is not None:
+            replicas.wrote(session.app)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """The Flask-SQLAlchemy extension, with sessions that can read from the
+    replicas, and the pool settings of project/pool.py"""
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', True)
+        app.config.setdefault('SQLALCHEMY_POOL_PREWARM', 0)
+        app.config.setdefault('SQLALCHEMY_STATEMENT_TIMEOUT', None)
+        app.config.setdefault('SQLALCHEMY_PGBOUNCER', False)
+        app.config.setdefault('SQLALCHEMY_DIRECT_URI', None)
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        options.update(engine_options(app.config))
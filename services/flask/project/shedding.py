@@ -0,0 +1,161 @@
+# services/flask/project/shedding.py
+
+"""
+Load shedding: concurrency limits for each class of routes.
+
+Each gunicorn worker only has so many threads, and under a spike every
+request would otherwise wait its turn until they all time out together.
+So routes are put in classes, and each class has a limit on the requests
+of a process that run at the same time, and on the ones that may wait for
+one of them to finish.  A request that finds the queue of its class full,
+or that waits LOAD_SHEDDING_QUEUE_TIMEOUT seconds without getting a turn,
+gets a 503 with a Retry-After header straight away.  Since the classes are
+limited separately, logins or CSV exports that pile up don't hold up the
+reads of the calendar.
+
+The classes are 'auth' for the routes that hash passwords with bcrypt,
+'export' for the CSV exports and imports, and 'read' or 'write' for the
+rest, by their method.  Routes are put in another class, or left out of
+load shedding with None, by the route_class decorator.
+LOAD_SHEDDING_LIMITS maps the classes to their (concurrency, queue size).
+Classes that it leaves out aren't limited.
+"""
+
+import random
+import threading
+
+from flask import current_app, g, request
+
+
+# Methods of the routes that are in the 'read' class by default
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+def route_class(name):
+    """Put the decorated route in the class called name, or leave it out of
+    load shedding if name is None"""
+
+    def decorator(route_function):
+        route_function.route_class = name
+        return route_function
+
+    return decorator
+
+
+class Limiter(object):
+    """The requests of one class that are running, and that are waiting to
+    run"""
+
+    def __init__(self, concurrency, queue_size):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.in_progress = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        """Wait up to timeout seconds for a turn, unless the queue is full.
+        Returns whether the request got one."""
+        with self._condition:
+            if self.in_progress < self.concurrency:
+                self.in_progress += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(
+                        lambda: self.in_progress < self.concurrency,
+                        timeout):
+                    self.rejected += 1
+                    return False
+                self.in_progress += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.in_progress -= 1
+            self._condition.notify()
+
+
+class LoadShedder(object):
+    """
+    Flask extension that limits the requests of each class of routes, if
+    LOAD_SHEDDING_ENABLED is set.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOAD_SHEDDING_ENABLED', False)
+        app.config.setdefault('LOAD_SHEDDING_LIMITS', {})
+        app.config.setdefault('LOAD_SHEDDING_QUEUE_TIMEOUT', 1.0)
+        app.config.setdefault('LOAD_SHEDDING_RETRY_AFTER', 5)
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def limiters(self, app):
+        """The Limiter of each class, created again when
+        LOAD_SHEDDING_LIMITS changes"""
+        limits = tuple(sorted(
+            (name, tuple(limit))
+            for name, limit in app.config['LOAD_SHEDDING_LIMITS'].items()))
+        state = app.extensions.get('load_limiters')
+        if state is None or state[0] != limits:
+            with self._lock:
+                state = app.extensions.get('load_limiters')
+                if state is None or state[0] != limits:
+                    state = app.extensions['load_limiters'] = (
+                        limits, {name: Limiter(*limit)
+                                 for name, limit in limits})
+        return state[1]
+
+    @staticmethod
+    def classify():
+        """The class of the current request's route, or None if it isn't
+        limited"""
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None:
+            return None
+        default = 'read' if request.method in READ_METHODS else 'write'
+        return getattr(view, 'route_class', default)
+
+    def _start(self):
+        g.load_limiter = None
+        config = current_app.config
+        if not config['LOAD_SHEDDING_ENABLED']:
+            return None
+        limiter = self.limiters(current_app).get(self.classify())
+        if limiter is None:
+            return None
+        if not limiter.acquire(config['LOAD_SHEDDING_QUEUE_TIMEOUT']):
+            return self.busy(config)
+        g.load_limiter = limiter
+        return None
+
+    def _finish(self, exception):
+        limiter = g.pop('load_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+    @staticmethod
+    def busy(config):
+        from project.admin.serializers import api_response
+        response_object = {
+            'status': 'fail',
+            'message': 'The server is busy.  Try again later.'
+        }
+        response = api_response(response_object)
+        response.status_code = 503
+        # spread the retries out, so that they don't come back as a spike
+        retry_after = config['LOAD_SHEDDING_RETRY_AFTER']
+        response.headers['Retry-After'] = str(
+            retry_after + random.randint(0, retry_after))
+        return response
@@ -0,0 +1,145 @@
+# services/flask/project/singleflight.py
+
+"""
+Single-flight coalescing of identical expensive reads.
+
+When a read is already running for a key, a request for the same key waits
+for that read (the leader) to finish and shares its result, instead of
+running the same queries again.  If the leader fails or takes longer than
+SINGLE_FLIGHT_TIMEOUT seconds, the follower runs the read itself.
+
+That only coalesces requests in the same process, which is enough with
+threaded workers.  With SINGLE_FLIGHT_ADVISORY_LOCK set, the leaders in
+different processes also queue up on a Postgres advisory lock for the key.
+Each one then checks the shared cache first (see the recheck argument of
+do()), so only the first one runs the read.  That's only useful with a
+cache backend that the processes share.
+
+A follower may get a result whose read started just before its own
+request.  Reads that must see the latest writes should use keys that
+change with every write, like the events cache keys do, or include
+visible_transactions() in their key, like the lists of all rows.
+"""
+
+import hashlib
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+def visible_transactions(session):
+    """
+    The snapshot of the transactions whose writes a statement that runs now
+    sees.  Requests that have the same one may share a read: a leader runs
+    its read after it got the snapshot, so it sees every write that was
+    committed before its followers' reads.  It changes when a transaction
+    that writes ends, but not with the writes of the session's own
+    transaction, so reads that may follow them shouldn't be shared.
+    """
+    return session.execute(
+        text('SELECT txid_current_snapshot()::text')).scalar()
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight(object):
+    """Flask extension that coalesces identical reads"""
+
+    def __init__(self, app=None):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.fallbacks = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SINGLE_FLIGHT_ENABLED', False)
+        app.config.setdefault('SINGLE_FLIGHT_TIMEOUT', 5.0)
+        app.config.setdefault('SINGLE_FLIGHT_ADVISORY_LOCK', False)
+
+    @staticmethod
+    def lock_id(key):
+        """The 64 bit advisory lock id of a key"""
+        digest = hashlib.sha1(repr(key).encode()).digest()
+        return int.from_bytes(digest[:8], 'big', signed=True)
+
+    def do(self, key, function, recheck=None):
+        """
+        Return function(), sharing the result with any identical call for
+        ``key`` that is already running.  ``recheck`` is called by a leader
+        after it waited for another process, and should return the result
+        that the other process cached, or None.  Without it, the processes
+        don't wait for each other.
+        """
+        config = current_app.config
+        if not config['SINGLE_FLIGHT_ENABLED']:
+            return function()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            if flight.done.wait(config['SINGLE_FLIGHT_TIMEOUT']) and \
+                    not flight.failed:
+                return flight.result
+            self.fallbacks += 1
+            return function()
+        try:
+            # without a recheck, waiting for the other processes would only
+            # make them take turns
+            if config['SINGLE_FLIGHT_ADVISORY_LOCK'] and recheck is not None:
+                flight.result = self._do_locked(key, function, recheck)
+            else:
+                flight.result = function()
+            return flight.result
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _do_locked(self, key, function, recheck):
+        """
+        Run function() while holding the key's advisory lock, in a
+        transaction of its own that only holds the lock.  If the lock can't
+        be had in time, run it anyway.
+        """
+        from project import db
+        timeout_ms = int(current_app.config['SINGLE_FLIGHT_TIMEOUT'] * 1000)
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            try:
+                connection.execute(f'SET LOCAL lock_timeout = {timeout_ms}')
+                connection.execute(text('SELECT pg_advisory_xact_lock(:id)'),
+                                   id=self.lock_id(key))
+            except DBAPIError:
+                self.fallbacks += 1
+            else:
+                result = recheck()
+                if result is not None:
+                    return result
+            return function()
+        finally:
+            # ending the transaction releases the lock
+            transaction.rollback()
+            connection.close()
+
+    def stats(self):
+        return {'leaders': self.leaders, 'followers': self.followers,
+                'fallbacks': self.fallbacks, 'inFlight': len(self._flights)}
@@ -0,0 +1,116 @@
+# services/flask/project/stream.py
+
+"""
+Live change notifications for the clients, as server-sent events.
+
+Every transaction that records changes to the jobs and expenses (see
+project/admin/changes.py) also sends a NOTIFY on STREAM_CHANNEL, which
+Postgres only delivers if the transaction commits.  The payload is small:
+the new change feed cursor, and the table, id and operation of each change.
+Each process has one listener thread that LISTENs on the channel and hands
+the notifications to the queues of its open /admin/stream responses.
+
+The notifications are only hints.  Clients apply the changes by asking
+/admin/changes for everything after their cursor, so a dropped notification
+just delays an update until the next one.
+
+Each open stream takes up a worker thread until it ends, so a process only
+serves STREAM_MAX_SUBSCRIBERS of them at a time, and turns more away with
+a 503.  That leaves the rest of its threads to the other routes.
+"""
+
+import json
+import os
+import queue
+import threading
+
+from project.invalidation import Listener
+
+
+class ChangeStream(object):
+    """
+    Flask extension that fans out the change notifications of STREAM_CHANNEL
+    to the subscribed streams of this process.  Only used when
+    STREAM_ENABLED is set.
+    """
+
+    def __init__(self, app=None):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STREAM_ENABLED', False)
+        app.config.setdefault('STREAM_CHANNEL', 'changes')
+        app.config.setdefault('STREAM_HEARTBEAT', 15)
+        app.config.setdefault('STREAM_MAX_AGE', 600)
+        app.config.setdefault('STREAM_QUEUE_SIZE', 100)
+        app.config.setdefault('STREAM_MAX_SUBSCRIBERS', 8)
+        app.before_first_request(lambda: self.start_listener(app))
+
+    def subscribe(self, app):
+        """Return a queue that gets every (event, data) from now on, or None
+        if this process already has STREAM_MAX_SUBSCRIBERS"""
+        subscriber = queue.Queue(app.config['STREAM_QUEUE_SIZE'])
+        with self._lock:
+            if len(self._subscribers) >= app.config['STREAM_MAX_SUBSCRIBERS']:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    # The client isn't keeping up.  Every message has the
+                    # latest cursor, so the oldest ones can go.
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def handle(self, payload):
+        """Pass on a notification that was received from NOTIFY"""
+        self.publish('change', payload)
+
+    def resync(self):
+        """Tell every stream to sync, after notifications may have been
+        missed"""
+        from project import db
+        from project.admin.changes import current_cursor
+        cursor = current_cursor()
+        db.session.remove()
+        self.publish('sync', json.dumps({'cursor': cursor}))
+
+    def start_listener(self, app):
+        """
+        Start the listener thread, unless it's disabled or already running
+        in this process.
+        """
+        if not app.config['STREAM_ENABLED']:
+            return None
+        if self._listener is not None and self._pid == os.getpid():
+            return self._listener
+        self._pid = os.getpid()
+        self._listener = Listener(app, app.config['STREAM_CHANNEL'],
+                                  self.handle, reconnected=self.resync,
+                                  name='change-stream-listener')
+        self._listener.start()
+        return self._listener
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -1,22 +1,76 @@
 # services/flask/project/tests/base.py
 
 from flask_testing import TestCase
+from sqlalchemy import event
 
-from project import create_app, db, set_app_configuration
+from project import cache, create_app, db, row_cache, set_app_configuration
 
 
 app = create_app()
 
+# The schema is created by the first test that runs, and is then shared by
+# every test in the run.
+schema_created = False
+
+
+def create_schema():
+    global schema_created
+    if not schema_created:
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+        db.session.remove()
+        schema_created = True
+
+
+def reset_sequences(connection):
+    """
+    Restart the id sequences, so that every test sees ids starting at 1.
+    Sequences aren't transactional, so rolling back doesn't reset them.
+    """
+    tables = [table.name for table in db.metadata.sorted_tables
+              if 'id' in table.columns and table.columns['id'].autoincrement]
+    connection.execute(
+        "SELECT setval(pg_get_serial_sequence(t, 'id'), 1, false) "
+        "FROM unnest(%(tables)s) AS t", {'tables': tables})
+
 
 class BaseTestCase(TestCase):
+    """
+    Runs every test inside a transaction that is rolled back at teardown.
+
+    The session is bound to a connection with an outer transaction, and all
+    of the work in a test happens in a SAVEPOINT on top of it.  When the code
+    under test commits or rolls back, only the SAVEPOINT ends, and a new one
+    is started straight away.  Nothing a test does is ever committed, so
+    there's no need to recreate the tables between tests.
+    """
+
     def create_app(self):
         set_app_configuration('TestingConfig', app)
         return app
 
     def setUp(self):
-        db.create_all()
-        db.session.commit()
+        create_schema()
+        # the ids of the rows in the cache will be reused by this test
+        cache.clear()
+        row_cache.clear()
+        self._original_session = db.session
+        self._connection = db.engine.connect()
+        self._transaction = self._connection.begin()
+        reset_sequences(self._connection)
+        db.session = db.create_scoped_session(
+            options={'bind': self._connection, 'binds': {}})
+        db.session.begin_nested()
+
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
 
     def tearDown(self):
         db.session.remove()
-        db.drop_all()
+        self._transaction.rollback()
+        self._connection.close()
+        db.session = self._original_session
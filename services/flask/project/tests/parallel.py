@@ -0,0 +1,199 @@
+# services/flask/project/tests/parallel.py
+
+"""
+Runs the test modules in several processes, each with its own database.
+
+The parent process creates a template database with the schema in it and
+clones one database per worker from it with ``CREATE DATABASE ... TEMPLATE``,
+which only copies files.  The test modules are shared out between the
+workers, the biggest modules first, so that the workers finish at about the
+same time.  Every worker is a fresh interpreter (``python -m
+project.tests.parallel``) started with DATABASE_TEST_URL pointing at its own
+database, and writes its results to a JSON file that the parent merges.
+
+When measuring coverage, the workers are started under ``coverage run
+--parallel-mode`` and the parent combines their data files.
+"""
+
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+
+TESTS_DIR = 'project/tests'
+TESTS_PATTERN = 'test*.py'
+
+
+def find_test_modules(start_dir=TESTS_DIR, pattern=TESTS_PATTERN):
+    """Names of the test modules, with the size of each file"""
+    paths = glob.glob(os.path.join(start_dir, pattern))
+    return {os.path.splitext(path)[0].replace(os.sep, '.'):
+            os.path.getsize(path) for path in paths}
+
+
+def shard(modules, workers):
+    """
+    Split the modules between the workers, giving the biggest remaining
+    module to the worker with the least work so far.
+    """
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for name in sorted(modules, key=lambda name: (-modules[name], name)):
+        i = loads.index(min(loads))
+        shards[i].append(name)
+        loads[i] += modules[name]
+    return [s for s in shards if s]
+
+
+class WorkerDatabases(object):
+    """
+    A template database with the schema, and one clone of it per worker.
+    The names are derived from the name of the database in ``url``.
+    """
+
+    def __init__(self, url, workers):
+        self.url = make_url(url)
+        self.template = f'{self.url.database}_template'
+        self.names = [f'{self.url.database}_{i}' for i in range(workers)]
+        # CREATE and DROP DATABASE can't run inside a transaction
+        admin_url = make_url(url)
+        admin_url.database = 'postgres'
+        self._admin = create_engine(admin_url, isolation_level='AUTOCOMMIT')
+
+    def url_for(self, name):
+        url = make_url(str(self.url))
+        url.database = name
+        return str(url)
+
+    def create(self):
+        from project import db
+        from project.admin import models  # noqa: F401, registers the tables
+        self.drop()
+        self._admin.execute(f'CREATE DATABASE "{self.template}"')
+        engine = create_engine(self.url_for(self.template))
+        db.metadata.create_all(engine)
+        # a template can't be copied while anyone is connected to it
+        engine.dispose()
+        for name in self.names:
+            self._admin.execute(
+                f'CREATE DATABASE "{name}" TEMPLATE "{self.template}"')
+
+    def drop(self):
+        for name in self.names + [self.template]:
+            self._admin.execute(f'DROP DATABASE IF EXISTS "{name}"')
+
+    def close(self):
+        self._admin.dispose()
+
+
+def coverage_command(options):
+    """The `coverage run` prefix for a worker, from Coverage() options"""
+    command = [sys.executable, '-m', 'coverage', 'run', '--parallel-mode']
+    if options.get('branch'):
+        command.append('--branch')
+    if options.get('include'):
+        command.append('--include=' + ','.join(options['include']))
+    if options.get('omit'):
+        command.append('--omit=' + ','.join(options['omit']))
+    return command
+
+
+def run(workers=None, verbosity=2, coverage_options=None,
+        start_dir=TESTS_DIR, pattern=TESTS_PATTERN, stream=sys.stderr):
+    """
+    Run the tests in ``workers`` processes (default: one per core) and
+    return True if they all passed.  If ``coverage_options`` are given, the
+    workers measure coverage, and leave their data files in the current
+    directory for the caller to combine.
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = shard(find_test_modules(start_dir, pattern), workers)
+    databases = WorkerDatabases(os.environ['DATABASE_TEST_URL'], len(shards))
+    started = time.time()
+    databases.create()
+    processes = []
+    results = []
+    try:
+        for name, modules in zip(databases.names, shards):
+            env = dict(os.environ, DATABASE_TEST_URL=databases.url_for(name))
+            result_file = tempfile.NamedTemporaryFile(
+                prefix='test-worker-', suffix='.json', delete=False)
+            result_file.close()
+            command = (coverage_command(coverage_options) if coverage_options
+                       else [sys.executable])
+            command += ['-m', __name__, result_file.name, str(verbosity)]
+            command += modules
+            processes.append(
+                (subprocess.Popen(command, env=env), result_file.name))
+        for process, result_path in processes:
+            process.wait()
+            with open(result_path) as result_file:
+                try:
+                    result = json.load(result_file)
+                except ValueError:
+                    # the worker died before writing anything
+                    result = {'output': '', 'testsRun': 0, 'failures': 0,
+                              'errors': 1, 'skipped': 0,
+                              'crashed': process.returncode}
+            results.append(result)
+    finally:
+        for process, result_path in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            os.remove(result_path)
+        databases.drop()
+        databases.close()
+    return report(results, time.time() - started, stream)
+
+
+def report(results, duration, stream):
+    """Print the output of each worker and a summary like unittest's"""
+    for i, result in enumerate(results):
+        stream.write(f'\n===== worker {i} =====\n')
+        stream.write(result['output'])
+        if 'crashed' in result:
+            stream.write(f"worker exited with status {result['crashed']}\n")
+    tests_run = sum(result['testsRun'] for result in results)
+    failures = sum(result['failures'] for result in results)
+    errors = sum(result['errors'] for result in results)
+    skipped = sum(result['skipped'] for result in results)
+    stream.write('\n' + '=' * 70 + '\n')
+    stream.write(f'Ran {tests_run} tests in {len(results)} workers in '
+                 f'{duration:.3f}s\n\n')
+    if failures or errors:
+        stream.write(f'FAILED (failures={failures}, errors={errors})\n')
+        return False
+    stream.write(f'OK (skipped={skipped})\n' if skipped else 'OK\n')
+    return True
+
+
+def main(argv):
+    """Worker entry point: result file, verbosity, then the test modules"""
+    result_path, verbosity, modules = argv[0], int(argv[1]), argv[2:]
+    output = io.StringIO()
+    tests = unittest.TestLoader().loadTestsFromNames(modules)
+    result = unittest.TextTestRunner(stream=output,
+                                     verbosity=verbosity).run(tests)
+    with open(result_path, 'w') as result_file:
+        json.dump({
+            'output': output.getvalue(),
+            'testsRun': result.testsRun,
+            'failures': len(result.failures),
+            'errors': len(result.errors),
+            'skipped': len(result.skipped),
+        }, result_file)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
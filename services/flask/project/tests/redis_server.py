@@ -0,0 +1,143 @@
+# services/flask/project/tests/redis_server.py
+
+"""
+A stand-in for a Redis server, for testing the redis cache backend without
+running one.  It speaks enough of the protocol for the backend: PING, QUIT,
+AUTH, SELECT, GET, MGET, SET (with PX), DEL and SCAN (with MATCH).
+"""
+
+import fnmatch
+import re
+import socketserver
+import threading
+import time
+
+
+def _glob_to_fnmatch(pattern):
+    # Redis escapes special characters with a backslash, fnmatch with []
+    return re.sub(r'\\(.)', r'[\1]', pattern)
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b'*', line
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode()
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        if isinstance(value, Exception):
+            return b'-ERR %s\r\n' % str(value).encode()
+        return (b'*%d\r\n' % len(value) +
+                b''.join(self.reply(item) for item in value))
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].decode().upper()
+            method = getattr(self.server, 'command_' + command.lower(), None)
+            if method is None:
+                result = Exception(f'unknown command {command}')
+            else:
+                with self.server.lock:
+                    result = method(*args[1:])
+            self.wfile.write(self.reply(result))
+            if command == 'QUIT':
+                return
+
+
+class RedisServer(socketserver.ThreadingTCPServer):
+    """Run with start(), and connect to url"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RedisHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    @property
+    def url(self):
+        return 'redis://%s:%d/0' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.01,),
+                                  daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def command_ping(self):
+        return 'PONG'
+
+    def command_quit(self):
+        return 'OK'
+
+    def command_auth(self, password):
+        return 'OK'
+
+    def command_select(self, db):
+        return 'OK'
+
+    def command_get(self, key):
+        self.commands += 1
+        return self.data[key] if self._live(key) else None
+
+    def command_mget(self, *keys):
+        self.commands += 1
+        return [self.data[key] if self._live(key) else None for key in keys]
+
+    def command_set(self, key, value, *options):
+        self.commands += 1
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if options and options[0].upper() == b'PX':
+            self.expires[key] = time.time() + int(options[1]) / 1000
+        return 'OK'
+
+    def command_del(self, *keys):
+        self.commands += 1
+        deleted = 0
+        for key in keys:
+            if self._live(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def command_scan(self, cursor, *options):
+        self.commands += 1
+        options = dict(zip(options[::2], options[1::2]))
+        pattern = _glob_to_fnmatch(options.get(b'MATCH', b'*').decode())
+        keys = [key for key in list(self.data) if self._live(key) and
+                fnmatch.fnmatchcase(key.decode(), pattern)]
+        return [b'0', keys]
@@ -0,0 +1,123 @@
+# services/flask/project/tests/test_access_log.py
+
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from project import access_log, create_app
+from project.access_log import DroppingQueueHandler
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestAccessLog(BaseTestCase):
+    """Tests for the access log."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'access.log')
+        self.app.config['ACCESS_LOG_ENABLED'] = True
+        self.app.config['ACCESS_LOG_FILE'] = self.path
+        self.user = add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        access_log.stop()
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        """The lines of the log, once they have all been written"""
+        access_log.stop()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_request_is_logged(self):
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        entry = self.entries()[-1]
+        self.assertEqual('GET', entry['method'])
+        self.assertEqual('/admin/jobs', entry['route'])
+        self.assertEqual('/admin/jobs', entry['path'])
+        self.assertEqual(200, entry['status'])
+        self.assertEqual(self.user.id, entry['userId'])
+        self.assertEqual(len(response.data), entry['bytes'])
+        self.assertGreater(entry['dbQueries'], 0)
+        self.assertGreaterEqual(entry['durationMs'], entry['dbTimeMs'])
+        self.assertEqual(1.0, entry['sampleRate'])
+        self.assertTrue(entry['time'].endswith('Z'))
+
+    def test_anonymous_request(self):
+        self.app.config['ACCESS_LOG_SAMPLE_RATES'] = {'/admin/ping': 1.0}
+        self.client.get('/admin/ping')
+        entry = self.entries()[-1]
+        self.assertEqual('/admin/ping', entry['route'])
+        self.assertIsNone(entry['userId'])
+
+    def test_sampling(self):
+        self.app.config['ACCESS_LOG_SAMPLE_RATES'] = {'/admin/ping': 0.0}
+        self.client.get('/admin/ping')
+        self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(['/admin/login', '/admin/jobs'],
+                         [entry['route'] for entry in self.entries()])
+
+    def test_slow_requests_are_always_logged(self):
+        self.app.config['ACCESS_LOG_SAMPLE_RATES'] = {'/admin/ping': 0.0}
+        self.app.config['ACCESS_LOG_SLOW_TIME'] = 0
+        self.client.get('/admin/ping')
+        self.assertEqual('/admin/ping', self.entries()[-1]['route'])
+
+    def test_disabled(self):
+        access_log.stop()
+        os.remove(self.path)
+        self.app.config['ACCESS_LOG_ENABLED'] = False
+        self.client.get('/admin/ping')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unhandled_exception(self):
+        app = create_app()
+
+        @app.route('/fail')
+        def fail():
+            raise RuntimeError('fail')
+
+        app.config['ACCESS_LOG_ENABLED'] = True
+        app.config['ACCESS_LOG_FILE'] = self.path
+        app.config['PROPAGATE_EXCEPTIONS'] = False
+        app.config['PRESERVE_CONTEXT_ON_EXCEPTION'] = False
+        self.assertEqual(500, app.test_client().get('/fail').status_code)
+        entry = self.entries()[-1]
+        self.assertEqual('/fail', entry['route'])
+        self.assertEqual(500, entry['status'])
+
+    def test_full_queue_drops_records(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        record = logging.makeLogRecord({'msg': 'request'})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(1, handler.queue.qsize())
+        self.assertEqual(1, handler.dropped)
+
+
+if __name__ == '__main__':
+    unittest.main()
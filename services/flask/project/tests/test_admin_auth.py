@@ -31,6 +31,8 @@ class TestAdminAuthRoutes(BaseTestCase):
             self.assertTrue(data['auth_token'])
             exp_datetime = parser.parse(data['expiration'])
             self.assertTrue(isinstance(exp_datetime, datetime.datetime))
+            # in UTC, with an offset that browsers don't read as local time
+            self.assertEqual(datetime.timedelta(0), exp_datetime.utcoffset())
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 201)
 
@@ -150,6 +152,8 @@ class TestAdminAuthRoutes(BaseTestCase):
             self.assertTrue(data['auth_token'])
             exp_datetime = parser.parse(data['expiration'])
             self.assertTrue(isinstance(exp_datetime, datetime.datetime))
+            # in UTC, with an offset that browsers don't read as local time
+            self.assertEqual(datetime.timedelta(0), exp_datetime.utcoffset())
             self.assertTrue(response.content_type == 'application/json')
             self.assertTrue(data['user'])
             self.assertEqual(data['user']['username'], 'test')
@@ -256,6 +260,8 @@ class TestAdminAuthRoutes(BaseTestCase):
             self.assertTrue(data['user']['email'] == 'test@test.com')
             exp_datetime = parser.parse(data['expiration'])
             self.assertTrue(isinstance(exp_datetime, datetime.datetime))
+            # in UTC, with an offset that browsers don't read as local time
+            self.assertEqual(datetime.timedelta(0), exp_datetime.utcoffset())
             self.assertEqual(response.status_code, 200)
 
     def test_invalid_status(self):
@@ -354,6 +360,8 @@ class TestAdminAuthRoutes(BaseTestCase):
             self.assertTrue(data['user']['email'] == 'test@test.com')
             exp_datetime = parser.parse(data['expiration'])
             self.assertTrue(isinstance(exp_datetime, datetime.datetime))
+            # in UTC, with an offset that browsers don't read as local time
+            self.assertEqual(datetime.timedelta(0), exp_datetime.utcoffset())
             self.assertEqual(response.status_code, 200)
 
 
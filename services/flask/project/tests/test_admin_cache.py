@@ -0,0 +1,509 @@
+# services/flask/project/tests/test_admin_cache.py
+
+import datetime
+import json
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from project import cache, db, events_cache, row_cache, single_flight
+from project.admin.models import Job
+from project.cache import (CacheError, LRUCache, MemoryBackend,
+                           RedisBackend, PostgresBackend, cache_entries)
+from project.tests.base import BaseTestCase
+from project.tests.redis_server import RedisServer
+from project.tests.utils import add_user, add_job, add_one_time_expense
+
+
+class TestLRUCache(unittest.TestCase):
+    """Tests for the LRU cache."""
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual({'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1,
+                          'evictions': 1}, cache.stats())
+
+    def test_delete_and_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
+class BackendTests(object):
+    """Tests that every cache backend must pass."""
+
+    def test_get_and_set(self):
+        value = {'id': 1, 'startDate': datetime.date(2018, 3, 1),
+                 'tags': ['a', 'b']}
+        self.backend.set('a', value)
+        self.assertEqual(value, self.backend.get('a'))
+        self.assertIsNone(self.backend.get('missing'))
+
+    def test_bulk(self):
+        self.backend.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual({'a': 1, 'c': 3},
+                         self.backend.get_many(['a', 'c', 'missing']))
+        self.backend.delete_many(['a', 'b'])
+        self.assertEqual({'c': 3}, self.backend.get_many(['a', 'b', 'c']))
+        self.assertEqual({}, self.backend.get_many([]))
+
+    def test_overwrite(self):
+        self.backend.set('a', 1, ttl=0.01)
+        self.backend.set('a', 2)
+        time.sleep(0.02)
+        self.assertEqual(2, self.backend.get('a'))
+
+    def test_ttl(self):
+        self.backend.set_many({'a': 1, 'b': 2}, ttl=0.05)
+        self.backend.set('c', 3, ttl=60)
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3},
+                         self.backend.get_many(['a', 'b', 'c']))
+        time.sleep(0.1)
+        self.assertEqual({'c': 3}, self.backend.get_many(['a', 'b', 'c']))
+
+    def test_delete_prefix(self):
+        self.backend.set_many({'ns:1': 1, 'ns:2': 2, 'ns2:1': 3,
+                               'n%_:1': 4})
+        self.backend.delete_prefix('ns:')
+        self.backend.delete_prefix('n%_:')
+        self.assertEqual({'ns2:1': 3},
+                         self.backend.get_many(['ns:1', 'ns:2', 'ns2:1',
+                                                'n%_:1']))
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    """Tests for the in-process cache backend."""
+
+    def setUp(self):
+        self.backend = MemoryBackend(maxsize=100)
+
+    def test_max_size(self):
+        backend = MemoryBackend(maxsize=2)
+        backend.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual({'b': 2, 'c': 3}, backend.get_many(['a', 'b', 'c']))
+        self.assertEqual(1, backend.stats()['evictions'])
+
+
+class TestRedisBackend(BackendTests, unittest.TestCase):
+    """Tests for the Redis cache backend, against a stand-in server."""
+
+    def setUp(self):
+        self.server = RedisServer().start()
+        self.backend = RedisBackend(self.server.url)
+
+    def tearDown(self):
+        self.backend.close()
+        self.server.stop()
+
+    def test_bulk_set_is_pipelined(self):
+        self.backend.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(3, self.server.commands)
+        self.backend.get_many(['a', 'b', 'c'])
+        self.assertEqual(4, self.server.commands)
+
+    def test_reconnects(self):
+        self.backend.set('a', 1)
+        # the server closes the connection after replying to QUIT
+        self.backend.execute(['QUIT'])
+        self.assertEqual(1, self.backend.get('a'))
+
+    def test_error_reply(self):
+        with self.assertRaises(CacheError):
+            self.backend.execute(['NOSUCHCOMMAND'])
+        # the connection still works after an error
+        self.assertEqual([0], self.backend.execute(['DEL', 'missing']))
+
+
+class TestPostgresBackend(BackendTests, BaseTestCase):
+    """Tests for the cache backend that uses an unlogged table."""
+
+    def setUp(self):
+        super().setUp()
+        self.engine = create_engine(
+                self.app.config['SQLALCHEMY_DATABASE_URI'])
+        cache_entries.create(self.engine, checkfirst=True)
+        self.backend = PostgresBackend(self.engine)
+
+    def tearDown(self):
+        cache_entries.drop(self.engine, checkfirst=True)
+        self.backend.close()
+        super().tearDown()
+
+    def test_missing_table(self):
+        cache_entries.drop(self.engine)
+        with self.assertRaises(CacheError):
+            self.backend.get('a')
+
+    def test_table_is_unlogged(self):
+        self.backend.set('a', 1)
+        persistence = self.engine.execute(
+            "SELECT relpersistence FROM pg_class "
+            "WHERE relname = 'cache_entries'").scalar()
+        self.assertEqual('u', persistence)
+
+
+class TestNamespace(BaseTestCase):
+    """Tests for cache namespaces."""
+
+    def test_namespaces_are_separate(self):
+        first = cache.namespace('first')
+        second = cache.namespace('second')
+        first.set_many({1: 'a', 2: 'b'})
+        second.set(1, 'c')
+        self.assertEqual({1: 'a', 2: 'b'}, first.get_many([1, 2]))
+        first.clear()
+        self.assertIsNone(first.get(1))
+        self.assertEqual('c', second.get(1))
+        self.assertIs(first, cache.namespace('first'))
+
+    def test_unreachable_backend(self):
+        """Ensure that a backend that's down acts like an empty cache."""
+        namespace = cache.namespace('unreachable')
+        backend = self.app.extensions['cache']
+        server = RedisServer()
+        url = server.url
+        server.server_close()
+        self.app.extensions['cache'] = RedisBackend(url)
+        try:
+            namespace.set('a', 1)
+            self.assertIsNone(namespace.get('a'))
+            namespace.clear()
+            self.assertEqual(3, namespace.stats()['errors'])
+        finally:
+            self.app.extensions['cache'] = backend
+
+
+class TestRowCache(BaseTestCase):
+    """Tests for the cache of rows loaded by id."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    VALID_JOB_DICT1 = {
+        'client': 'Client 1',
+        'description': 'Description 1',
+        'amountPaid': 100.5,
+        'paidTo': 'Tyler',
+        'workedBy': 'Tyler',
+        'confirmation': 'Confirmed',
+        'hasPaid': False,
+        'startDate': '2018-03-01',
+        'endDate': '2018-03-02',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['ROW_CACHE_ENABLED'] = True
+
+    def login(self):
+        """Log in as VALID_USER_DICT1 and return the auth headers"""
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        return {'Authorization': f'Bearer {token}'}
+
+    def get_json(self, url, headers):
+        response = self.client.get(url, headers=headers)
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_get_single_job_is_cached(self):
+        """Ensure that a job is loaded from the database only once."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        headers = self.login()
+        before = row_cache.stats()
+        status, first = self.get_json('/admin/jobs/1', headers)
+        self.assertEqual(200, status)
+        status, second = self.get_json('/admin/jobs/1', headers)
+        self.assertEqual(first, second)
+        self.assertEqual('Client 1', second['data']['client'])
+        after = row_cache.stats()
+        self.assertEqual(1, after['hits'] - before['hits'])
+        self.assertEqual(1, after['misses'] - before['misses'])
+
+    def test_update_job_invalidates(self):
+        """Ensure that an updated job isn't served from the cache."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        headers = self.login()
+        self.get_json('/admin/jobs/1', headers)
+        job = dict(self.VALID_JOB_DICT1, client='Client 2')
+        response = self.client.post('/admin/jobs/1', data=json.dumps(job),
+                                    content_type='application/json',
+                                    headers=headers)
+        self.assertEqual(200, response.status_code)
+        status, data = self.get_json('/admin/jobs/1', headers)
+        self.assertEqual('Client 2', data['data']['client'])
+
+    def test_delete_job_invalidates(self):
+        """Ensure that a deleted job isn't served from the cache."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        headers = self.login()
+        self.get_json('/admin/jobs/1', headers)
+        response = self.client.delete('/admin/jobs/1', headers=headers)
+        self.assertEqual(200, response.status_code)
+        status, data = self.get_json('/admin/jobs/1', headers)
+        self.assertEqual(404, status)
+
+    def test_delete_one_time_expense_invalidates(self):
+        """Ensure that a deleted expense isn't served from the cache."""
+        add_one_time_expense('Merchant 1', 'Description 1', 10.0,
+                             '2018-01-01', 'Tyler', True, 'Food')
+        status, _ = self.get_json('/admin/one-time-expenses/1', {})
+        self.assertEqual(200, status)
+        self.client.delete('/admin/one-time-expenses/1')
+        status, _ = self.get_json('/admin/one-time-expenses/1', {})
+        self.assertEqual(404, status)
+
+    def test_missing_rows_are_not_cached(self):
+        """Ensure that a row that doesn't exist yet isn't cached."""
+        status, _ = self.get_json('/admin/users/1', {})
+        self.assertEqual(404, status)
+        add_user(**self.VALID_USER_DICT1)
+        status, data = self.get_json('/admin/users/1', {})
+        self.assertEqual(200, status)
+        self.assertEqual('testUser1', data['data']['username'])
+
+    def test_events_user_is_cached(self):
+        """Ensure that users_only loads the user through the cache."""
+        headers = self.login()
+        url = '/admin/events?startDate=2018-01-01&endDate=2018-12-31'
+        self.get_json(url, headers)
+        hits = row_cache.stats()['hits']
+        status, data = self.get_json(url, headers)
+        self.assertEqual(200, status)
+        self.assertEqual('testUser1', data['data']['user']['username'])
+        self.assertEqual(hits + 1, row_cache.stats()['hits'])
+
+    def test_cache_stats(self):
+        """Ensure that the cache counters are returned."""
+        headers = self.login()
+        self.get_json('/admin/users/1', headers)
+        status, data = self.get_json('/admin/cache/stats', headers)
+        self.assertEqual(200, status)
+        self.assertTrue(data['data']['rowCacheEnabled'])
+        self.assertEqual('memory', data['data']['backend'])
+        self.assertEqual(1, data['data']['backendStats']['size'])
+        self.assertIn('rows', data['data']['namespaces'])
+
+    def test_disabled(self):
+        """Ensure that nothing is cached unless the cache is enabled."""
+        self.app.config['ROW_CACHE_ENABLED'] = False
+        add_user(**self.VALID_USER_DICT1)
+        self.get_json('/admin/users/1', {})
+        self.get_json('/admin/users/1', {})
+        self.assertEqual(0, cache.backend.stats()['size'])
+
+
+class TestEventsCache(BaseTestCase):
+    """Tests for the cache of /events payloads."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    MARCH = '/admin/events?startDate=2018-03-01&endDate=2018-03-31'
+    APRIL = '/admin/events?startDate=2018-04-01&endDate=2018-04-30'
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['EVENTS_CACHE_ENABLED'] = True
+        self.headers = self.login()
+
+    def login(self):
+        """Log in as VALID_USER_DICT1 and return the auth headers"""
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        return {'Authorization': f'Bearer {token}'}
+
+    def clients(self, url):
+        """The clients of the jobs that /events returns"""
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data.decode())['data']
+        self.assertEqual('testUser1', data['user']['username'])
+        return [job['client'] for job in data['jobs']]
+
+    def post_job(self, client, start_date, url='/admin/jobs'):
+        job = {
+            'client': client,
+            'description': 'Description',
+            'amountPaid': 100.5,
+            'paidTo': 'Tyler',
+            'workedBy': 'Tyler',
+            'confirmation': 'Confirmed',
+            'hasPaid': False,
+            'startDate': start_date,
+            'endDate': start_date,
+        }
+        response = self.client.post(url, data=json.dumps(job),
+                                    content_type='application/json',
+                                    headers=self.headers)
+        self.assertIn(response.status_code, (200, 201))
+
+    def test_served_from_cache(self):
+        """Ensure that a window is loaded from the database only once."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-05', '2018-03-06')
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+        hits = cache.namespace('events').stats()['hits']
+        # added without invalidating, so it's only seen after a reload
+        add_job('Client 2', 'Description 2', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-07', '2018-03-07')
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+        self.assertEqual(hits + 1, cache.namespace('events').stats()['hits'])
+
+    def test_add_job_invalidates_overlapping_windows(self):
+        """Ensure that only the windows that overlap a new job are reloaded."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-04-05', '2018-04-05')
+        self.clients(self.MARCH)
+        self.assertEqual(['Client 1'], self.clients(self.APRIL))
+        add_job('Client 2', 'Description 2', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-04-06', '2018-04-06')
+        self.post_job('Client 3', '2018-03-10')
+        self.assertEqual(['Client 3'], self.clients(self.MARCH))
+        # April is still cached, so Client 2 isn't seen
+        self.assertEqual(['Client 1'], self.clients(self.APRIL))
+
+    def test_update_job_invalidates_old_and_new_dates(self):
+        """Ensure that moving a job reloads both windows."""
+        self.post_job('Client 1', '2018-03-10')
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+        self.assertEqual([], self.clients(self.APRIL))
+        self.post_job('Client 1', '2018-04-10', url='/admin/jobs/1')
+        self.assertEqual([], self.clients(self.MARCH))
+        self.assertEqual(['Client 1'], self.clients(self.APRIL))
+
+    def test_delete_job_invalidates(self):
+        self.post_job('Client 1', '2018-03-10')
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+        self.client.delete('/admin/jobs/1', headers=self.headers)
+        self.assertEqual([], self.clients(self.MARCH))
+
+    def test_expenses_invalidate(self):
+        self.clients(self.MARCH)
+        expense = {
+            'merchant': 'Merchant 1',
+            'description': 'Description 1',
+            'amountSpent': 10.0,
+            'date': '2018-03-15',
+            'paidBy': 'Tyler',
+            'taxDeductible': True,
+            'category': 'Food',
+        }
+        self.client.post('/admin/one-time-expenses',
+                         data=json.dumps(expense),
+                         content_type='application/json')
+        response = self.client.get(self.MARCH, headers=self.headers)
+        data = json.loads(response.data.decode())['data']
+        self.assertEqual(['Merchant 1'],
+                         [e['merchant'] for e in data['expenses']])
+
+    def test_formats_are_cached_separately(self):
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-05', '2018-03-06')
+        self.clients(self.MARCH)
+        response = self.client.get(self.MARCH + '&format=columns',
+                                   headers=self.headers)
+        data = json.loads(response.data.decode())['data']
+        self.assertEqual(['Client 1'], data['jobs']['columns']['client'])
+
+    def test_import_invalidates(self):
+        self.clients(self.MARCH)
+        rows = ('client,description,amount_paid,paid_to,worked_by,'
+                'confirmation,has_paid,start_date,end_date\n'
+                'Client 1,Description,1,Tyler,Tyler,Confirmed,false,'
+                '2018-03-05,2018-03-05\n')
+        response = self.client.post('/admin/import/jobs.csv', data=rows,
+                                    content_type='text/csv',
+                                    headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+
+    def test_long_windows_are_not_cached(self):
+        """Ensure that windows longer than the maximum aren't cached."""
+        self.app.config['EVENTS_CACHE_MAX_DAYS'] = 10
+        self.clients(self.MARCH)
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-05', '2018-03-06')
+        self.assertEqual(['Client 1'], self.clients(self.MARCH))
+
+    def test_reload_after_write_is_not_coalesced(self):
+        """Ensure that a reload after a write doesn't share the read of a
+        request that started before it, when the cache is off."""
+        self.app.config['EVENTS_CACHE_ENABLED'] = False
+        self.app.config['SINGLE_FLIGHT_ENABLED'] = True
+        followers = single_flight.stats()['followers']
+        release = threading.Event()
+        # The test's own transaction is never committed, so the earlier
+        # request and the write use connections of their own, and what was
+        # committed is deleted afterwards
+        reader = db.engine.connect()
+        writer = db.engine.connect()
+
+        def earlier_request():
+            with self.app.app_context():
+                db.session.registry.set(Session(bind=reader))
+                events_cache.get('2018-03-01', '2018-03-31', 'rows',
+                                 lambda: release.wait(5) and {})
+                db.session.remove()
+        thread = threading.Thread(target=earlier_request)
+        thread.start()
+        try:
+            while not single_flight.stats()['inFlight']:
+                time.sleep(0.01)
+            session = Session(bind=writer)
+            session.add(Job('Client 1', 'Description 1', 100.5, 'Tyler',
+                            'Tyler', 'Confirmed', False, '2018-03-10'))
+            session.commit()
+            session.close()
+            self.assertEqual(['Client 1'], self.clients(self.MARCH))
+        finally:
+            release.set()
+            thread.join()
+            writer.execute('DELETE FROM changes')
+            writer.execute('DELETE FROM jobs')
+            writer.close()
+            reader.close()
+        self.assertEqual(followers, single_flight.stats()['followers'])
+
+
+if __name__ == '__main__':
+    unittest.main()
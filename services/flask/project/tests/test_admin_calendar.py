@@ -151,6 +151,56 @@ class TestAdminCalendarRoutes(BaseTestCase):
                              self.VALID_USER_DICT1['email'])
             self.assertEqual(data['data']['user']['id'], 1)
 
+    def test_get_events_columns_format(self):
+        """
+        Test getting events with ?format=columns, which returns one array
+        per field instead of a list of objects.
+        """
+        add_user(**self.VALID_USER_DICT1)
+        add_job(**self.VALID_JOB_DICT1)
+        add_job(**self.VALID_JOB_DICT2)
+        add_one_time_expense(**self.VALID_EXPENSE_DICT1)
+
+        with self.client:
+            resp_login = self.client.post(
+                '/admin/login',
+                data=json.dumps({
+                    'username': self.VALID_USER_DICT1['username'],
+                    'password': self.VALID_USER_DICT1['password']
+                }),
+                content_type='application/json'
+            )
+            token = json.loads(resp_login.data.decode())['auth_token']
+            request_data = {
+                     'startDate': self.FIRST_DAY.isoformat(),
+                     'endDate': self.LAST_DAY.isoformat(),
+                     'format': 'columns'
+            }
+            response = self.client.get(
+                url_for('admin.get_events', **request_data),
+                headers={'Authorization': f'Bearer {token}'}
+            )
+            data = json.loads(response.data.decode())
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['status'], 'success')
+            jobs = data['data']['jobs']
+            self.assertEqual(jobs['format'], 'columns')
+            self.assertEqual(jobs['length'], 2)
+            self.assertEqual(sorted(jobs['columns']['client']),
+                             ['Job Client 1', 'Job Client 2'])
+            paid_to = jobs['columns']['paidTo']
+            self.assertEqual([paid_to['dictionary'][c]
+                              for c in paid_to['codes']],
+                             [self.VALID_JOB_DICT1['paid_to'],
+                              self.VALID_JOB_DICT2['paid_to']])
+            expenses = data['data']['expenses']
+            self.assertEqual(expenses['length'], 1)
+            self.assertEqual(expenses['columns']['merchant'],
+                             [self.VALID_EXPENSE_DICT1['merchant']])
+            self.assertEqual(data['data']['user']['username'],
+                             self.VALID_USER_DICT1['username'])
+
     def test_get_events_not_signed_in(self):
         """
         Test attempting to get jobs and one-time-expenses (events)
@@ -0,0 +1,193 @@
+# services/flask/project/tests/test_admin_changes.py
+
+import datetime
+import json
+import unittest
+
+from project import db
+from project.admin.changes import prune_changes
+from project.admin.models import Change, Job
+from project.tests.base import BaseTestCase
+from project.tests.utils import (add_user, add_job, add_one_time_expense,
+                                 add_recurring_expense)
+
+
+class TestAdminChanges(BaseTestCase):
+    """Tests for the change feed."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def get_changes(self, query=''):
+        response = self.client.get(f'/admin/changes{query}',
+                                   headers=self.headers)
+        return response.status_code, json.loads(response.data.decode())
+
+    def add_job(self, client='Client 1'):
+        return add_job(client, 'Description 1', 100.5, 'Tyler', 'Tyler',
+                       'Confirmed', False, '2018-03-01', '2018-03-02')
+
+    def test_cursor_without_since(self):
+        status, data = self.get_changes()
+        self.assertEqual(200, status)
+        self.assertEqual({'changes': [], 'cursor': 0, 'more': False},
+                         data['data'])
+        self.add_job()
+        status, data = self.get_changes()
+        self.assertEqual(1, data['data']['cursor'])
+        self.assertEqual([], data['data']['changes'])
+
+    def test_created_rows(self):
+        self.add_job()
+        add_one_time_expense('Merchant 1', 'Description 1', 10.0,
+                             '2018-03-01', 'Tyler', True, 'Food')
+        add_recurring_expense('Merchant 1', 'Description 1', 10.0, True,
+                              'Housing', 'Monthly', 'Tyler', '2017-01-01')
+        status, data = self.get_changes('?since=0')
+        self.assertEqual(200, status)
+        changes = data['data']['changes']
+        self.assertEqual(['jobs', 'one_time_expenses', 'recurring_expenses'],
+                         [change['table'] for change in changes])
+        self.assertEqual(['upsert'] * 3,
+                         [change['operation'] for change in changes])
+        self.assertEqual('Client 1', changes[0]['row']['client'])
+        self.assertEqual('2018-03-01', changes[1]['row']['date'])
+        self.assertNotIn('endDate', changes[2]['row'])
+        self.assertEqual(3, data['data']['cursor'])
+        self.assertFalse(data['data']['more'])
+
+    def test_only_changes_after_the_cursor(self):
+        self.add_job()
+        _, data = self.get_changes('?since=0')
+        cursor = data['data']['cursor']
+        self.add_job('Client 2')
+        _, data = self.get_changes(f'?since={cursor}')
+        self.assertEqual([2], [change['id']
+                               for change in data['data']['changes']])
+        _, data = self.get_changes(f"?since={data['data']['cursor']}")
+        self.assertEqual([], data['data']['changes'])
+
+    def test_updated_and_deleted_rows(self):
+        self.add_job()
+        self.add_job('Client 2')
+        _, data = self.get_changes('?since=0')
+        cursor = data['data']['cursor']
+        job = Job.query.get(1)
+        job.client = 'Client 3'
+        db.session.commit()
+        response = self.client.delete('/admin/jobs/2', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        _, data = self.get_changes(f'?since={cursor}')
+        self.assertEqual([
+            {'table': 'jobs', 'id': 1, 'operation': 'upsert',
+             'row': Job.query.get(1).to_json()},
+            {'table': 'jobs', 'id': 2, 'operation': 'delete'},
+        ], data['data']['changes'])
+
+    def test_unmodified_rows_are_not_recorded(self):
+        self.add_job()
+        job = Job.query.get(1)
+        job.client = 'Client 1'
+        db.session.commit()
+        self.assertEqual(1, Change.query.count())
+
+    def test_only_the_last_change_of_a_row(self):
+        job = self.add_job()
+        job.client = 'Client 2'
+        db.session.commit()
+        _, data = self.get_changes('?since=0')
+        self.assertEqual(['Client 2'], [change['row']['client']
+                                        for change in data['data']['changes']])
+        self.assertEqual(2, data['data']['cursor'])
+
+    def test_created_and_deleted_rows(self):
+        """Ensure that a row that was deleted after the page is reported as
+        deleted."""
+        job = self.add_job()
+        db.session.delete(job)
+        db.session.commit()
+        _, data = self.get_changes('?since=0&limit=1')
+        self.assertEqual([{'table': 'jobs', 'id': 1, 'operation': 'delete'}],
+                         data['data']['changes'])
+        self.assertEqual(1, data['data']['cursor'])
+        self.assertTrue(data['data']['more'])
+
+    def test_pages(self):
+        for i in range(5):
+            self.add_job(f'Client {i}')
+        _, data = self.get_changes('?since=0&limit=2')
+        self.assertEqual([1, 2], [change['id']
+                                  for change in data['data']['changes']])
+        self.assertTrue(data['data']['more'])
+        _, data = self.get_changes('?since=2&limit=3')
+        self.assertEqual([3, 4, 5], [change['id']
+                                     for change in data['data']['changes']])
+        self.assertFalse(data['data']['more'])
+
+    def test_import_resets_the_table(self):
+        self.add_job()
+        body = ('client,description,amount_paid,paid_to,worked_by,'
+                'confirmation,has_paid,start_date,end_date\n'
+                'Client 2,Description 2,10,Tyler,Tyler,Confirmed,true,'
+                '2018-03-01,\n')
+        response = self.client.post('/admin/import/jobs.csv', data=body,
+                                    content_type='text/csv',
+                                    headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        add_one_time_expense('Merchant 1', 'Description 1', 10.0,
+                             '2018-03-01', 'Tyler', True, 'Food')
+        _, data = self.get_changes('?since=0')
+        self.assertEqual([
+            {'table': 'jobs', 'operation': 'reset'},
+            {'table': 'one_time_expenses', 'id': 1, 'operation': 'upsert',
+             'row': data['data']['changes'][1]['row']},
+        ], data['data']['changes'])
+
+    def test_invalid_parameters(self):
+        for query in ('?since=a', '?since=-1', '?since=0&limit=0',
+                      '?since=0&limit=b'):
+            status, data = self.get_changes(query)
+            self.assertEqual(400, status, query)
+            self.assertEqual('fail', data['status'])
+
+    def test_expired_cursor(self):
+        for i in range(3):
+            self.add_job(f'Client {i}')
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=60)
+        Change.query.update({'changed_at': old})
+        self.assertEqual(2, prune_changes(datetime.timedelta(30)))
+        status, data = self.get_changes('?since=1')
+        self.assertEqual(410, status)
+        status, data = self.get_changes('?since=2')
+        self.assertEqual(200, status)
+        self.assertEqual([3], [change['id']
+                               for change in data['data']['changes']])
+
+    def test_updated_at(self):
+        job = self.add_job()
+        self.assertIsInstance(job.updated_at, datetime.datetime)
+
+    def test_requires_login(self):
+        response = self.client.get('/admin/changes?since=0')
+        self.assertEqual(401, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
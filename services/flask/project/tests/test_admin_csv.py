@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import unittest
+
+from project import db
+from project.tests.base import BaseTestCase
+from project.admin.models import Job, RecurringExpense
+from project.tests.utils import (add_user, add_job, add_one_time_expense,
+                                 add_recurring_expense)
+
+
+class TestAdminCSVRoutes(BaseTestCase):
+    """Tests for the CSV export and import routes."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def login(self):
+        """Log in as VALID_USER_DICT1 and return the auth headers"""
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        return {'Authorization': f'Bearer {token}'}
+
+    def read_csv(self, response):
+        return list(csv.reader(io.StringIO(response.data.decode())))
+
+    def test_export_jobs(self):
+        """Ensure that jobs are exported as CSV."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        response = self.client.get('/admin/export/jobs.csv',
+                                   headers=self.login())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('jobs.csv', response.headers['Content-Disposition'])
+        rows = self.read_csv(response)
+        self.assertEqual(rows[0], ['id', 'client', 'description',
+                                   'amount_paid', 'paid_to', 'worked_by',
+                                   'confirmation', 'has_paid',
+                                   'start_date', 'end_date'])
+        self.assertEqual(rows[1], ['1', 'Client 1', 'Description 1',
+                                   '100.5', 'Tyler', 'Tyler', 'Confirmed',
+                                   'False', '2018-03-01', '2018-03-02'])
+        self.assertEqual(len(rows), 2)
+
+    def test_export_date_range(self):
+        """Ensure that only rows that overlap the date range are exported."""
+        add_one_time_expense('Merchant 1', 'Description 1', 10.0,
+                             '2017-12-31', 'Tyler', True, 'Food')
+        add_one_time_expense('Merchant 2', 'Description 2', 20.0,
+                             '2018-06-01', 'Tyler', True, 'Food')
+        add_one_time_expense('Merchant 3', 'Description 3', 30.0,
+                             '2019-01-01', 'Tyler', True, 'Food')
+        response = self.client.get(
+            '/admin/export/one_time_expenses.csv' +
+            '?startDate=2018-01-01&endDate=2018-12-31',
+            headers=self.login())
+        self.assertEqual(response.status_code, 200)
+        rows = self.read_csv(response)
+        self.assertEqual([row[1] for row in rows[1:]], ['Merchant 2'])
+
+    def test_export_recurring_expenses_without_end_date(self):
+        """Ensure that open-ended recurring expenses match any later range."""
+        add_recurring_expense('Merchant 1', 'Description 1', 10.0, True,
+                              'Housing', 'Monthly', 'Tyler', '2017-01-01')
+        add_recurring_expense('Merchant 2', 'Description 2', 20.0, True,
+                              'Housing', 'Monthly', 'Tyler', '2017-01-01',
+                              '2017-06-01')
+        response = self.client.get(
+            '/admin/export/recurring_expenses.csv?startDate=2018-01-01',
+            headers=self.login())
+        rows = self.read_csv(response)
+        self.assertEqual([row[1] for row in rows[1:]], ['Merchant 1'])
+        self.assertEqual(rows[1][rows[0].index('end_date')], '')
+
+    def test_export_unknown_table(self):
+        """Ensure that exporting an unknown table fails."""
+        response = self.client.get('/admin/export/users.csv',
+                                   headers=self.login())
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['message'], 'Table does not exist')
+
+    def test_export_invalid_date(self):
+        """Ensure that an invalid date is rejected."""
+        response = self.client.get(
+            '/admin/export/jobs.csv?startDate=notadate',
+            headers=self.login())
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_no_auth_header(self):
+        """Ensure that exporting requires an auth token."""
+        response = self.client.get('/admin/export/jobs.csv')
+        self.assertEqual(response.status_code, 401)
+
+    def test_import_jobs(self):
+        """Ensure that valid rows are imported and invalid ones reported."""
+        body = '\n'.join([
+            'client,description,amount_paid,paid_to,worked_by,confirmation,'
+            'has_paid,start_date,end_date',
+            'Client 1,Description 1,100.5,Tyler,Tyler,Confirmed,false,'
+            '2018-03-01,2018-03-02',
+            'Client 2,Description 2,200,Tyler,Tyler,Nope,true,2018-03-01,',
+            'Client 3,Description 3,abc,Tyler,Tyler,Confirmed,true,'
+            '2018-03-01,',
+            'Client 4,Description 4,300,Meghan,Meghan,Pencilled In,TRUE,'
+            '2018-04-01,',
+            'Client 5,Description 5,400,Tyler,Tyler,Confirmed,true,'
+            '2018-03-05,2018-03-01',
+        ])
+        response = self.client.post('/admin/import/jobs.csv', data=body,
+                                    content_type='text/csv',
+                                    headers=self.login())
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['data']['imported'], 2)
+        self.assertEqual(data['data']['rejected'], 3)
+        self.assertEqual([e['line'] for e in data['data']['errors']],
+                         [3, 4, 6])
+        self.assertIn("Invalid 'confirmation' value",
+                      data['data']['errors'][0]['message'])
+        self.assertEqual(data['data']['errors'][1]['message'],
+                         "'amount_paid' must be a number.")
+        jobs = Job.query.order_by(Job.id).all()
+        self.assertEqual([job.client for job in jobs],
+                         ['Client 1', 'Client 4'])
+        self.assertEqual(jobs[1].confirmation, Job.Confirmation.PENCILLED_IN)
+        self.assertTrue(jobs[1].has_paid)
+        # An empty end date defaults to the start date
+        self.assertEqual(jobs[1].end_date, jobs[1].start_date)
+
+    def test_import_reports_rows_rejected_by_database(self):
+        """Ensure that only the rows that the database rejects are
+        reported, and the rest of their chunk is imported."""
+        db.session.execute('ALTER TABLE jobs ADD CONSTRAINT '
+                           'test_amount_paid CHECK (amount_paid >= 0)')
+        rows = [f'Client {i},Description,{-1 if i in (2, 5) else 1},'
+                f'Tyler,Tyler,Confirmed,false,2018-03-01,'
+                for i in range(1, 7)]
+        body = '\n'.join([
+            'client,description,amount_paid,paid_to,worked_by,confirmation,'
+            'has_paid,start_date,end_date'] + rows)
+        response = self.client.post('/admin/import/jobs.csv', data=body,
+                                    content_type='text/csv',
+                                    headers=self.login())
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['data']['imported'], 4)
+        self.assertEqual([e['line'] for e in data['data']['errors']],
+                         [3, 6])
+        self.assertIn('test_amount_paid',
+                      data['data']['errors'][0]['message'])
+        self.assertEqual([job.client for job in
+                          Job.query.order_by(Job.id).all()],
+                         ['Client 1', 'Client 3', 'Client 4', 'Client 6'])
+
+    def test_import_multipart(self):
+        """Ensure that a CSV file can be uploaded as a form field."""
+        body = ('merchant,description,amount,tax_deductible,category,'
+                'recurrence,paid_by,start_date,end_date\n'
+                'Merchant 1,Description 1,50,true,Housing,Monthly,Tyler,'
+                '2018-01-01,\n')
+        response = self.client.post(
+            '/admin/import/recurring_expenses.csv',
+            data={'file': (io.BytesIO(body.encode()), 'expenses.csv')},
+            content_type='multipart/form-data',
+            headers=self.login())
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['data']['imported'], 1)
+        expense = RecurringExpense.query.first()
+        self.assertEqual(expense.recurrence,
+                         RecurringExpense.Recurrence.MONTHLY)
+        self.assertIsNone(expense.end_date)
+
+    def test_import_export_round_trip(self):
+        """Ensure that an exported CSV file can be imported again."""
+        add_one_time_expense('Merchant, Inc.', 'Description "1"', 10.0,
+                             '2018-01-01', 'Tyler', True, 'Food')
+        headers = self.login()
+        exported = self.client.get('/admin/export/one_time_expenses.csv',
+                                   headers=headers).data
+        response = self.client.post('/admin/import/one_time_expenses.csv',
+                                    data=exported, content_type='text/csv',
+                                    headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['data']['imported'], 1)
+        exported_again = self.client.get(
+            '/admin/export/one_time_expenses.csv', headers=headers)
+        rows = self.read_csv(exported_again)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1:], rows[2][1:])
+
+    def test_import_unknown_column(self):
+        """Ensure that a file with an unknown column is rejected."""
+        response = self.client.post('/admin/import/jobs.csv',
+                                    data='client,nope\nClient 1,x\n',
+                                    content_type='text/csv',
+                                    headers=self.login())
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'Unknown columns: nope')
+
+    def test_import_no_auth_header(self):
+        """Ensure that importing requires an auth token."""
+        response = self.client.post('/admin/import/jobs.csv', data='',
+                                    content_type='text/csv')
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import datetime
+import unittest
+
+from project import db
+from project.admin.models import Job, OneTimeExpense, RecurringExpense
+from project.admin.seed import DEFAULT_END_DATE, SyntheticData
+from project.tests.base import BaseTestCase
+
+
+class TestSyntheticData(BaseTestCase):
+    """Tests for the synthetic data generator used by seed_scale."""
+
+    START_DATE = datetime.date(2017, 1, 1)
+    END_DATE = datetime.date(2017, 12, 31)
+
+    def make_data(self, **kwargs):
+        return SyntheticData(start_date=self.START_DATE,
+                             end_date=self.END_DATE, **kwargs)
+
+    def test_deterministic(self):
+        """Ensure that the same seed generates the same rows."""
+        first = list(self.make_data(seed=1).chunks('jobs', 100, 30))
+        second = list(self.make_data(seed=1).chunks('jobs', 100, 30))
+        other = list(self.make_data(seed=2).chunks('jobs', 100, 30))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual([len(chunk) for chunk in first], [30, 30, 30, 10])
+
+    def test_default_dates_are_fixed(self):
+        """Ensure that the default date range doesn't depend on the day."""
+        data = SyntheticData()
+        self.assertEqual(DEFAULT_END_DATE, data.end_date)
+        self.assertEqual(list(data.chunks('jobs', 50)),
+                         list(SyntheticData().chunks('jobs', 50)))
+
+    def test_load(self):
+        """Ensure that generated rows load and respect the constraints."""
+        data = self.make_data()
+        self.assertEqual(data.load('jobs', 200, chunk_size=64), 200)
+        self.assertEqual(data.load('one_time_expenses', 150), 150)
+        self.assertEqual(data.load('recurring_expenses', 50), 50)
+        db.session.commit()
+        self.assertEqual(Job.query.count(), 200)
+        self.assertEqual(OneTimeExpense.query.count(), 150)
+        self.assertEqual(RecurringExpense.query.count(), 50)
+        for job in Job.query.all():
+            self.assertTrue(self.START_DATE <= job.start_date <= job.end_date)
+            self.assertTrue(job.end_date <= self.END_DATE)
+
+    def test_enum_weights(self):
+        """Ensure that enum weights control the distribution."""
+        data = self.make_data(enum_weights={
+            ('jobs', 'paid_to'): {Job.PaidTo.MEGHAN.value: 1}
+        })
+        data.load('jobs', 100)
+        db.session.commit()
+        self.assertEqual(
+            Job.query.filter(Job.paid_to != Job.PaidTo.MEGHAN).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
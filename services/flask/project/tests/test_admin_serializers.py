@@ -0,0 +1,224 @@
+import datetime
+import json
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from project.tests.base import BaseTestCase
+from project.admin.models import Job, RecurringExpense
+from project.admin import serializers
+from project.admin.serializers import (dumps, json_backends, api_response,
+                                       init_json_backend, packb, unpackb,
+                                       job_serializer,
+                                       recurring_expense_serializer)
+from project.tests.utils import add_user, add_job, add_recurring_expense
+
+
+class TestSerializers(BaseTestCase):
+    """Tests for the fast JSON serialization path."""
+
+    def test_dumps_dates_and_enums(self):
+        """Ensure that dates and enums are encoded as strings."""
+        data = {
+            'date': datetime.date(2018, 3, 1),
+            'paidTo': Job.PaidTo.TYLER,
+        }
+        decoded = json.loads(dumps(data).decode())
+        self.assertEqual(decoded['date'], '2018-03-01')
+        self.assertEqual(decoded['paidTo'], 'Tyler')
+
+    def test_dumps_datetimes_with_offset(self):
+        """Ensure that naive datetimes are encoded as UTC with an offset,
+        which browsers would otherwise read as local times."""
+        data = {
+            'naive': datetime.datetime(2018, 3, 1, 12, 30, 15, 250),
+            'aware': datetime.datetime(2018, 3, 1, 12, 30, 15, 250,
+                                       datetime.timezone.utc),
+        }
+        for encode in set(json_backends.values()):
+            decoded = json.loads(encode(data).decode())
+            self.assertEqual(decoded['naive'],
+                             '2018-03-01T12:30:15.000250+00:00')
+            self.assertEqual(decoded['aware'],
+                             '2018-03-01T12:30:15.000250+00:00')
+
+    def test_backends_agree(self):
+        """Ensure that every JSON backend produces the same document."""
+        data = {
+            'date': datetime.date(2018, 3, 1),
+            'time': datetime.datetime(2018, 3, 1, 12, 30, 15, 250),
+            'paidTo': Job.PaidTo.TYLER,
+            'amount': 111.11,
+            'nested': [{'hasPaid': False}],
+        }
+        outputs = [json.loads(encode(data).decode())
+                   for encode in json_backends.values()]
+        for output in outputs:
+            self.assertEqual(output, outputs[0])
+
+    def test_unknown_backend(self):
+        """Ensure that an unknown JSON_BACKEND is rejected at startup."""
+        app = Flask(__name__)
+        app.config['JSON_BACKEND'] = 'simplejson'
+        with self.assertRaises(ValueError):
+            init_json_backend(app)
+
+    def test_missing_orjson_is_logged(self):
+        """Ensure that falling back from orjson is logged."""
+        app = Flask(__name__)
+        app.config['JSON_BACKEND'] = 'orjson'
+        with mock.patch.object(serializers, 'orjson', None), \
+                self.assertLogs(serializers.logger, 'WARNING'):
+            init_json_backend(app)
+
+    def test_api_response(self):
+        """Ensure that api_response returns a JSON response."""
+        with self.app.test_request_context('/'):
+            response = api_response({'status': 'success'})
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertEqual(json.loads(response.data.decode()),
+                         {'status': 'success'})
+
+    def test_job_serializer_matches_to_json(self):
+        """Ensure that the job serializer matches Job.to_json."""
+        job = add_job('Client', 'Description', 100.5, 'Tyler', 'Tyler',
+                      'Confirmed', False, '2018-03-01', '2018-03-02')
+        expected = job.to_json()
+        from_instance = json.loads(dumps(job_serializer.dump(job)).decode())
+        rows = job_serializer.query().all()
+        from_rows = json.loads(
+            dumps(job_serializer.dump_rows(rows)).decode())
+        self.assertEqual(from_instance, expected)
+        self.assertEqual(from_rows, [expected])
+
+    def test_recurring_expense_serializer_omits_end_date(self):
+        """Ensure that a missing endDate is left out, like in to_json."""
+        expense = add_recurring_expense(
+            'Merchant', 'Description', 50.0, True,
+            next(c.value for c in RecurringExpense.Category),
+            next(r.value for r in RecurringExpense.Recurrence),
+            next(p.value for p in RecurringExpense.PaidBy),
+            '2018-03-01')
+        data = recurring_expense_serializer.dump(expense)
+        self.assertNotIn('endDate', data)
+        self.assertEqual(json.loads(dumps(data).decode()), expense.to_json())
+
+    def test_dump_columns(self):
+        """Ensure that rows can be serialized column-wise."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01')
+        add_job('Client 2', 'Description 2', 200.5, 'Meghan', 'Meghan',
+                'Confirmed', True, '2018-03-05')
+        rows = job_serializer.query().order_by(Job.id).all()
+        with self.app.test_request_context('/?format=columns'):
+            data = job_serializer.dump_many(rows)
+        self.assertEqual(data['format'], 'columns')
+        self.assertEqual(data['length'], 2)
+        columns = json.loads(dumps(data['columns']).decode())
+        self.assertEqual(set(columns), set(job_serializer.keys))
+        self.assertEqual(columns['client'], ['Client 1', 'Client 2'])
+        self.assertEqual(columns['startDate'], ['2018-03-01', '2018-03-05'])
+        paid_to = columns['paidTo']
+        self.assertEqual(paid_to['dictionary'],
+                         [p.value for p in Job.PaidTo])
+        self.assertEqual([paid_to['dictionary'][c] for c in paid_to['codes']],
+                         ['Tyler', 'Meghan'])
+
+    def test_dump_columns_no_rows(self):
+        """Ensure that an empty collection still lists every column."""
+        data = job_serializer.dump_columns([])
+        self.assertEqual(data['length'], 0)
+        self.assertEqual(data['columns']['id'], [])
+        self.assertEqual(data['columns']['paidTo']['codes'], [])
+
+    def test_dump_many_defaults_to_rows(self):
+        """Ensure that rows are returned when no format is requested."""
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01')
+        rows = job_serializer.query().all()
+        with self.app.test_request_context('/'):
+            data = job_serializer.dump_many(rows)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['client'], 'Client 1')
+
+    def test_msgpack_round_trip(self):
+        """Ensure that dates, datetimes and enums survive MessagePack."""
+        data = {
+            'date': datetime.date(2018, 3, 1),
+            'before_epoch': datetime.date(1969, 12, 31),
+            'time': datetime.datetime(2018, 3, 1, 12, 30, 15, 250),
+            'paidTo': Job.PaidTo.TYLER,
+        }
+        decoded = unpackb(packb(data))
+        self.assertEqual(decoded['date'], datetime.date(2018, 3, 1))
+        self.assertEqual(decoded['before_epoch'], datetime.date(1969, 12, 31))
+        self.assertEqual(decoded['time'].replace(tzinfo=None), data['time'])
+        self.assertEqual(decoded['paidTo'], 'Tyler')
+
+    def test_api_response_msgpack(self):
+        """Ensure that api_response honours Accept: application/msgpack."""
+        headers = {'Accept': 'application/msgpack'}
+        with self.app.test_request_context('/', headers=headers):
+            response = api_response({'status': 'success'})
+        self.assertEqual(response.content_type, 'application/msgpack')
+        self.assertIn('Accept', response.headers['Vary'])
+        self.assertEqual(unpackb(response.data), {'status': 'success'})
+
+    def test_add_job_msgpack(self):
+        """Ensure that a job can be added and read back with MessagePack."""
+        add_user('testUser1', 'user1@email.com', 'somePassword')
+        with self.client:
+            resp_login = self.client.post(
+                '/admin/login',
+                data=packb({
+                    'username': 'testUser1',
+                    'password': 'somePassword'
+                }),
+                content_type='application/msgpack',
+                headers={'Accept': 'application/msgpack'}
+            )
+            self.assertEqual(resp_login.content_type, 'application/msgpack')
+            token = unpackb(resp_login.data)['auth_token']
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Accept': 'application/msgpack'
+            }
+            response = self.client.post(
+                '/admin/jobs',
+                data=packb({
+                    'client': 'Client',
+                    'description': 'Description',
+                    'amountPaid': 100.5,
+                    'paidTo': 'Tyler',
+                    'workedBy': 'Tyler',
+                    'confirmation': 'Confirmed',
+                    'hasPaid': False,
+                    'startDate': datetime.date(2018, 3, 1),
+                }),
+                content_type='application/msgpack',
+                headers=headers
+            )
+            self.assertEqual(response.status_code, 201)
+            job = unpackb(response.data)['job']
+            self.assertEqual(job['startDate'], datetime.date(2018, 3, 1))
+            self.assertEqual(job['endDate'], datetime.date(2018, 3, 1))
+
+            response = self.client.get(f'/admin/jobs/{job["id"]}',
+                                       headers=headers)
+            self.assertEqual(unpackb(response.data)['data'], job)
+
+    def test_invalid_msgpack_payload(self):
+        """Ensure that an undecodable MessagePack body is rejected."""
+        response = self.client.post(
+            '/admin/users',
+            data=b'\xc1',
+            content_type='application/msgpack'
+        )
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'Invalid payload.')
+
+
+if __name__ == '__main__':
+    unittest.main()
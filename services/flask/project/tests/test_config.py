@@ -76,6 +76,11 @@ class TestProductionConfig(TestCase):
         self.assertTrue(app.config['TOKEN_EXPIRE_SECONDS_LONG'] == 0)
         self.assertTrue(app.config['TOKEN_EXPIRE_DAYS_SHORT'] == 0)
         self.assertTrue(app.config['TOKEN_EXPIRE_SECONDS_SHORT'] == 600)
+        # /metrics isn't open to anyone
+        if not custom_config_file_exists(app):
+            self.assertEqual('METRICS_TOKEN' in os.environ,
+                             app.config['METRICS_ENABLED'])
+            self.assertFalse(app.config['PROFILING_ENABLED'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,118 @@
+# services/flask/project/tests/test_instrumentation.py
+
+import json
+import unittest
+
+from flask import g
+from sqlalchemy import exc, text
+
+from project import db, query_instrumentation
+from project.instrumentation import request_stats
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_job, add_user
+
+
+class TestQueryInstrumentation(BaseTestCase):
+    """Tests for the per-request SQL instrumentation."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def server_timing(self, response):
+        """The Server-Timing metrics of a response, by name"""
+        metrics = {}
+        for header in response.headers.getlist('Server-Timing'):
+            name, *params = header.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing(self):
+        for i in range(3):
+            add_job(f'Client {i}', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                    'Confirmed', False, '2018-03-01', '2018-03-02')
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        metrics = self.server_timing(response)
+        self.assertEqual({'db', 'total'}, set(metrics))
+        # the user of the token, and the jobs
+        # the app context, and with it g, outlives the request in the tests
+        stats = g.query_stats
+        self.assertEqual(f'"{stats.queries} queries, {stats.rows} rows"',
+                         metrics['db']['desc'])
+        self.assertTrue(any('FROM jobs' in statement
+                            for statement in stats.statements))
+        self.assertGreaterEqual(stats.rows, 3)
+        self.assertLessEqual(float(metrics['db']['dur']),
+                             float(metrics['total']['dur']))
+
+    def test_server_timing_disabled(self):
+        self.app.config['SERVER_TIMING_ENABLED'] = False
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_instrumentation_disabled(self):
+        self.app.config['SQL_INSTRUMENTATION_ENABLED'] = False
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertNotIn('Server-Timing', response.headers)
+        with self.app.test_request_context():
+            query_instrumentation._start()
+            db.session.execute('SELECT 1')
+            self.assertIsNone(request_stats())
+
+    def test_slow_statement(self):
+        self.app.config['SQL_SLOW_QUERY_TIME'] = 0
+        with self.assertLogs('project.instrumentation', 'WARNING') as logs:
+            self.client.get('/admin/jobs/1', headers=self.headers)
+        self.assertIn('Slow statement', logs.output[0])
+        self.assertIn('GET /admin/jobs/1', logs.output[0])
+        # the id of the user in the token
+        self.assertIn("'param_1': 1", logs.output[0])
+
+    def test_repeated_statements(self):
+        self.app.config['SQL_REPEATED_QUERY_THRESHOLD'] = 3
+        with self.app.test_request_context('/admin/jobs'):
+            query_instrumentation._start()
+            with self.assertLogs('project.instrumentation', 'WARNING') as logs:
+                for i in range(5):
+                    db.session.execute(text('SELECT :i'), {'i': i})
+                db.session.execute('SELECT 1')
+            stats = request_stats()
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('Likely N+1 query: GET /admin/jobs has run this '
+                      'statement 3 times', logs.output[0])
+        self.assertEqual(6, stats.queries)
+        self.assertEqual(6, stats.rows)
+
+    def test_failed_statement(self):
+        with self.app.test_request_context():
+            query_instrumentation._start()
+            with self.assertRaises(exc.ProgrammingError):
+                db.session.execute('SELECT * FROM no_such_table')
+            db.session.rollback()
+            db.session.execute('SELECT 1')
+            statements = request_stats().statements
+            self.assertNotIn('SELECT * FROM no_such_table', statements)
+            self.assertEqual(1, statements['SELECT 1'])
+            connection = db.session.connection()
+            self.assertEqual([], connection.info['query_start'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# services/flask/project/tests/test_invalidation.py
+
+import json
+import queue
+import unittest
+
+from project import db, invalidation_bus, row_cache
+from project.admin.models import Job
+from project.admin.serializers import job_serializer
+from project.invalidation import InvalidationBus, MAX_PAYLOAD_SIZE
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_job
+
+
+class TestInvalidationBus(BaseTestCase):
+    """Tests for the cache invalidation bus."""
+
+    def test_publish_applies_locally(self):
+        bus = InvalidationBus()
+        received = []
+        bus.subscribe('test', received.append)
+        bus.publish({'n': 'test', 'k': ['a']})
+        bus.publish({'n': 'other', 'k': ['b']})
+        self.assertEqual([{'n': 'test', 'k': ['a']}], received)
+
+    def test_handle_skips_own_messages(self):
+        bus = InvalidationBus()
+        received = []
+        bus.subscribe('test', received.append)
+        bus.handle(bus.encode({'n': 'test', 'k': ['a']}))
+        bus.handle(json.dumps({'n': 'test', 'k': ['b'], 'w': 'someone'}))
+        bus.handle('not json')
+        self.assertEqual([{'n': 'test', 'k': ['b']}], received)
+
+    def test_big_messages_clear(self):
+        bus = InvalidationBus()
+        keys = [f'jobs:{i}' for i in range(MAX_PAYLOAD_SIZE)]
+        message = json.loads(bus.encode({'n': 'rows', 'k': keys}))
+        self.assertEqual({'n': 'rows', 'clear': True, 'w': bus.sender},
+                         message)
+
+    def test_listener_receives_notifications(self):
+        """Ensure that a message published here reaches another process."""
+        self.app.config['CACHE_INVALIDATION_ENABLED'] = True
+        other = InvalidationBus()
+        received = queue.Queue()
+        other.subscribe('test', received.put)
+        listener = other.start_listener(self.app)
+        listener.POLL_INTERVAL = 0.05
+        try:
+            self.assertTrue(listener.listening.wait(5))
+            invalidation_bus.publish({'n': 'test', 'k': ['jobs:1']})
+            self.assertEqual({'n': 'test', 'k': ['jobs:1']},
+                             received.get(timeout=5))
+        finally:
+            other.stop_listener()
+        self.assertFalse(listener.is_alive())
+
+    def test_listener_direct_uri(self):
+        """Ensure that the listener can connect around PgBouncer."""
+        self.app.config['CACHE_INVALIDATION_ENABLED'] = True
+        self.app.config['SQLALCHEMY_DIRECT_URI'] = \
+            self.app.config['SQLALCHEMY_DATABASE_URI']
+        other = InvalidationBus()
+        received = queue.Queue()
+        other.subscribe('test', received.put)
+        listener = other.start_listener(self.app)
+        listener.POLL_INTERVAL = 0.05
+        try:
+            self.assertTrue(listener.listening.wait(5))
+            invalidation_bus.publish({'n': 'test', 'k': ['jobs:1']})
+            self.assertEqual({'n': 'test', 'k': ['jobs:1']},
+                             received.get(timeout=5))
+        finally:
+            other.stop_listener()
+
+    def test_listener_disabled(self):
+        self.assertIsNone(InvalidationBus().start_listener(self.app))
+
+    def test_row_cache_invalidated_by_other_process(self):
+        """Ensure that a message from another process drops a cached row."""
+        self.app.config['ROW_CACHE_ENABLED'] = True
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        self.assertEqual('Client 1',
+                         row_cache.get(job_serializer, 1)['client'])
+        job = Job.query.get(1)
+        job.client = 'Client 2'
+        db.session.commit()
+        self.assertEqual('Client 1',
+                         row_cache.get(job_serializer, 1)['client'])
+        invalidation_bus.handle(json.dumps({'n': 'rows', 'k': ['jobs:1'],
+                                            'w': 'another process'}))
+        self.assertEqual('Client 2',
+                         row_cache.get(job_serializer, 1)['client'])
+
+
+if __name__ == '__main__':
+    unittest.main()
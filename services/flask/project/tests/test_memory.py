@@ -0,0 +1,146 @@
+# services/flask/project/tests/test_memory.py
+
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from project import memory_monitor
+from project.memory import rss, snapshot_paths, snapshot_pids
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestMemory(BaseTestCase):
+    """Tests for the memory diagnostics and the recycling of processes."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.app.config['MEMORY_SNAPSHOT_DIR'] = self.directory
+        self.recycled = 0
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        memory_monitor.watch(None)
+        if memory_monitor.tracing():
+            memory_monitor.stop_tracing()
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def recycle(self):
+        self.recycled += 1
+
+    def get_jobs(self):
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+
+    def test_rss(self):
+        self.assertGreater(rss(), 1024 * 1024)
+
+    def test_rss_limit_jitter(self):
+        self.app.config['MEMORY_RSS_LIMIT'] = 100
+        self.app.config['MEMORY_RSS_JITTER'] = 0.1
+        limit = memory_monitor.rss_limit(self.app)
+        self.assertLessEqual(limit, 100 * 1024 * 1024)
+        self.assertGreaterEqual(limit, 90 * 1024 * 1024)
+        # the same for the life of the process
+        self.assertEqual(limit, memory_monitor.rss_limit(self.app))
+        self.app.config['MEMORY_RSS_LIMIT'] = None
+        self.assertIsNone(memory_monitor.rss_limit(self.app))
+
+    def test_recycles_above_watermark(self):
+        self.app.config['MEMORY_RSS_LIMIT'] = 1
+        memory_monitor.watch(self.recycle)
+        self.get_jobs()
+        self.get_jobs()
+        # only once, while the process finishes its requests
+        self.assertEqual(1, self.recycled)
+
+    def test_no_recycling_below_watermark(self):
+        self.app.config['MEMORY_RSS_LIMIT'] = 1024 * 1024
+        memory_monitor.watch(self.recycle)
+        self.get_jobs()
+        self.assertEqual(0, self.recycled)
+
+    def test_tracing(self):
+        self.app.config['MEMORY_TRACING_ENABLED'] = True
+        self.get_jobs()
+        self.get_jobs()
+        response = self.client.post('/admin/memory/snapshot',
+                                    headers=self.headers)
+        data = json.loads(response.data.decode())['data']
+        # the first snapshot is the baseline
+        self.assertIsNone(data['topGrowers'])
+        self.get_jobs()
+        response = self.client.post('/admin/memory/snapshot',
+                                    headers=self.headers)
+        growers = json.loads(response.data.decode())['data']['topGrowers']
+        self.assertTrue(growers)
+        self.assertEqual({'file', 'line', 'size', 'sizeDiff', 'count',
+                          'countDiff'}, set(growers[0]))
+        self.assertEqual([os.getpid()], snapshot_pids(self.directory))
+
+        response = self.client.get('/admin/memory', headers=self.headers)
+        data = json.loads(response.data.decode())['data']
+        self.assertTrue(data['tracing'])
+        self.assertEqual(os.getpid(), data['pid'])
+        self.assertTrue(data['topGrowers'])
+        routes = {route['route']: route for route in data['routes']}
+        self.assertEqual(3, routes['/admin/jobs']['requests'])
+
+    def test_tracing_started_before(self):
+        """Ensure that tracing that was already on is snapshotted too."""
+        memory_monitor._next_snapshot = None
+        tracemalloc.start()
+        self.app.config['MEMORY_TRACING_ENABLED'] = True
+        self.app.config['MEMORY_SNAPSHOT_INTERVAL'] = 0
+        self.get_jobs()
+        self.assertEqual([os.getpid()], snapshot_pids(self.directory))
+
+    def test_snapshot_without_tracing(self):
+        response = self.client.post('/admin/memory/snapshot',
+                                    headers=self.headers)
+        self.assertEqual(404, response.status_code)
+        response = self.client.get('/admin/memory', headers=self.headers)
+        data = json.loads(response.data.decode())['data']
+        self.assertFalse(data['tracing'])
+        self.assertIsNone(data['topGrowers'])
+        self.assertGreater(data['rss'], 0)
+
+    def test_keeps_snapshots_of_latest_processes(self):
+        self.app.config['MEMORY_TRACING_ENABLED'] = True
+        self.app.config['MEMORY_MAX_SNAPSHOT_PROCESSES'] = 2
+        for pid in (1, 2):
+            for path in snapshot_paths(self.directory, pid):
+                open(path, 'w').close()
+                os.utime(path, (pid, pid))
+        self.get_jobs()
+        memory_monitor.snapshot(self.app)
+        self.assertEqual([os.getpid(), 2], snapshot_pids(self.directory))
+
+    def test_requires_login(self):
+        response = self.client.get('/admin/memory')
+        self.assertEqual(401, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# services/flask/project/tests/test_metrics.py
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from project import create_app, metrics
+from project.metrics import (Metrics, Registry, mark_process_dead, merge,
+                             read_json, render, write_json)
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+def parse(text):
+    """The samples of the Prometheus text format, by name and labels"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            sample, value = line.rsplit(' ', 1)
+            samples[sample] = float(value)
+    return samples
+
+
+class TestMetrics(BaseTestCase):
+    """Tests for the /metrics endpoint."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        add_user(**self.VALID_USER_DICT1)
+        self.directory = None
+
+    def tearDown(self):
+        super().tearDown()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+    def login(self):
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        return {'Authorization': f'Bearer {token}'}
+
+    def scrape(self, headers=None):
+        response = self.client.get('/metrics', headers=headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8',
+                         response.headers['Content-Type'])
+        return parse(response.data.decode())
+
+    def use_directory(self):
+        self.directory = tempfile.mkdtemp()
+        self.app.config['METRICS_DIR'] = self.directory
+
+    def test_requests(self):
+        headers = self.login()
+        ok = 'http_requests_total{method="GET",route="/admin/jobs",' \
+             'status="200"}'
+        not_found = 'http_requests_total{method="GET",' \
+                    'route="/admin/jobs/<job_id>",status="404"}'
+        count = 'http_request_duration_seconds_count{method="GET",' \
+                'route="/admin/jobs"}'
+        statements = 'db_statements_total{route="/admin/jobs"}'
+        before = self.scrape()
+        for _ in range(2):
+            self.client.get('/admin/jobs', headers=headers)
+        self.client.get('/admin/jobs/99', headers=headers)
+        after = self.scrape()
+        self.assertEqual(2, after[ok] - before.get(ok, 0))
+        self.assertEqual(1, after[not_found] - before.get(not_found, 0))
+        self.assertEqual(2, after[count] - before.get(count, 0))
+        self.assertEqual(after[count], after[
+            'http_request_duration_seconds_bucket{method="GET",'
+            'route="/admin/jobs",le="+Inf"}'])
+        self.assertGreaterEqual(after[statements] -
+                                before.get(statements, 0), 2)
+
+    def test_gauges(self):
+        self.login()
+        samples = self.scrape()
+        self.assertEqual(self.app.config['SQLALCHEMY_POOL_SIZE'],
+                         samples['db_pool_size{database="primary"}'])
+        self.assertGreater(samples['db_pool_checkouts_total'
+                                   '{database="primary"}'], 0)
+        self.assertIn('cache_hits_total{namespace="rows"}', samples)
+        self.assertEqual(0, samples['bcrypt_in_progress'])
+        self.assertGreater(samples['bcrypt_duration_seconds_count'], 0)
+
+    def test_disabled(self):
+        self.app.config['METRICS_ENABLED'] = False
+        response = self.client.get('/metrics')
+        self.assertEqual(404, response.status_code)
+
+    def test_token(self):
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        response = self.client.get('/metrics')
+        self.assertEqual(401, response.status_code)
+        response = self.client.get('/metrics',
+                                   headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(401, response.status_code)
+        self.scrape(headers={'Authorization': 'Bearer secret'})
+
+    def test_unhandled_exception(self):
+        app = create_app()
+
+        @app.route('/boom')
+        def boom():
+            raise RuntimeError('boom')
+
+        app.config['PROPAGATE_EXCEPTIONS'] = False
+        app.config['PRESERVE_CONTEXT_ON_EXCEPTION'] = False
+        self.assertEqual(500, app.test_client().get('/boom').status_code)
+        samples = merge([metrics.registry.snapshot()])['counters']
+        self.assertEqual(1, samples[('http_requests_total', (
+            ('method', 'GET'), ('route', '/boom'), ('status', '500')))])
+
+    def test_processes_are_added_up(self):
+        self.use_directory()
+        other = Metrics()
+        other.registry.inc('http_requests_total', {
+            'route': '/other', 'method': 'GET', 'status': '200'}, 3)
+        snapshot = other.registry.snapshot()
+        snapshot['gauges'].append(['bcrypt_in_progress', [], 2])
+        write_json(os.path.join(self.directory, '12345-abcdef12.json'),
+                   snapshot)
+        other_requests = 'http_requests_total{method="GET",' \
+                         'route="/other",status="200"}'
+        samples = self.scrape()
+        self.assertEqual(3, samples[other_requests])
+        self.assertEqual(2, samples['bcrypt_in_progress'])
+        # this process's own file is up to date
+        self.assertEqual(2, len(os.listdir(self.directory)))
+
+        mark_process_dead(self.directory, 12345)
+        mark_process_dead(self.directory, 12345)
+        samples = self.scrape()
+        self.assertEqual(3, samples[other_requests])
+        self.assertEqual(0, samples['bcrypt_in_progress'])
+        dead = read_json(os.path.join(self.directory, 'dead.json'))
+        self.assertEqual(['12345-abcdef12.json'], dead['files'])
+
+        # a file that was read just before it was folded in isn't counted
+        # twice
+        write_json(os.path.join(self.directory, '12345-abcdef12.json'),
+                   snapshot)
+        self.assertEqual(3, self.scrape()[other_requests])
+
+    def test_flusher(self):
+        self.use_directory()
+        self.app.config['METRICS_FLUSH_INTERVAL'] = 0.01
+        flusher = Metrics().start_flusher(self.app)
+        try:
+            flusher._stopped.wait(0.2)
+        finally:
+            flusher.stop()
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+    def test_render(self):
+        registry = Registry()
+        for value in (0.005, 0.02, 100):
+            registry.observe('http_request_duration_seconds',
+                             {'route': '/a"b', 'method': 'GET'}, value)
+        samples = parse(render(merge([registry.snapshot()])))
+        labels = 'method="GET",route="/a\\"b"'
+        self.assertEqual(1, samples['http_request_duration_seconds_bucket{'
+                                    f'{labels},le="0.005"}}'])
+        self.assertEqual(2, samples['http_request_duration_seconds_bucket{'
+                                    f'{labels},le="0.025"}}'])
+        self.assertEqual(3, samples['http_request_duration_seconds_bucket{'
+                                    f'{labels},le="+Inf"}}'])
+        self.assertEqual(3, samples['http_request_duration_seconds_count{'
+                                    f'{labels}}}'])
+        self.assertAlmostEqual(100.025, samples[
+            f'http_request_duration_seconds_sum{{{labels}}}'])
+
+
+if __name__ == '__main__':
+    unittest.main()
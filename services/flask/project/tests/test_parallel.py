@@ -0,0 +1,36 @@
+# services/flask/project/tests/test_parallel.py
+
+import unittest
+
+from project.tests.parallel import shard, find_test_modules, WorkerDatabases
+
+
+class TestParallelRunner(unittest.TestCase):
+    """Tests for the parallel test runner's helpers."""
+
+    def test_shard_balances_modules(self):
+        modules = {'a': 10, 'b': 7, 'c': 5, 'd': 4, 'e': 1}
+        shards = shard(modules, 2)
+        self.assertEqual([['a', 'd'], ['b', 'c', 'e']], shards)
+        self.assertEqual(sorted(modules), sorted(sum(shards, [])))
+
+    def test_shard_more_workers_than_modules(self):
+        self.assertEqual([['a'], ['b']], shard({'a': 2, 'b': 1}, 4))
+
+    def test_find_test_modules(self):
+        modules = find_test_modules()
+        self.assertIn('project.tests.test_parallel', modules)
+        self.assertNotIn('project.tests.base', modules)
+        self.assertNotIn('project.tests.parallel', modules)
+
+    def test_worker_database_names(self):
+        databases = WorkerDatabases('postgresql://postgres@db:5432/test_db', 2)
+        self.assertEqual('test_db_template', databases.template)
+        self.assertEqual(['test_db_0', 'test_db_1'], databases.names)
+        self.assertEqual('postgresql://postgres@db:5432/test_db_1',
+                         databases.url_for('test_db_1'))
+        databases.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
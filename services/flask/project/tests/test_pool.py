@@ -0,0 +1,120 @@
+# services/flask/project/tests/test_pool.py
+
+import json
+import unittest
+
+from sqlalchemy import create_engine, exc
+
+from project import db
+from project.pool import TimedQueuePool, engine_options, pool_stats, prewarm
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestPool(BaseTestCase):
+    """Tests for the settings and telemetry of the connection pools."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def create_engine(self, **config):
+        options = engine_options(dict(self.app.config, **config))
+        return create_engine(self.app.config['SQLALCHEMY_DATABASE_URI'],
+                             **options)
+
+    def test_app_engine(self):
+        pool = db.engine.pool
+        self.assertIsInstance(pool, TimedQueuePool)
+        self.assertEqual(self.app.config['SQLALCHEMY_POOL_SIZE'],
+                         pool.size())
+        self.assertEqual(self.app.config['SQLALCHEMY_POOL_RECYCLE'],
+                         pool._recycle)
+        self.assertTrue(pool._pre_ping)
+
+    def test_statement_timeout(self):
+        engine = self.create_engine(SQLALCHEMY_STATEMENT_TIMEOUT=0.05)
+        try:
+            with engine.connect() as connection:
+                self.assertEqual('50ms', connection.execute(
+                    'SHOW statement_timeout').scalar())
+                with self.assertRaises(exc.OperationalError):
+                    connection.execute('SELECT pg_sleep(1)')
+        finally:
+            engine.dispose()
+
+    def test_pgbouncer_statement_timeout(self):
+        """Ensure that the timeout is set for each transaction through
+        PgBouncer."""
+        self.app.config['SQLALCHEMY_STATEMENT_TIMEOUT'] = 0.05
+        self.app.config['SQLALCHEMY_PGBOUNCER'] = True
+        self.assertNotIn('connect_args', engine_options(self.app.config))
+        session = db.create_session({})()
+        try:
+            self.assertEqual('50ms', session.execute(
+                'SHOW statement_timeout').scalar())
+            with self.assertRaises(exc.OperationalError):
+                session.execute('SELECT pg_sleep(1)')
+            session.rollback()
+            self.app.config['SQLALCHEMY_PGBOUNCER'] = False
+            self.assertEqual('0', session.execute(
+                'SHOW statement_timeout').scalar())
+        finally:
+            session.close()
+
+    def test_checkouts_are_counted(self):
+        engine = self.create_engine(SQLALCHEMY_POOL_SIZE=1,
+                                    SQLALCHEMY_MAX_OVERFLOW=0,
+                                    SQLALCHEMY_POOL_TIMEOUT=0.05)
+        try:
+            connection = engine.connect()
+            stats = pool_stats(engine)
+            self.assertEqual(1, stats['checkouts'])
+            self.assertEqual(1, stats['checkedOut'])
+            self.assertGreater(stats['waitTime'], 0)
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+            connection.close()
+            stats = pool_stats(engine)
+            self.assertEqual(1, stats['timeouts'])
+            self.assertGreaterEqual(stats['maxWaitTime'], stats['waitTime'])
+            self.assertEqual({'size': 1, 'open': 1, 'checkedOut': 0,
+                              'overflow': 0},
+                             {key: stats[key] for key in
+                              ('size', 'open', 'checkedOut', 'overflow')})
+        finally:
+            engine.dispose()
+
+    def test_prewarm(self):
+        self.assertEqual(0, prewarm(self.app))
+        self.app.config['SQLALCHEMY_POOL_PREWARM'] = 2
+        self.assertEqual(2, prewarm(self.app))
+        self.assertGreaterEqual(pool_stats(db.engine)['open'], 2)
+        self.app.config['SQLALCHEMY_POOL_PREWARM'] = 1000
+        self.assertEqual(db.engine.pool.size(), prewarm(self.app))
+
+    def test_stats(self):
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        response = self.client.get(
+            '/admin/cache/stats',
+            headers={'Authorization': f'Bearer {token}'})
+        data = json.loads(response.data.decode())['data']['connectionPool']
+        self.assertEqual(self.app.config['SQLALCHEMY_POOL_SIZE'],
+                         data['size'])
+        self.assertGreater(data['checkouts'], 0)
+        self.assertGreaterEqual(data['checkedOut'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# services/flask/project/tests/test_profiling.py
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from project.profiling import Sampler
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+def busy_for(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+class TestProfiling(BaseTestCase):
+    """Tests for the request profiler."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.app.config['PROFILING_DIR'] = self.directory
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def get_jobs(self, profile=True, headers=None):
+        headers = dict(self.headers if headers is None else headers)
+        if profile:
+            headers['X-Profile'] = '1'
+        response = self.client.get('/admin/jobs', headers=headers)
+        self.assertEqual(200, response.status_code)
+        return response
+
+    def test_requested_profile(self):
+        response = self.get_jobs()
+        name = response.headers['X-Profile-Id']
+        self.assertIn('-GET-admin-jobs-', name)
+        response = self.client.get('/admin/profiles', headers=self.headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual([name], data['data']['profiles'])
+        response = self.client.get(f'/admin/profiles/{name}',
+                                   headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/plain', response.mimetype)
+
+    def test_not_requested(self):
+        response = self.get_jobs(profile=False)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_requires_valid_token(self):
+        self.client.get('/admin/jobs', headers={'X-Profile': '1'})
+        self.client.get('/admin/jobs', headers={
+            'X-Profile': '1', 'Authorization': 'Bearer invalid'})
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_disabled(self):
+        self.app.config['PROFILING_ENABLED'] = False
+        response = self.get_jobs()
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_sampled_requests(self):
+        self.app.config['PROFILING_SAMPLE_RATE'] = 1.0
+        response = self.get_jobs(profile=False)
+        # stored, but the client isn't told
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+    def test_max_concurrent(self):
+        self.app.config['PROFILING_MAX_CONCURRENT'] = 0
+        response = self.get_jobs()
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_oldest_profiles_are_deleted(self):
+        self.app.config['PROFILING_MAX_FILES'] = 2
+        names = [self.get_jobs().headers['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        self.assertIn(names[-1], os.listdir(self.directory))
+
+    def test_invalid_names(self):
+        for name in ('..%2Fconfig.folded', 'missing.folded', 'a.txt'):
+            response = self.client.get(f'/admin/profiles/{name}',
+                                       headers=self.headers)
+            self.assertEqual(404, response.status_code, name)
+
+    def test_requires_login(self):
+        response = self.client.get('/admin/profiles')
+        self.assertEqual(401, response.status_code)
+
+    def test_sampler(self):
+        sampler = Sampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_for(0.1)
+        sampler.stop()
+        lines = sampler.folded().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        frames = stack.split(';')
+        # the path depends on sys.path, which differs between the runners
+        self.assertRegex(frames[-1],
+                         r'^busy_for \((.+/)?test_profiling\.py:\d+\)$')
+        self.assertTrue(frames[-2].startswith('test_sampler '))
+
+
+if __name__ == '__main__':
+    unittest.main()
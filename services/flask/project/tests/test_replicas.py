@@ -0,0 +1,184 @@
+# services/flask/project/tests/test_replicas.py
+
+import json
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from project import create_app, db, replicas
+from project.admin.models import Job
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+# Stands in for a replica in these tests.  It's a separate database, not a
+# real replica, so the tests can tell which one a query went to.
+replica_url = None
+
+
+def create_replica(primary_url):
+    global replica_url
+    if replica_url is None:
+        url = make_url(primary_url)
+        database = f'{url.database}_replica'
+        url.database = 'postgres'
+        admin = create_engine(url, isolation_level='AUTOCOMMIT')
+        with admin.connect() as connection:
+            exists = connection.execute(
+                'SELECT 1 FROM pg_database WHERE datname = %s',
+                (database,)).scalar()
+            if not exists:
+                connection.execute(f'CREATE DATABASE "{database}"')
+        admin.dispose()
+        url.database = database
+        engine = create_engine(url)
+        db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+        engine.dispose()
+        replica_url = str(url)
+    return replica_url
+
+
+def tearDownModule():
+    # The parallel runner only drops the databases of its workers
+    global replica_url
+    if replica_url is not None:
+        url = make_url(replica_url)
+        database = url.database
+        url.database = 'postgres'
+        admin = create_engine(url, isolation_level='AUTOCOMMIT')
+        with admin.connect() as connection:
+            connection.execute(f'DROP DATABASE IF EXISTS "{database}"')
+        admin.dispose()
+        replica_url = None
+
+
+class TestReplicas(BaseTestCase):
+    """Tests for the routing of reads to the read replicas."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    VALID_JOB_DICT1 = {
+        'client': 'Client 1',
+        'description': 'Description 1',
+        'amountPaid': 100.5,
+        'paidTo': 'Tyler',
+        'workedBy': 'Tyler',
+        'confirmation': 'Confirmed',
+        'hasPaid': False,
+        'startDate': '2018-03-01',
+        'endDate': '2018-03-02',
+    }
+
+    def setUp(self):
+        super().setUp()
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        token = json.loads(resp_login.data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+        url = create_replica(self.app.config['SQLALCHEMY_DATABASE_URI'])
+        self.replica = create_engine(url)
+        self.replica.execute(
+            Job.__table__.insert(),
+            client='Replica client', description='Description',
+            amount_paid=1.0, paid_to='TYLER', worked_by='TYLER',
+            confirmation='CONFIRMED', has_paid=False,
+            start_date='2018-03-01', end_date='2018-03-01')
+        self.app.config['SQLALCHEMY_REPLICA_URIS'] = [url]
+        # the writes above would send the reads to the primary
+        replicas._primary_until = 0.0
+
+    def tearDown(self):
+        # ends the session's transaction on the replica too
+        super().tearDown()
+        self.replica.execute('TRUNCATE jobs RESTART IDENTITY')
+        self.replica.dispose()
+        # forget what the checks found
+        for replica in replicas.replicas(self.app):
+            replica.engine.dispose()
+        del self.app.extensions['replica_engines']
+        self.app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        replicas._primary_until = 0.0
+
+    def get_jobs(self):
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data.decode())
+        return [job['client'] for job in data['data']['jobs']]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(['Replica client'], self.get_jobs())
+        response = self.client.get('/admin/jobs/1', headers=self.headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual('Replica client', data['data']['client'])
+
+    def test_other_routes_use_the_primary(self):
+        response = self.client.get('/admin/changes?since=0',
+                                   headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, Job.query.count())
+
+    def test_reads_after_writes_go_to_the_primary(self):
+        response = self.client.post(
+            '/admin/jobs',
+            data=json.dumps(self.VALID_JOB_DICT1),
+            content_type='application/json',
+            headers=self.headers
+        )
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(['Client 1'], [job.client for job in Job.query])
+        self.assertEqual(['Client 1'], self.get_jobs())
+        replicas._primary_until = 0.0
+        self.assertEqual(['Replica client'], self.get_jobs())
+
+    def test_lagging_replica(self):
+        self.app.config['REPLICA_MAX_LAG'] = -1
+        self.assertEqual([], self.get_jobs())
+        stats = replicas.stats(self.app)['replicas'][0]
+        self.assertFalse(stats['healthy'])
+        self.assertEqual(0, stats['lag'])
+
+    def test_unreachable_replica(self):
+        self.app.config['SQLALCHEMY_REPLICA_URIS'] = [
+            'postgresql://postgres@localhost:1/replica']
+        self.assertEqual([], self.get_jobs())
+        self.assertFalse(replicas.stats(self.app)['replicas'][0]['healthy'])
+
+    def test_replicas_are_checked_again(self):
+        self.app.config['REPLICA_MAX_LAG'] = -1
+        self.assertEqual([], self.get_jobs())
+        self.app.config['REPLICA_MAX_LAG'] = 5.0
+        # not due for a check yet
+        self.assertEqual([], self.get_jobs())
+        self.app.config['REPLICA_CHECK_INTERVAL'] = 0
+        self.assertEqual(['Replica client'], self.get_jobs())
+
+    def test_stats(self):
+        self.get_jobs()
+        response = self.client.get('/admin/cache/stats', headers=self.headers)
+        data = json.loads(response.data.decode())['data']['readReplicas']
+        self.assertFalse(data['primaryOnly'])
+        self.assertEqual([True], [replica['healthy']
+                                  for replica in data['replicas']])
+
+    def test_create_app(self):
+        app = create_app(replica_uris=['postgresql://replica/db'])
+        self.assertEqual(['postgresql://replica/db'],
+                         app.config['SQLALCHEMY_REPLICA_URIS'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# services/flask/project/tests/test_shedding.py
+
+import json
+import threading
+import unittest
+
+from project import load_shedder
+from project.shedding import Limiter
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestLimiter(unittest.TestCase):
+    """Tests for the limits of one class of routes."""
+
+    def test_concurrency(self):
+        limiter = Limiter(2, 0)
+        self.assertTrue(limiter.acquire(0))
+        self.assertTrue(limiter.acquire(0))
+        self.assertFalse(limiter.acquire(0))
+        self.assertEqual(1, limiter.rejected)
+        limiter.release()
+        self.assertTrue(limiter.acquire(0))
+        self.assertEqual(2, limiter.in_progress)
+
+    def test_waiting_request_gets_a_turn(self):
+        limiter = Limiter(1, 1)
+        limiter.acquire(0)
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(limiter.acquire(5)))
+        waiter.start()
+        while not limiter.waiting:
+            pass
+        # the queue is full
+        self.assertFalse(limiter.acquire(5))
+        limiter.release()
+        waiter.join()
+        self.assertEqual([True], results)
+        self.assertEqual(1, limiter.in_progress)
+        self.assertEqual(0, limiter.waiting)
+
+    def test_waiting_times_out(self):
+        limiter = Limiter(1, 1)
+        limiter.acquire(0)
+        self.assertFalse(limiter.acquire(0.01))
+        self.assertEqual(0, limiter.waiting)
+        self.assertEqual(1, limiter.rejected)
+
+
+class TestLoadShedding(BaseTestCase):
+    """Tests for the load shedding of requests."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['LOAD_SHEDDING_ENABLED'] = True
+        self.app.config['LOAD_SHEDDING_LIMITS'] = {}
+        add_user(**self.VALID_USER_DICT1)
+        token = json.loads(self.login().data.decode())['auth_token']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def login(self):
+        return self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+
+    def classify(self, method, path):
+        with self.app.test_request_context(path, method=method):
+            return load_shedder.classify()
+
+    def test_classes(self):
+        self.assertEqual('auth', self.classify('POST', '/admin/login'))
+        self.assertEqual('auth', self.classify('POST', '/admin/register'))
+        self.assertEqual('read', self.classify('GET', '/admin/events'))
+        self.assertEqual('write', self.classify('POST', '/admin/jobs'))
+        self.assertEqual('write', self.classify('DELETE', '/admin/jobs/1'))
+        self.assertEqual('export',
+                         self.classify('GET', '/admin/export/jobs.csv'))
+        self.assertEqual('export',
+                         self.classify('POST', '/admin/import/jobs.csv'))
+        self.assertIsNone(self.classify('GET', '/admin/stream'))
+        self.assertIsNone(self.classify('GET', '/admin/ping'))
+        self.assertIsNone(self.classify('GET', '/metrics'))
+        self.assertIsNone(self.classify('GET', '/nowhere'))
+
+    def test_saturated_class_is_shed(self):
+        self.app.config['LOAD_SHEDDING_LIMITS'] = {'read': (0, 0)}
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(503, response.status_code)
+        self.assertIn(int(response.headers['Retry-After']), range(5, 11))
+        data = json.loads(response.data.decode())
+        self.assertEqual('fail', data['status'])
+        # the other classes are still served
+        self.assertEqual(200, self.login().status_code)
+        self.assertEqual(200, self.client.get('/admin/ping').status_code)
+        limiter = load_shedder.limiters(self.app)['read']
+        self.assertEqual(1, limiter.rejected)
+
+    def test_turn_is_released(self):
+        self.app.config['LOAD_SHEDDING_LIMITS'] = {'read': (1, 0)}
+        for _ in range(3):
+            response = self.client.get('/admin/jobs', headers=self.headers)
+            self.assertEqual(200, response.status_code)
+        self.assertEqual(0, load_shedder.limiters(self.app)['read']
+                         .in_progress)
+
+    def test_disabled(self):
+        self.app.config['LOAD_SHEDDING_ENABLED'] = False
+        self.app.config['LOAD_SHEDDING_LIMITS'] = {'read': (0, 0)}
+        response = self.client.get('/admin/jobs', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# services/flask/project/tests/test_singleflight.py
+
+import threading
+import time
+import unittest
+
+from project import db
+from project.singleflight import SingleFlight, visible_transactions
+from project.tests.base import BaseTestCase
+
+
+class TestSingleFlight(BaseTestCase):
+    """Tests for the coalescing of identical reads."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['SINGLE_FLIGHT_ENABLED'] = True
+        self.flight = SingleFlight()
+        self.calls = 0
+
+    def slow_read(self, release, result='result'):
+        def read():
+            self.calls += 1
+            release.wait(5)
+            return result
+        return read
+
+    def in_threads(self, count, function):
+        """Call function in count threads and return their results"""
+        results = [None] * count
+
+        def run(i):
+            with self.app.app_context():
+                try:
+                    results[i] = function()
+                except Exception as e:
+                    results[i] = e
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_followers(self, count):
+        for _ in range(500):
+            if self.flight.followers >= count:
+                return
+            time.sleep(0.01)
+        self.fail('The followers never arrived')
+
+    def test_disabled(self):
+        self.app.config['SINGLE_FLIGHT_ENABLED'] = False
+        release = threading.Event()
+        release.set()
+        self.flight.do('key', self.slow_read(release))
+        self.flight.do('key', self.slow_read(release))
+        self.assertEqual(2, self.calls)
+        self.assertEqual(0, self.flight.stats()['leaders'])
+
+    def test_followers_share_the_result(self):
+        release = threading.Event()
+        read = self.slow_read(release, ['rows'])
+        threads, results = self.in_threads(
+            5, lambda: self.flight.do('key', read))
+        self.wait_for_followers(4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.calls)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual({'leaders': 1, 'followers': 4, 'fallbacks': 0,
+                          'inFlight': 0}, self.flight.stats())
+
+    def test_different_keys_are_not_coalesced(self):
+        release = threading.Event()
+        release.set()
+        self.flight.do('a', self.slow_read(release))
+        self.flight.do('b', self.slow_read(release))
+        self.assertEqual(2, self.calls)
+
+    def test_leader_fails(self):
+        """Ensure that followers run the read themselves if the leader
+        fails."""
+        release = threading.Event()
+
+        def read():
+            self.calls += 1
+            if self.calls == 1:
+                release.wait(5)
+                raise ValueError('failed')
+            return 'result'
+        threads, results = self.in_threads(
+            3, lambda: self.flight.do('key', read))
+        self.wait_for_followers(2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, sum(isinstance(r, ValueError) for r in results))
+        self.assertEqual(2, results.count('result'))
+        self.assertEqual(2, self.flight.stats()['fallbacks'])
+
+    def test_timeout(self):
+        self.app.config['SINGLE_FLIGHT_TIMEOUT'] = 0.05
+        release = threading.Event()
+        read = self.slow_read(release)
+        threads, _ = self.in_threads(1, lambda: self.flight.do('key', read))
+        for _ in range(500):
+            if self.calls:
+                break
+            time.sleep(0.01)
+        try:
+            self.assertEqual('fast', self.flight.do('key', lambda: 'fast'))
+            self.assertEqual(1, self.flight.stats()['fallbacks'])
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+
+
+class TestSingleFlightAdvisoryLock(BaseTestCase):
+    """Tests for coalescing reads across processes."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['SINGLE_FLIGHT_ENABLED'] = True
+        self.app.config['SINGLE_FLIGHT_ADVISORY_LOCK'] = True
+        self.flight = SingleFlight()
+        # stands in for another process that is running the read
+        self.other = db.engine.connect()
+        self.other.execute('SELECT pg_advisory_lock(%s)',
+                           (SingleFlight.lock_id('key'),))
+
+    def tearDown(self):
+        # the connection goes back to the pool, which would keep the lock
+        self.other.execute('SELECT pg_advisory_unlock_all()')
+        self.other.close()
+        super().tearDown()
+
+    def test_uses_the_result_of_the_other_process(self):
+        cached = []
+        calls = []
+
+        def run():
+            with self.app.app_context():
+                cached.append(self.flight.do(
+                    'key', lambda: calls.append(1),
+                    recheck=lambda: 'cached by the other process'))
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.1)
+        self.assertTrue(thread.is_alive())
+        self.other.execute('SELECT pg_advisory_unlock(%s)',
+                           (SingleFlight.lock_id('key'),))
+        thread.join(5)
+        self.assertEqual(['cached by the other process'], cached)
+        self.assertEqual([], calls)
+
+    def test_lock_timeout(self):
+        """Ensure that the read runs anyway if the lock isn't released."""
+        self.app.config['SINGLE_FLIGHT_TIMEOUT'] = 0.1
+        result = self.flight.do('key', lambda: 'result',
+                                recheck=lambda: 'cached')
+        self.assertEqual('result', result)
+        self.assertEqual(1, self.flight.stats()['fallbacks'])
+
+    def test_without_recheck(self):
+        """Ensure that reads without a recheck don't wait for the lock."""
+        self.app.config['SINGLE_FLIGHT_TIMEOUT'] = 5.0
+        started = time.monotonic()
+        self.assertEqual('result', self.flight.do('key', lambda: 'result'))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(0, self.flight.stats()['fallbacks'])
+
+
+class TestVisibleTransactions(BaseTestCase):
+    """Tests for the keys of reads that must see the latest writes."""
+
+    def test_changes_with_writes(self):
+        before = visible_transactions(db.session)
+        self.assertEqual(before, visible_transactions(db.session))
+        with db.engine.begin() as connection:
+            connection.execute('SELECT txid_current()')
+        self.assertNotEqual(before, visible_transactions(db.session))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# services/flask/project/tests/test_stream.py
+
+import json
+import queue
+import unittest
+from unittest import mock
+
+from sqlalchemy.orm import Session
+
+from project import change_stream, db
+from project.admin import api
+from project.admin.models import Job
+from project.stream import ChangeStream
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_job, add_user
+
+
+class TestChangeStream(BaseTestCase):
+    """Tests for the change notification streams."""
+
+    VALID_USER_DICT1 = {
+        'username': 'testUser1',
+        'email': 'user1@email.com',
+        'password': 'somePassword'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['STREAM_ENABLED'] = True
+        self.app.config['STREAM_HEARTBEAT'] = 0.05
+        self.app.config['STREAM_MAX_AGE'] = 0.2
+        add_user(**self.VALID_USER_DICT1)
+        resp_login = self.client.post(
+            '/admin/login',
+            data=json.dumps({
+                'username': self.VALID_USER_DICT1['username'],
+                'password': self.VALID_USER_DICT1['password']
+            }),
+            content_type='application/json'
+        )
+        self.token = json.loads(resp_login.data.decode())['auth_token']
+
+    def read_events(self, response):
+        """Read the stream until it ends, and return its (event, data)
+        pairs and the number of heartbeats"""
+        events = []
+        heartbeats = 0
+        text = b''.join(response.response).decode()
+        for block in text.split('\n\n'):
+            if block == ': heartbeat':
+                heartbeats += 1
+            elif block:
+                event, data = block.split('\n')
+                events.append((event[len('event: '):],
+                               json.loads(data[len('data: '):])))
+        return events, heartbeats
+
+    def test_stream(self):
+        add_job('Client 1', 'Description 1', 100.5, 'Tyler', 'Tyler',
+                'Confirmed', False, '2018-03-01', '2018-03-02')
+        response = self.client.get(f'/admin/stream?token={self.token}',
+                                   buffered=False)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+        self.assertEqual('no-cache', response.headers['Cache-Control'])
+        change_stream.handle('{"cursor":2,"changes":[["jobs",1,"upsert"]]}')
+        events, heartbeats = self.read_events(response)
+        self.assertEqual([
+            ('sync', {'cursor': 1}),
+            ('change', {'cursor': 2, 'changes': [['jobs', 1, 'upsert']]}),
+        ], events)
+        self.assertGreater(heartbeats, 0)
+        # the stream unsubscribes when it ends
+        self.assertEqual(set(), change_stream._subscribers)
+
+    def test_unsubscribes_if_never_read(self):
+        """Ensure that streams that are closed without being read, like the
+        responses to HEAD requests, unsubscribe."""
+        for method in ('HEAD', 'GET'):
+            response = self.client.open(f'/admin/stream?token={self.token}',
+                                        method=method, buffered=False)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(1, len(change_stream._subscribers))
+            # what the server does when it's done with the response
+            response.close()
+            self.assertEqual(set(), change_stream._subscribers)
+
+    def test_unsubscribes_if_cursor_fails(self):
+        self.app.config['PROPAGATE_EXCEPTIONS'] = False
+        self.app.config['PRESERVE_CONTEXT_ON_EXCEPTION'] = False
+        with mock.patch.object(api, 'current_cursor',
+                               side_effect=RuntimeError('no database')):
+            response = self.client.get(f'/admin/stream?token={self.token}')
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(set(), change_stream._subscribers)
+
+    def test_subscriber_limit(self):
+        """Ensure that streams past the limit are turned away, so that they
+        can't take up every worker thread."""
+        self.app.config['STREAM_MAX_SUBSCRIBERS'] = 1
+        first = self.client.get(f'/admin/stream?token={self.token}',
+                                buffered=False)
+        self.assertEqual(200, first.status_code)
+        response = self.client.get(f'/admin/stream?token={self.token}')
+        self.assertEqual(503, response.status_code)
+        self.assertTrue(response.headers['Retry-After'])
+        self.assertEqual(1, len(change_stream._subscribers))
+        first.close()
+        response = self.client.get(f'/admin/stream?token={self.token}',
+                                   buffered=False)
+        self.assertEqual(200, response.status_code)
+        response.close()
+
+    def test_authorization_header(self):
+        response = self.client.get(
+            '/admin/stream',
+            headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(200, response.status_code)
+
+    def test_requires_token(self):
+        response = self.client.get('/admin/stream')
+        self.assertEqual(401, response.status_code)
+        response = self.client.get('/admin/stream?token=invalid')
+        self.assertEqual(401, response.status_code)
+
+    def test_disabled(self):
+        self.app.config['STREAM_ENABLED'] = False
+        response = self.client.get(f'/admin/stream?token={self.token}')
+        self.assertEqual(404, response.status_code)
+
+    def test_slow_subscriber_drops_oldest(self):
+        self.app.config['STREAM_QUEUE_SIZE'] = 2
+        stream = ChangeStream()
+        subscriber = stream.subscribe(self.app)
+        for cursor in range(1, 4):
+            stream.handle(json.dumps({'cursor': cursor}))
+        self.assertEqual([('change', '{"cursor": 2}'),
+                          ('change', '{"cursor": 3}')],
+                         [subscriber.get_nowait() for _ in range(2)])
+        stream.unsubscribe(subscriber)
+        stream.handle('{"cursor": 4}')
+        self.assertTrue(subscriber.empty())
+
+    def test_committed_changes_are_notified(self):
+        """Ensure that a committed change reaches the listener, and a
+        rolled back one doesn't."""
+        stream = ChangeStream()
+        subscriber = stream.subscribe(self.app)
+        listener = stream.start_listener(self.app)
+        listener.POLL_INTERVAL = 0.05
+        # The test's own transaction is never committed, so this uses a
+        # connection of its own, and deletes what it committed afterwards
+        connection = db.engine.connect()
+        try:
+            self.assertTrue(listener.listening.wait(5))
+            session = Session(bind=connection)
+            session.add(Job('Client 1', 'Description 1', 100.5, 'Tyler',
+                            'Tyler', 'Confirmed', False, '2018-03-01'))
+            session.commit()
+            event, data = subscriber.get(timeout=5)
+            job_id = session.query(Job.id).scalar()
+            self.assertEqual('change', event)
+            self.assertEqual([['jobs', job_id, 'upsert']],
+                             json.loads(data)['changes'])
+
+            session.add(Job('Client 2', 'Description 2', 100.5, 'Tyler',
+                            'Tyler', 'Confirmed', False, '2018-03-01'))
+            session.flush()
+            session.rollback()
+            session.close()
+            with self.assertRaises(queue.Empty):
+                subscriber.get(timeout=0.2)
+        finally:
+            stream.stop_listener()
+            connection.execute('DELETE FROM changes')
+            connection.execute('DELETE FROM jobs')
+            connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()